@@ -1,11 +1,26 @@
 import io
 import re
 import sys
+import threading
 import uuid
 from copy import deepcopy
 
 from PIL import Image, ImageDraw, ImageFilter
-from PyQt6.QtCore import QPoint, QPointF, QRectF, QSize, Qt, pyqtSignal
+from PyQt6.QtCore import (
+    QEvent,
+    QObject,
+    QPoint,
+    QPointF,
+    QRectF,
+    QRunnable,
+    QSettings,
+    QSize,
+    Qt,
+    QThread,
+    QThreadPool,
+    QTimer,
+    pyqtSignal,
+)
 from PyQt6.QtGui import (
     QBrush,
     QColor,
@@ -38,6 +53,7 @@ from PyQt6.QtWidgets import (
     QListWidget,
     QListWidgetItem,
     QMessageBox,
+    QProgressDialog,
     QPushButton,
     QScrollArea,
     QSlider,
@@ -238,300 +254,2830 @@ except ImportError:
     REMBG_AVAILABLE = False
     print("⚠️ rembg não está instalado.")
 
+try:
+    import onnxruntime as ort
 
-class GridOverlay(QGraphicsObject):
-    positionChanged = pyqtSignal(int, int)
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+    print("⚠️ onnxruntime não está instalado.")
 
-    def __init__(self, cell_size=32, rows=1, cols=1, subdivisions=False):
-        super().__init__()
-        self.cell_size = cell_size
-        self.rows = rows
-        self.cols = cols
-        self.subdivisions = subdivisions
-        self.setFlag(QGraphicsObject.GraphicsItemFlag.ItemIsMovable, True)
-        self.setFlag(QGraphicsObject.GraphicsItemFlag.ItemSendsGeometryChanges, True)
-        self.setZValue(10)
 
-    def boundingRect(self):
-        width = self.cols * self.cell_size
-        height = self.rows * self.cell_size
-        return QRectF(0, 0, width, height)
+class LRUCache:
+    """
+    Cache LRU simples com limite de itens e, opcionalmente, de tamanho
+    total (sizeof(valor) em bytes, por exemplo)
+    """
 
-    def paint(self, painter, option, widget):
-        width = self.cols * self.cell_size
-        height = self.rows * self.cell_size
+    def __init__(self, max_items, max_size=None, sizeof=None):
+        from collections import OrderedDict
 
-        pen = QPen(QColor(255, 255, 255), 1, Qt.PenStyle.SolidLine)
-        pen.setCosmetic(True)
-        painter.setPen(pen)
-        painter.drawRect(0, 0, width, height)
+        self.max_items = max_items
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.items = OrderedDict()
 
-        if self.subdivisions or (self.rows > 1 or self.cols > 1):
-            for c in range(1, self.cols):
-                x = c * self.cell_size
-                painter.drawLine(x, 0, x, height)
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        if key in self.items:
+            self.pop(key)
+        self.items[key] = value
+        if self.sizeof:
+            self.size += self.sizeof(value)
+        while len(self.items) > 1 and (
+            len(self.items) > self.max_items
+            or (self.max_size is not None and self.size > self.max_size)
+        ):
+            self.pop(next(iter(self.items)))
+
+    def pop(self, key):
+        value = self.items.pop(key)
+        if self.sizeof:
+            self.size -= self.sizeof(value)
+        return value
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+
+# Modelos Real-ESRGAN (mesma ordem do combo_upscale_model). Os mesmos
+# campos vão para o models.json do registro local.
+UPSCALE_MODELS = [
+    {
+        "name": "RealESRGAN_x4plus",
+        "file": "RealESRGAN_x4plus.pth",
+        "arch": "RRDBNet",
+        "params": dict(num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+        "netscale": 4,
+        "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth",
+    },
+    {
+        "name": "RealESRGAN_x4plus_anime_6B",
+        "file": "RealESRGAN_x4plus_anime_6B.pth",
+        "arch": "RRDBNet",
+        "params": dict(num_feat=64, num_block=6, num_grow_ch=32, scale=4),
+        "netscale": 4,
+        "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth",
+    },
+    {
+        "name": "RealESRGAN_x2plus",
+        "file": "RealESRGAN_x2plus.pth",
+        "arch": "RRDBNet",
+        "params": dict(num_feat=64, num_block=23, num_grow_ch=32, scale=2),
+        "netscale": 2,
+        "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth",
+    },
+]
+
+
+def default_model_dir():
+    """Pasta padrão dos pesos (SPRITE_EDITOR_MODEL_DIR ou ~/.sprite_editor/models)"""
+    import os
+
+    return os.environ.get("SPRITE_EDITOR_MODEL_DIR") or os.path.join(
+        os.path.expanduser("~"), ".sprite_editor", "models"
+    )
+
+
+class ModelRegistry:
+    """
+    Registro local dos pesos: models.json na pasta dos modelos guarda
+    arquivo, SHA-256, tamanho, arquitetura e URL de cada modelo. Nada é
+    baixado sem pedido explícito; o hash é conferido na primeira vez e
+    depois só quando tamanho/mtime do arquivo mudam.
+    """
+
+    MANIFEST = "models.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = self.load_manifest()
+
+    @property
+    def manifest_path(self):
+        import os
+
+        return os.path.join(self.directory, self.MANIFEST)
+
+    def load_manifest(self):
+        import json
+
+        entries = {model["name"]: dict(model) for model in UPSCALE_MODELS}
 
-            for r in range(1, self.rows):
-                y = r * self.cell_size
-                painter.drawLine(0, y, width, y)
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                saved = json.load(f).get("models", {})
+        except (OSError, ValueError):
+            saved = {}
 
-        painter.fillRect(0, 0, width, height, QColor(255, 255, 255, 30))
+        for name, entry in saved.items():
+            entries.setdefault(name, {}).update(entry)
+        return entries
 
-    def itemChange(self, change, value):
-        if change == QGraphicsObject.GraphicsItemChange.ItemPositionChange:
-            new_pos = value
-            self.positionChanged.emit(int(new_pos.x()), int(new_pos.y()))
-        return super().itemChange(change, value)
+    def save_manifest(self):
+        import json
+        import os
 
-    def update_grid(self, rows, cols, subdivisions):
-        self.rows = rows
-        self.cols = cols
-        self.subdivisions = subdivisions
-        self.prepareGeometryChange()
-        self.update()
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"models": self.entries}, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
 
+    def path(self, name):
+        import os
 
-class FineGridOverlay(QGraphicsObject):
-    def __init__(self, image_rect, grid_spacing=4):
-        super().__init__()
-        self.image_rect = image_rect
-        self.grid_spacing = grid_spacing
-        self.setZValue(5)
-        self.visible = False
+        return os.path.join(self.directory, self.entries[name]["file"])
 
-    def boundingRect(self):
-        return self.image_rect.adjusted(-1, -1, 1, 1)
+    @staticmethod
+    def file_sha256(path):
+        import hashlib
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def check(self, name):
+        """Estado do modelo: 'ok', 'missing' ou 'corrupt'"""
+        import os
+
+        entry = self.entries[name]
+        path = self.path(name)
+        if not os.path.isfile(path):
+            return "missing"
+
+        stat = os.stat(path)
+        if entry.get("size") and entry["size"] != stat.st_size:
+            return "corrupt"
+
+        # Hash já conferido para este arquivo: não relê os pesos
+        if entry.get("sha256") and entry.get("mtime") == stat.st_mtime:
+            return "ok"
+
+        sha256 = self.file_sha256(path)
+        if entry.get("sha256") and entry["sha256"] != sha256:
+            return "corrupt"
+
+        entry.update(sha256=sha256, size=stat.st_size, mtime=stat.st_mtime)
+        self.save_manifest()
+        return "ok"
+
+    def status(self):
+        return {name: self.check(name) for name in self.entries}
+
+    def register(self, name, source_path):
+        """Copia um arquivo de pesos para a pasta e registra hash/tamanho"""
+        import os
+        import shutil
+
+        os.makedirs(self.directory, exist_ok=True)
+        target = self.path(name)
+        if os.path.abspath(source_path) != os.path.abspath(target):
+            shutil.copy2(source_path, target)
+
+        for key in ("sha256", "size", "mtime"):
+            self.entries[name].pop(key, None)
+        return self.check(name)
+
+    def download(self, name):
+        """
+        Baixa os pesos da URL do manifest para a pasta e registra. Um
+        arquivo já existente (corrompido, truncado) é apagado antes: o
+        load_file_from_url não baixa por cima de nada.
+        """
+        import os
 
-    def paint(self, painter, option, widget):
-        if not self.visible:
-            return
+        from basicsr.utils.download_util import load_file_from_url
 
-        rect = self.image_rect
+        entry = self.entries[name]
+        if os.path.exists(self.path(name)):
+            os.remove(self.path(name))
 
-        # Grid fino
-        pen = QPen(QColor(255, 255, 255, 40), 1, Qt.PenStyle.SolidLine)
-        pen.setCosmetic(True)
-        painter.setPen(pen)
+        path = load_file_from_url(
+            entry["url"],
+            model_dir=self.directory,
+            progress=False,
+            file_name=entry["file"],
+        )
+        return self.register(name, path)
 
-        # Linhas verticais
-        x = 0
-        while x <= rect.width():
-            painter.drawLine(int(x), 0, int(x), int(rect.height()))
-            x += self.grid_spacing
+    def onnx_path(self, name):
+        import os
 
-        # Linhas horizontais
-        y = 0
-        while y <= rect.height():
-            painter.drawLine(0, int(y), int(rect.width()), int(y))
-            y += self.grid_spacing
+        return os.path.splitext(self.path(name))[0] + ".onnx"
 
-        # Borda da imagem em vermelho
-        border_pen = QPen(QColor(255, 100, 100, 200), 3, Qt.PenStyle.SolidLine)
-        border_pen.setCosmetic(True)
-        painter.setPen(border_pen)
-        painter.drawRect(rect)
+    def check_onnx(self, name):
+        """
+        Estado do .onnx ('ok', 'missing' ou 'corrupt'), conferido como o
+        .pth em check(): o hash gravado na exportação (ou na primeira vez,
+        para um .onnx copiado) só é relido quando tamanho/mtime mudam
+        """
+        import os
 
-    def set_visible(self, visible):
-        self.visible = visible
-        self.update()
+        entry = self.entries[name]
+        path = self.onnx_path(name)
+        if not os.path.isfile(path):
+            return "missing"
 
-    def update_rect(self, new_rect):
-        self.prepareGeometryChange()
-        self.image_rect = new_rect
-        self.update()
+        stat = os.stat(path)
+        if entry.get("onnx_size") and entry["onnx_size"] != stat.st_size:
+            return "corrupt"
+        if entry.get("onnx_sha256") and entry.get("onnx_mtime") == stat.st_mtime:
+            return "ok"
 
-    def set_spacing(self, spacing):
-        self.grid_spacing = spacing
-        self.update()
+        sha256 = self.file_sha256(path)
+        if entry.get("onnx_sha256") and entry["onnx_sha256"] != sha256:
+            return "corrupt"
 
+        entry.update(
+            onnx_sha256=sha256, onnx_size=stat.st_size, onnx_mtime=stat.st_mtime
+        )
+        self.save_manifest()
+        return "ok"
 
-class SelectionRectangle(QGraphicsRectItem):
-    def __init__(self):
-        super().__init__()
-        self.setFlag(
-            QGraphicsRectItem.GraphicsItemFlag.ItemIsMovable, False
-        )  # Desabilitado por padrão
-        self.setFlag(QGraphicsRectItem.GraphicsItemFlag.ItemSendsGeometryChanges, True)
-        self.setFlag(QGraphicsRectItem.GraphicsItemFlag.ItemIsSelectable, True)
-        self.setZValue(15)
+    def ensure_onnx(self, name):
+        """
+        Caminho do modelo ONNX conferido; exporta do .pth (uma vez) se
+        ainda não existir ou se estiver corrompido. Um .onnx copiado para
+        a pasta roda sem PyTorch instalado.
+        """
+        import os
 
-        pen = QPen(QColor(0, 150, 255), 2, Qt.PenStyle.DashLine)
-        pen.setCosmetic(True)
-        self.setPen(pen)
-        self.setBrush(QBrush(QColor(0, 150, 255, 30)))
+        path = self.onnx_path(name)
+        state = self.check_onnx(name)
+        if state == "ok":
+            return path
 
-        self.setAcceptHoverEvents(True)
+        if state == "corrupt" and not REALESRGAN_AVAILABLE:
+            raise FileNotFoundError(
+                f"{os.path.basename(path)} corrompido em {self.directory}.\n"
+                f"Substitua o arquivo (reexportar do .pth requer PyTorch)."
+            )
 
-        # Armazena a imagem selecionada como um pixmap item
-        self.selected_pixmap_item = None
-        self.original_rect = None
+        if not REALESRGAN_AVAILABLE:
+            raise FileNotFoundError(
+                f"{os.path.basename(path)} não encontrado em {self.directory}.\n"
+                f"Exportar do .pth requer PyTorch/Real-ESRGAN."
+            )
 
-    def set_rect(self, rect):
-        """Define o retângulo de seleção"""
-        self.setRect(rect)
-        self.original_rect = rect
+        entry = self.entries[name]
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, **entry["params"])
+        model.load_state_dict(self.load_state_dict(name), strict=True)
+        model.eval()
+
+        # Altura/largura dinâmicas: o mesmo arquivo serve para qualquer tile
+        temp_path = path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                torch.zeros(1, 3, 64, 64),
+                temp_path,
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes={
+                    "input": {2: "height", 3: "width"},
+                    "output": {2: "height", 3: "width"},
+                },
+                opset_version=17,
+            )
+        os.replace(temp_path, path)
 
-    def hoverEnterEvent(self, event):
-        self.setCursor(Qt.CursorShape.SizeAllCursor)
-        super().hoverEnterEvent(event)
+        stat = os.stat(path)
+        entry.update(
+            onnx_sha256=self.file_sha256(path),
+            onnx_size=stat.st_size,
+            onnx_mtime=stat.st_mtime,
+        )
+        self.save_manifest()
+        return path
+
+    def verified_path(self, name):
+        """Caminho dos pesos conferidos; FileNotFoundError se faltam ou mudaram"""
+        state = self.check(name)
+        if state != "ok":
+            problem = "não encontrado" if state == "missing" else "corrompido"
+            raise FileNotFoundError(
+                f"Modelo {name} {problem} em {self.directory}.\n"
+                f"Use Import Model ou Download Missing na aba Upscale."
+            )
+        return self.path(name)
 
-    def hoverLeaveEvent(self, event):
-        """Restaura o cursor ao sair da seleção"""
-        self.setCursor(Qt.CursorShape.ArrowCursor)
-        super().hoverLeaveEvent(event)
+    def load_state_dict(self, name):
+        """Carrega os pesos do disco, com mmap quando o torch suporta"""
+        path = self.verified_path(name)
+        try:
+            loadnet = torch.load(
+                path, map_location="cpu", mmap=True, weights_only=True
+            )
+        except (TypeError, RuntimeError):
+            # torch antigo ou checkpoint fora do formato zip
+            loadnet = torch.load(path, map_location="cpu")
 
-    def mousePressEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.setCursor(Qt.CursorShape.ClosedHandCursor)
-        super().mousePressEvent(event)
+        return loadnet["params_ema"] if "params_ema" in loadnet else loadnet["params"]
 
-    def mouseReleaseEvent(self, event):
-        """Restaura o cursor após arrastar"""
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.setCursor(Qt.CursorShape.SizeAllCursor)
-        super().mouseReleaseEvent(event)
 
+MODEL_REGISTRY = ModelRegistry(default_model_dir())
 
-class ZoomableGraphicsView(QGraphicsView):
-    def __init__(self, scene, parent=None):
-        super().__init__(scene, parent)
-        self.setTransformationAnchor(QGraphicsView.ViewportAnchor.NoAnchor)
-        self.zoom_factor = 1.0
 
-    def wheelEvent(self, event: QWheelEvent):
-        modifiers = QApplication.keyboardModifiers()
+def set_model_directory(directory):
+    """Troca a pasta do registro de modelos (e descarta upsamplers carregados)"""
+    global MODEL_REGISTRY
 
-        if modifiers == Qt.KeyboardModifier.ControlModifier:
-            zoom_in_factor = 1.15
-            zoom_out_factor = 1 / zoom_in_factor
+    MODEL_REGISTRY = ModelRegistry(directory)
+    UPSAMPLER_CACHE.clear()
 
-            old_pos = self.mapToScene(event.position().toPoint())
+# Upsamplers carregados ficam em memória entre os cliques
+UPSAMPLER_CACHE = LRUCache(max_items=2)
 
-            if event.angleDelta().y() > 0:
-                factor = zoom_in_factor
-                self.zoom_factor *= zoom_in_factor
-            else:
-                factor = zoom_out_factor
-                self.zoom_factor *= zoom_out_factor
+# Serializa o carregamento de modelos: se um job pedir o modelo que o
+# aquecimento em segundo plano está carregando, espera e reaproveita
+MODEL_LOAD_LOCK = threading.RLock()
 
-            if 0.1 <= self.zoom_factor <= 5.0:
-                self.scale(factor, factor)
 
-                new_pos = self.mapToScene(event.position().toPoint())
-                delta = new_pos - old_pos
-                self.translate(delta.x(), delta.y())
+def build_upsampler(name, netscale, device, half=False, tile_pad=10):
+    """
+    Monta o RealESRGANer pelo construtor público, com o modelo da
+    arquitetura do registro e o .pth já conferido (hash) por ele
+    """
+    registered = MODEL_REGISTRY.entries[name]
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, **registered["params"])
+    return RealESRGANer(
+        scale=netscale,
+        model_path=MODEL_REGISTRY.verified_path(name),
+        model=model,
+        tile=0,
+        tile_pad=tile_pad,
+        pre_pad=0,
+        half=half,
+        device=torch.device(device),
+    )
 
-                if hasattr(self.parent(), "update_zoom_label"):
-                    self.parent().update_zoom_label(int(self.zoom_factor * 100))
-            else:
-                self.zoom_factor /= factor
 
-            event.accept()
-        else:
-            super().wheelEvent(event)
+UPSCALE_BACKENDS = ["PyTorch", "ONNX Runtime (CPU)"]
+ONNX_OPTIMIZATION_LEVELS = ["All", "Extended", "Basic", "Disabled"]
 
 
-class SliceWindow(QWidget):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Sprite Editor - Made by Sherrat")
-        self.resize(900, 600)
+class OnnxUpsampler:
+    """
+    Roda o modelo exportado para ONNX no onnxruntime (CPU), com a mesma
+    interface de enhance() do RealESRGANer.
+    """
 
-        self.setWindowIcon(QIcon("editor.ico"))
+    def __init__(self, path, netscale, threads=0, optimization="All", tile_pad=10):
+        levels = {
+            "All": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+            "Extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "Basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "Disabled": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        }
 
-        self.setStyleSheet("background-color: #494949; color: white;")
-        self.original_image_pil = None
-        self.current_image_pil = None
-        self.sliced_images = []
-        self.cell_size = 32
-        self.color_picker_mode = False
-        self.paint_color_picker_mode = False
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = levels[optimization]
 
-        # Eraser tool
-        self.eraser_mode = False
-        self.eraser_size = 10
-        self.eraser_feathering = 0  # NOVA VARIÁVEL
-        self.last_eraser_point = None
-        
-        self.cut_size_mode = False
-        self.rotate_fine_angle = 0        
-        self.cut_rect_item = None
-        self.is_drawing_cut_rect = False
-        self.cut_start_pos = None        
+        self.session = ort.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        self.scale = netscale
+        self.tile_pad = tile_pad
+
+    def enhance(self, img, outscale=None):
+        import cv2
+        import numpy as np
+
+        h, w = img.shape[:2]
+
+        # O modelo x2 usa pixel unshuffle: precisa de dimensões pares
+        mod = 2 if self.scale == 2 else 1
+        rgb = img[:, :, ::-1]
+        if h % mod or w % mod:
+            padding = ((0, (-h) % mod), (0, (-w) % mod), (0, 0))
+            rgb = np.pad(rgb, padding, mode="edge")
+
+        x = rgb.transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+        y = self.session.run(None, {self.input_name: x})[0][0]
+        y = y[:, : h * self.scale, : w * self.scale]
+
+        out = np.clip(y.transpose(1, 2, 0)[:, :, ::-1] * 255.0, 0, 255)
+        out = np.ascontiguousarray(out.round().astype(np.uint8))
+
+        if outscale and outscale != self.scale:
+            out = cv2.resize(
+                out,
+                (int(w * outscale), int(h * outscale)),
+                interpolation=cv2.INTER_LANCZOS4,
+            )
+        return out, "RGB"
+
+
+# Perfil de CPU padrão do backend PyTorch
+DEFAULT_CPU_PROFILE = {
+    "threads": 0,
+    "inference_mode": True,
+    "channels_last": False,
+    "precision": "fp32",
+}
+CPU_PRECISIONS = ["fp32", "bf16"]
+
+
+# Threads do torch antes de qualquer perfil (o "Auto" do perfil)
+TORCH_DEFAULT_THREADS = torch.get_num_threads() if REALESRGAN_AVAILABLE else 0
+
+
+def set_torch_threads(threads):
+    """
+    Aplica o número de threads do perfil (0 = padrão do torch). O
+    torch.set_num_threads vale para o processo todo, então só é chamado
+    na thread da interface quando o perfil muda, nunca dentro dos jobs.
+    """
+    torch.set_num_threads(threads if threads > 0 else TORCH_DEFAULT_THREADS)
+
+
+class ChannelsLastModel:
+    """
+    Modelo com pesos em channels_last que também recebe a entrada nesse
+    layout (o RealESRGANer monta o tensor NCHW contíguo)
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+class ProfiledUpsampler:
+    """
+    Envolve o RealESRGANer aplicando o perfil de CPU em cada enhance():
+    inference_mode e autocast bf16. As threads são globais e ficam com
+    set_torch_threads.
+    """
+
+    def __init__(self, upsampler, profile):
+        self.upsampler = upsampler
+        self.profile = profile
+        self.scale = upsampler.scale
+        self.tile_pad = upsampler.tile_pad
+
+    def enhance(self, img, outscale=None):
+        import contextlib
+
+        with contextlib.ExitStack() as stack:
+            if self.profile.get("inference_mode", True):
+                stack.enter_context(torch.inference_mode())
+            if self.profile.get("precision") == "bf16":
+                stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+            return self.upsampler.enhance(img, outscale=outscale)
+
+
+def get_upsampler(model_idx, device, half=False, backend="torch", options=None):
+    """
+    Retorna o upsampler do modelo, carregando os pesos do registro local
+    só na primeira vez. A chave é (modelo, escala da rede, device,
+    precisão, channels-last) no PyTorch e (modelo, escala, threads,
+    otimização) no onnxruntime; a escala final é passada em cada
+    enhance(). Na CPU, options é o perfil (ver DEFAULT_CPU_PROFILE).
+    """
+    with MODEL_LOAD_LOCK:
+        entry = UPSCALE_MODELS[model_idx]
+
+        if backend == "onnx":
+            options = options or {}
+            threads = options.get("threads", 0)
+            optimization = options.get("optimization", "All")
+            key = (model_idx, entry["netscale"], "onnx", threads, optimization)
+
+            upsampler = UPSAMPLER_CACHE.get(key)
+            if upsampler is None:
+                path = MODEL_REGISTRY.ensure_onnx(entry["name"])
+                upsampler = OnnxUpsampler(
+                    path, entry["netscale"], threads, optimization
+                )
+                UPSAMPLER_CACHE.put(key, upsampler)
+            return upsampler
+
+        profile = dict(DEFAULT_CPU_PROFILE, **(options or {}))
+        channels_last = device == "cpu" and profile["channels_last"]
+        key = (
+            model_idx,
+            entry["netscale"],
+            device,
+            "fp16" if half else "fp32",
+            channels_last,
+        )
 
-        self.paint_mode = False
-        self.paint_size = 5
-        self.paint_color = QColor(0, 0, 0, 255)
-        self.last_paint_point = None
-        self.paint_feathering = 0
+        upsampler = UPSAMPLER_CACHE.get(key)
+        if upsampler is None:
+            upsampler = build_upsampler(entry["name"], entry["netscale"], device, half)
+            if channels_last:
+                upsampler.model = ChannelsLastModel(
+                    upsampler.model.to(memory_format=torch.channels_last)
+                )
+            UPSAMPLER_CACHE.put(key, upsampler)
 
-        self.brush_type = "Circle"
-        self.spray_density = 0.3  # 0–1, fração de pontos pintados no círculo
-        self.texture_brush_image = None  # PIL.Image para textura do pincel
+        if device == "cpu":
+            return ProfiledUpsampler(upsampler, profile)
+        return upsampler
 
-        self.outline_color = QColor(0, 0, 0, 255)  # Preto por padrão
 
-        self.selection_mode = False
-        self.selection_start = None
-        self.selection_rect_item = None
-        self.is_drawing_selection = False
-        self.selected_image_data = None
+def available_memory(device="cpu"):
+    """Memória livre em bytes (GPU ou RAM); None se não der para saber"""
+    if device == "cuda" and REALESRGAN_AVAILABLE:
+        try:
+            free, _ = torch.cuda.mem_get_info()
+            return free
+        except Exception:
+            return None
 
-        self.is_moving_selection = False
-        self.move_start_pos = None
-        self.selection_image_backup = None  # Backup da área original
-        self.floating_selection_pixmap = None
+    try:
+        import psutil
 
-        # Fine Grid
-        self.fine_grid_item = None
-        self.fine_grid_enabled = False
-        self.fine_grid_spacing = 32
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
 
-        # === LAYERS SYSTEM ===
-        self.layers = []  # Lista de Layer objects
-        self.active_layer_id = None  # ID do layer ativo
-        self.layer_widgets = {}  # Mapeamento de ID -> LayerWidget
-        self.layer_graphics_items = {}  # Mapeamento de ID -> DraggableLayerItem
-        self.is_dragging_layer = False
-        self.layer_drag_start = None
+    try:
+        import os
 
-        self.undo_stack = []
-        self.redo_stack = []
-        self.max_undo_steps = 20
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
 
-        self.init_ui()
 
-    def init_ui(self):
-        main_layout = QVBoxLayout(self)
-        main_layout.setContentsMargins(0, 0, 0, 0)
-        main_layout.setSpacing(0)
+def auto_tile_size(width, height, netscale, device="cpu", tile_pad=10):
+    """
+    Escolhe o tamanho do tile pelo pico de memória estimado do RRDBNet
+    (features de 64 canais em float32, inclusive nas etapas ampliadas).
+    Retorna 0 quando a imagem inteira cabe no orçamento.
+    """
+    memory = available_memory(device) or 2 * 1024**3
+    budget = memory * 0.5
 
-        toolbar = QFrame()
-        toolbar.setFixedHeight(40)
-        toolbar.setStyleSheet("background-color: #333; border-bottom: 1px solid #222;")
-        tb_layout = QHBoxLayout(toolbar)
-        tb_layout.setContentsMargins(10, 5, 10, 5)
+    bytes_per_pixel = 4 * 64 * (8 + 3 * netscale * netscale)
+    side = int((budget / bytes_per_pixel) ** 0.5) - 2 * tile_pad
+    side = max(64, min(1024, side // 32 * 32))
 
-        btn_open = QPushButton("Open Image")
-        btn_open.setStyleSheet("background-color: #555; padding: 5px;")
-        btn_open.clicked.connect(self.open_image)
-        tb_layout.addWidget(btn_open)
+    if width <= side and height <= side:
+        return 0
+    return side
 
-        # Novo botão: Export Project (exporta a imagem atual inteira, sem slices)
-        btn_export_project = QPushButton("Export Project")
-        btn_export_project.setStyleSheet(
-            "background-color: #28a745; padding: 5px; font-weight: bold;"
-        )
-        btn_export_project.clicked.connect(self.export_full_project)
-        tb_layout.addWidget(btn_export_project)
 
-        tb_layout.addStretch()
+def content_mask(alpha, margin):
+    """
+    Pixels visíveis (alpha > 0) dilatados por margin px, ou None se a
+    imagem for toda opaca. Tiles sem nada nessa máscara podem ser pulados.
+    """
+    import cv2
+    import numpy as np
 
-        btn_rot_r = QPushButton("Rot 90°")
-        btn_rot_r.clicked.connect(lambda: self.transform_image("rotate_90"))
-        tb_layout.addWidget(btn_rot_r)
+    if alpha.min() == 255:
+        return None
 
-        btn_flip_h = QPushButton("Flip H")
+    mask = (alpha > 0).astype(np.uint8)
+    if margin > 0:
+        kernel = np.ones((2 * margin + 1, 2 * margin + 1), np.uint8)
+        mask = cv2.dilate(mask, kernel)
+    return mask.astype(bool)
+
+
+def tile_occupancy(mask, tile):
+    """Grade (linhas, colunas) dizendo quais tiles têm conteúdo"""
+    import numpy as np
+
+    h, w = mask.shape
+    padded = np.pad(mask, ((0, (-h) % tile), (0, (-w) % tile)))
+    rows, cols = padded.shape[0] // tile, padded.shape[1] // tile
+    return padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+
+def choose_sparse_tile(mask, max_tile, tile_pad=10):
+    """
+    Tile que minimiza os pixels enviados ao modelo (tiles com conteúdo
+    vezes a área com padding) em sheets com muito fundo transparente.
+    """
+    candidates = sorted({t for t in range(64, max_tile, 32)} | {max_tile})
+
+    best, best_cost = max_tile, None
+    for tile in candidates:
+        cost = int(tile_occupancy(mask, tile).sum()) * (tile + 2 * tile_pad) ** 2
+        if best_cost is None or cost <= best_cost:
+            best, best_cost = tile, cost
+    return best
+
+
+def upscale_tiled(
+    upsampler,
+    bgr,
+    netscale,
+    tile,
+    tile_pad=10,
+    progress=None,
+    cancelled=None,
+    mask=None,
+):
+    """
+    Passa a imagem pelo upsampler em tiles de tile px (mais tile_pad de
+    contexto) e grava cada saída direto no buffer uint8 pré-alocado, na
+    escala da rede. Com tile 0 processa a imagem inteira. Tiles sem
+    conteúdo na mask (ver content_mask) ficam zerados sem passar pelo
+    modelo. Retorna None se cancelado entre tiles.
+    """
+    import numpy as np
+
+    h, w = bgr.shape[:2]
+    if tile <= 0:
+        tile = max(w, h)
+
+    tiles = [
+        (x, y, min(x + tile, w), min(y + tile, h))
+        for y in range(0, h, tile)
+        for x in range(0, w, tile)
+    ]
+    if mask is not None:
+        tiles = [t for t in tiles if mask[t[1] : t[3], t[0] : t[2]].any()]
+
+    out = np.zeros((h * netscale, w * netscale, 3), np.uint8)
+
+    for done, (x0, y0, x1, y1) in enumerate(tiles, 1):
+        if cancelled and cancelled():
+            return None
+
+        px0, py0 = max(0, x0 - tile_pad), max(0, y0 - tile_pad)
+        px1, py1 = min(w, x1 + tile_pad), min(h, y1 + tile_pad)
+
+        result, _ = upsampler.enhance(
+            np.ascontiguousarray(bgr[py0:py1, px0:px1]), outscale=netscale
+        )
+
+        ox, oy = (x0 - px0) * netscale, (y0 - py0) * netscale
+        out[y0 * netscale : y1 * netscale, x0 * netscale : x1 * netscale] = result[
+            oy : oy + (y1 - y0) * netscale, ox : ox + (x1 - x0) * netscale
+        ]
+
+        if progress:
+            progress(done, len(tiles))
+
+    return out
+
+
+# Upscalers de pixel art (NumPy puro), depois dos modelos no combo
+PIXEL_ART_UPSCALERS = ["scale2x", "xbr"]
+
+
+def pack_rgba_pixels(rgba):
+    """Cada pixel RGBA como um uint32 (transparentes viram 0) para comparar cores"""
+    import numpy as np
+
+    rgba = np.array(rgba, np.uint8)
+    rgba[rgba[..., 3] == 0] = 0
+    return rgba.view(np.uint32)[..., 0]
+
+
+def unpack_rgba_pixels(packed):
+    h, w = packed.shape
+    return packed.view("uint8").reshape(h, w, 4)
+
+
+def pixel_neighbors(array, radius=1):
+    """at(dy, dx) devolve o array deslocado (bordas repetidas)"""
+    import numpy as np
+
+    h, w = array.shape[:2]
+    pad = ((radius, radius), (radius, radius)) + ((0, 0),) * (array.ndim - 2)
+    padded = np.pad(array, pad, mode="edge")
+
+    def at(dy, dx):
+        return padded[radius + dy : radius + dy + h, radius + dx : radius + dx + w]
+
+    return at
+
+
+def scale2x(rgba):
+    """Scale2x / EPX: cada pixel vira 2x2 seguindo as bordas dos vizinhos"""
+    import numpy as np
+
+    E = pack_rgba_pixels(rgba)
+    at = pixel_neighbors(E)
+    B, D, F, H = at(-1, 0), at(0, -1), at(0, 1), at(1, 0)
+
+    h, w = E.shape
+    out = np.empty((h, 2, w, 2), np.uint32)
+    out[:, 0, :, 0] = np.where((D == B) & (B != F) & (D != H), D, E)
+    out[:, 0, :, 1] = np.where((B == F) & (B != D) & (F != H), F, E)
+    out[:, 1, :, 0] = np.where((D == H) & (D != B) & (H != F), D, E)
+    out[:, 1, :, 1] = np.where((H == F) & (D != H) & (B != F), F, E)
+    return unpack_rgba_pixels(out.reshape(h * 2, w * 2))
+
+
+def scale3x(rgba):
+    """Scale3x (AdvMAME3x): cada pixel vira 3x3"""
+    import numpy as np
+
+    E = pack_rgba_pixels(rgba)
+    at = pixel_neighbors(E)
+    A, B, C = at(-1, -1), at(-1, 0), at(-1, 1)
+    D, F = at(0, -1), at(0, 1)
+    G, H, I = at(1, -1), at(1, 0), at(1, 1)
+
+    db = (D == B) & (B != F) & (D != H)
+    bf = (B == F) & (B != D) & (F != H)
+    dh = (D == H) & (D != B) & (H != F)
+    hf = (H == F) & (D != H) & (B != F)
+
+    h, w = E.shape
+    out = np.empty((h, 3, w, 3), np.uint32)
+    out[:, 0, :, 0] = np.where(db, D, E)
+    out[:, 0, :, 1] = np.where((db & (E != C)) | (bf & (E != A)), B, E)
+    out[:, 0, :, 2] = np.where(bf, F, E)
+    out[:, 1, :, 0] = np.where((db & (E != G)) | (dh & (E != A)), D, E)
+    out[:, 1, :, 1] = E
+    out[:, 1, :, 2] = np.where((bf & (E != I)) | (hf & (E != C)), F, E)
+    out[:, 2, :, 0] = np.where(dh, D, E)
+    out[:, 2, :, 1] = np.where((dh & (E != I)) | (hf & (E != G)), H, E)
+    out[:, 2, :, 2] = np.where(hf, F, E)
+    return unpack_rgba_pixels(out.reshape(h * 3, w * 3))
+
+
+def xbr_upscale(rgba, scale):
+    """
+    Upscale estilo xBR (regra de nível 1) em qualquer escala inteira:
+    em cada canto do pixel, se a diferença de cor (YUV + alpha) indica
+    uma borda diagonal, o triângulo do canto recebe a cor do vizinho,
+    misturada em alpha pré-multiplicado.
+    """
+    import numpy as np
+
+    h, w = rgba.shape[:2]
+    packed = pack_rgba_pixels(rgba)
+
+    color = rgba.astype(np.float32)
+    alpha = color[..., 3:] / 255.0
+    premul = np.concatenate([color[..., :3] * alpha, color[..., 3:]], axis=2)
+
+    # Distância do xBR: 48*Y + 7*U + 6*V, mais o alpha com o peso do Y
+    r, g, b = color[..., 0], color[..., 1], color[..., 2]
+    features = np.stack(
+        [
+            48 * (0.299 * r + 0.587 * g + 0.114 * b),
+            7 * (-0.169 * r - 0.331 * g + 0.5 * b),
+            6 * (0.5 * r - 0.419 * g - 0.081 * b),
+            48 * color[..., 3],
+        ],
+        axis=2,
+    )
+
+    at_f = pixel_neighbors(features, 2)
+    at_p = pixel_neighbors(packed, 2)
+    at_c = pixel_neighbors(premul, 2)
+
+    # Coordenadas do centro de cada subpixel dentro do pixel (0-1)
+    centers = (np.arange(scale) + 0.5) / scale
+    out = np.repeat(np.repeat(premul, scale, axis=0), scale, axis=1)
+    out = out.reshape(h, scale, w, scale, 4)
+
+    def dist(a, b):
+        return np.abs(a - b).sum(axis=2)
+
+    for sy in (1, -1):
+        for sx in (1, -1):
+            # Vizinhos espelhados para o canto (sy, sx); a regra é simétrica
+            def f(dy, dx):
+                return at_f(dy * sy, dx * sx)
+
+            E, F, H, I = f(0, 0), f(0, 1), f(1, 0), f(1, 1)
+            B, C, D, G = f(-1, 0), f(-1, 1), f(0, -1), f(1, -1)
+            F4, H5, I4, I5 = f(0, 2), f(2, 0), f(1, 2), f(2, 1)
+
+            e = dist(E, C) + dist(E, G) + dist(I, F4) + dist(I, H5) + 4 * dist(H, F)
+            i = dist(H, D) + dist(H, I5) + dist(F, I4) + dist(F, B) + 4 * dist(E, I)
+
+            pe = at_p(0, 0)
+            edge = (e < i) & (pe != at_p(0, sx)) & (pe != at_p(sy, 0))
+            if not edge.any():
+                continue
+
+            # Cor do vizinho (F ou H) mais parecido com E
+            use_f = dist(E, F) <= dist(E, H)
+            neighbor = np.where(use_f[..., None], at_c(0, sx), at_c(sy, 0))
+
+            u = centers if sx == 1 else 1 - centers
+            v = centers if sy == 1 else 1 - centers
+            coverage = np.clip((v[:, None] + u[None, :] - 1.5) * scale + 0.5, 0, 1)
+
+            for row, col in zip(*np.nonzero(coverage)):
+                weight = coverage[row, col] * edge[..., None]
+                sub = out[:, row, :, col]
+                out[:, row, :, col] = sub + (neighbor - sub) * weight
+
+    out = out.reshape(h * scale, w * scale, 4)
+    alpha = out[..., 3:] / 255.0
+    rgb = np.where(alpha > 0, out[..., :3] / np.maximum(alpha, 1e-6), 0)
+    result = np.concatenate([rgb, out[..., 3:]], axis=2)
+    return np.clip(result.round(), 0, 255).astype(np.uint8)
+
+
+def pixel_art_upscale(image, method, scale):
+    """Upscale de pixel art (Scale2x/Scale3x ou xBR), respeitando o alpha"""
+    import numpy as np
+
+    rgba = np.asarray(image.convert("RGBA"))
+
+    if method == "scale2x":
+        if scale == 3:
+            out = scale3x(rgba)
+        else:
+            out = rgba
+            while out.shape[0] < rgba.shape[0] * scale:
+                out = scale2x(out)
+    else:
+        out = xbr_upscale(rgba, scale)
+
+    return Image.fromarray(np.ascontiguousarray(out), "RGBA")
+
+
+def ai_upscale_image(
+    source,
+    model_idx,
+    scale,
+    device,
+    tile=0,
+    keep_size=False,
+    progress=None,
+    cancelled=None,
+    backend="torch",
+    options=None,
+):
+    """
+    Upscale Real-ESRGAN de uma imagem RGBA (alpha ampliado com LANCZOS).
+    Com keep_size volta para a resolução original. Tile 0 = automático.
+    Retorna a nova imagem ou None se cancelado.
+    """
+    import cv2
+    import numpy as np
+
+    if model_idx >= len(UPSCALE_MODELS):
+        # Pixel art: sem modelo, direto na CPU
+        method = PIXEL_ART_UPSCALERS[model_idx - len(UPSCALE_MODELS)]
+        upscaled_image = pixel_art_upscale(source, method, scale)
+        if keep_size:
+            upscaled_image = upscaled_image.resize(source.size, Image.LANCZOS)
+        return upscaled_image
+
+    # Upsampler vem do cache; só a primeira vez lê os pesos
+    upsampler = get_upsampler(model_idx, device, backend=backend, options=options)
+    netscale = UPSCALE_MODELS[model_idx]["netscale"]
+
+    # Converter PIL para numpy array (BGR para OpenCV)
+    img_bgr = cv2.cvtColor(np.array(source.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+    # Só tiles com pixels visíveis (até tile_pad de distância) vão para o
+    # modelo; o resto já sai transparente
+    mask = None
+    if source.mode == "RGBA":
+        mask = content_mask(np.asarray(source.getchannel("A")), upsampler.tile_pad)
+
+    # Tiles limitados pela memória livre (ou o valor manual)
+    if not tile:
+        tile = auto_tile_size(source.width, source.height, netscale, device)
+        if mask is not None:
+            max_tile = tile or max(source.width, source.height)
+            tile = choose_sparse_tile(mask, max_tile, upsampler.tile_pad)
+
+    output = upscale_tiled(
+        upsampler,
+        img_bgr,
+        netscale,
+        tile,
+        upsampler.tile_pad,
+        progress,
+        cancelled,
+        mask,
+    )
+    if output is None:
+        return None
+
+    if scale != netscale:
+        output = cv2.resize(
+            output,
+            (source.width * scale, source.height * scale),
+            interpolation=cv2.INTER_LANCZOS4,
+        )
+
+    # Converter de volta para PIL (BGR -> RGB)
+    upscaled_image = Image.fromarray(cv2.cvtColor(output, cv2.COLOR_BGR2RGB))
+
+    # Se tinha transparência, processar canal alpha
+    if source.mode == "RGBA":
+        alpha = source.split()[-1]
+        alpha_upscaled = alpha.resize(
+            (upscaled_image.width, upscaled_image.height), Image.LANCZOS
+        )
+        upscaled_image = upscaled_image.convert("RGBA")
+        upscaled_image.putalpha(alpha_upscaled)
+
+    if keep_size:
+        # Usar LANCZOS para melhor qualidade no downscale
+        upscaled_image = upscaled_image.resize(source.size, Image.LANCZOS)
+
+    return upscaled_image
+
+
+def visible_mask(image):
+    """
+    Máscara booleana dos pixels visíveis, com o mesmo critério do
+    getbbox(): alfa nos modos com transparência e qualquer canal
+    diferente de zero nos outros (índice 0 no modo P)
+    """
+    import numpy as np
+
+    if "A" in image.getbands():
+        return np.asarray(image.getchannel("A")) > 0
+
+    data = np.asarray(image)
+    if data.ndim == 3:
+        return data.any(axis=2)
+    return data != 0
+
+
+def grid_cell_mask(
+    image, start_x, start_y, cell_size, rows, cols, skip_empty=True, spacing=(0, 0)
+):
+    """
+    Máscara (rows, cols) das células da grade que cabem inteiras na imagem
+    e, com skip_empty, têm algum pixel visível (ver visible_mask).
+    cell_size e spacing são (largura, altura). Tudo de uma vez: a região
+    da grade vira blocos (rows, passo, cols, passo) e a parte de cada
+    bloco que é célula (sem o espaçamento) é reduzida com any().
+    """
+    import numpy as np
+
+    cell_w, cell_h = cell_size
+    pitch_w, pitch_h = cell_w + spacing[0], cell_h + spacing[1]
+
+    mask = np.zeros((rows, cols), bool)
+    fit_cols = max(0, min(cols, (image.width - start_x + spacing[0]) // pitch_w))
+    fit_rows = max(0, min(rows, (image.height - start_y + spacing[1]) // pitch_h))
+    if not fit_cols or not fit_rows:
+        return mask
+
+    if not skip_empty:
+        mask[:fit_rows, :fit_cols] = True
+        return mask
+
+    # A última célula não tem espaçamento depois: completa com vazio
+    region = image.crop(
+        (start_x, start_y, start_x + fit_cols * pitch_w, start_y + fit_rows * pitch_h)
+    )
+    blocks = visible_mask(region).reshape(fit_rows, pitch_h, fit_cols, pitch_w)
+    mask[:fit_rows, :fit_cols] = blocks[:, :cell_h, :, :cell_w].any(axis=(1, 3))
+    return mask
+
+
+def detect_sprites(image, merge_distance=0, min_area=1):
+    """
+    Encontra os sprites de uma folha empacotada sem grade: componentes
+    conexos (8-vizinhança) dos pixels visíveis. Partes separadas por até
+    merge_distance pixels vazios viram um sprite só (a máscara é dilatada
+    antes da rotulação); componentes com menos de min_area pixels visíveis
+    são descartados. Retorna (rects, labels, ids): retângulos justos
+    (x, y, w, h) em ordem de leitura, o mapa de rótulos e o rótulo de
+    cada retângulo.
+    """
+    import cv2
+    import numpy as np
+
+    mask = visible_mask(image)
+    mask_u8 = mask.astype(np.uint8)
+
+    radius = (merge_distance + 1) // 2
+    if radius:
+        kernel = np.ones((2 * radius + 1, 2 * radius + 1), np.uint8)
+        mask_u8 = cv2.dilate(mask_u8, kernel)
+
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(
+        mask_u8, connectivity=8, ltype=cv2.CV_32S
+    )
+
+    if radius:
+        # Caixas e áreas só dos pixels visíveis de verdade, não da dilatação
+        ys, xs = np.nonzero(mask)
+        owner = labels[ys, xs]
+        area = np.bincount(owner, minlength=count)
+        x0 = np.full(count, image.width, np.int64)
+        y0 = np.full(count, image.height, np.int64)
+        x1 = np.full(count, -1, np.int64)
+        y1 = np.full(count, -1, np.int64)
+        np.minimum.at(x0, owner, xs)
+        np.minimum.at(y0, owner, ys)
+        np.maximum.at(x1, owner, xs)
+        np.maximum.at(y1, owner, ys)
+        boxes = np.stack([x0, y0, x1 - x0 + 1, y1 - y0 + 1], axis=1)
+    else:
+        area = stats[:, cv2.CC_STAT_AREA]
+        boxes = stats[:, :4].astype(np.int64)
+
+    # Rótulo 0 é o fundo
+    ids = np.nonzero(area >= max(1, min_area))[0]
+    ids = ids[ids > 0]
+    ids = ids[np.lexsort((boxes[ids, 0], boxes[ids, 1]))]
+
+    rects = [tuple(int(v) for v in boxes[i]) for i in ids]
+    return rects, labels, ids.tolist()
+
+
+def crop_sprite(image, rect, labels=None, label=None):
+    """
+    Recorta rect (x, y, w, h). Com o mapa de rótulos, pixels de outros
+    sprites que caem dentro da caixa viram transparentes.
+    """
+    import numpy as np
+
+    x, y, w, h = rect
+    sprite = image.crop((x, y, x + w, y + h))
+    if labels is None:
+        return sprite
+
+    window = labels[y : y + h, x : x + w]
+    foreign = (window != label) & visible_mask(sprite)
+    if foreign.any():
+        sprite.paste(
+            Image.new(sprite.mode, sprite.size, 0),
+            mask=Image.fromarray(foreign.astype(np.uint8) * 255),
+        )
+    return sprite
+
+
+# Variantes de um sprite que contam como duplicata (transposições do PIL)
+SPRITE_TRANSFORMS = {
+    "flip_h": Image.Transpose.FLIP_LEFT_RIGHT,
+    "flip_v": Image.Transpose.FLIP_TOP_BOTTOM,
+    "rotate_180": Image.Transpose.ROTATE_180,
+    "rotate_90": Image.Transpose.ROTATE_90,
+    "rotate_270": Image.Transpose.ROTATE_270,
+    "transpose": Image.Transpose.TRANSPOSE,
+    "transverse": Image.Transpose.TRANSVERSE,
+}
+
+
+def sprite_digest(image):
+    """
+    Hash do conteúdo visível de um sprite: pixels totalmente transparentes
+    contam como iguais, seja qual for a cor escondida embaixo
+    """
+    import hashlib
+
+    import numpy as np
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}{image.size}".encode())
+    if image.mode == "P":
+        digest.update(bytes(image.getpalette("RGBA") or []))
+
+    if image.mode == "RGBA":
+        data = np.asarray(image).copy()
+        data[data[:, :, 3] == 0] = 0
+        digest.update(data.tobytes())
+    else:
+        digest.update(image.tobytes())
+    return digest.digest()
+
+
+class SpriteIndex:
+    """
+    Índice por conteúdo dos sprites únicos. find() devolve (posição do
+    sprite único, transformação) para uma cópia já vista; com variants,
+    versões espelhadas/rotacionadas também contam (rotações de 90° só em
+    sprites quadrados, para não mudar o tamanho da célula).
+    """
+
+    def __init__(self, variants=False):
+        self.variants = variants
+        self.lookup = {}
+
+    def find(self, image):
+        return self.lookup.get(sprite_digest(image))
+
+    def add(self, image, position):
+        self.lookup.setdefault(sprite_digest(image), (position, "identity"))
+        if not self.variants:
+            return
+
+        square = image.width == image.height
+        for name, method in SPRITE_TRANSFORMS.items():
+            if not square and method not in (
+                Image.Transpose.FLIP_LEFT_RIGHT,
+                Image.Transpose.FLIP_TOP_BOTTOM,
+                Image.Transpose.ROTATE_180,
+            ):
+                continue
+            self.lookup.setdefault(
+                sprite_digest(image.transpose(method)), (position, name)
+            )
+
+
+def sheet_content_mask(image):
+    """
+    Pixels com conteúdo numa folha de sprites: os visíveis se a imagem tem
+    transparência, senão os que diferem da cor de fundo (a mais comum na
+    borda da imagem)
+    """
+    import numpy as np
+
+    mask = visible_mask(image)
+    if not mask.all():
+        return mask
+
+    data = np.asarray(image)
+    if data.ndim == 2:
+        data = data[:, :, None]
+    border = np.concatenate([data[0], data[-1], data[:, 0], data[:, -1]])
+    colors, counts = np.unique(border, axis=0, return_counts=True)
+    background = colors[np.argmax(counts)]
+    return (data != background).any(axis=2)
+
+
+def autocorrelation(profile):
+    """Autocorrelação normalizada (lag 0 = 1) de um perfil, via FFT"""
+    import numpy as np
+
+    n = len(profile)
+    centered = profile - profile.mean()
+    spectrum = np.fft.rfft(centered, 2 * n)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), 2 * n)[:n]
+    if autocorr[0] <= 0:
+        return None
+    return autocorr / autocorr[0]
+
+
+def grid_pitch(profile, min_pitch=4):
+    """
+    Período dominante de um perfil de projeção pela autocorrelação (FFT):
+    o primeiro pico local entre min_pitch e metade do comprimento com
+    pelo menos metade da altura do maior (os múltiplos do período também
+    são picos). None se o perfil não for periódico.
+    """
+    import numpy as np
+
+    n = len(profile)
+    if n < 2 * min_pitch:
+        return None
+
+    autocorr = autocorrelation(profile)
+    if autocorr is None:
+        return None
+
+    lags = np.arange(min_pitch, n // 2 + 1)
+    lags = lags[lags + 1 < n]
+    if not len(lags):
+        return None
+    peaks = lags[
+        (autocorr[lags] > autocorr[lags - 1]) & (autocorr[lags] >= autocorr[lags + 1])
+    ]
+    if not len(peaks):
+        return None
+
+    strongest = autocorr[peaks].max()
+    if strongest < 0.1:
+        return None
+    return int(peaks[autocorr[peaks] >= strongest * 0.5][0])
+
+
+def fold_profile(counts, pitch):
+    """Soma o perfil por fase (posição módulo o período)"""
+    import numpy as np
+
+    phases = np.arange(len(counts)) % pitch
+    return np.bincount(phases, weights=counts, minlength=pitch)
+
+
+def detect_grid_axis(counts):
+    """
+    Offset, tamanho da célula, espaçamento e número de células num eixo, a
+    partir da contagem de pixels com conteúdo por coluna (ou linha)
+    """
+    import numpy as np
+
+    n = len(counts)
+    occupied = np.nonzero(counts)[0]
+    if not len(occupied):
+        return None
+
+    pitch = grid_pitch(counts.astype(np.float64))
+    if pitch is None:
+        # Uma célula só, justa no conteúdo
+        first, last = int(occupied[0]), int(occupied[-1])
+        return first, last - first + 1, 0, 1
+
+    # Dobrado no período certo, as calhas caem sempre nas mesmas fases:
+    # entre os lags vizinhos quase tão correlacionados quanto o pico, fica
+    # o que deixa mais fases vazias (ou, sem calhas, o que divide o tamanho)
+    def empty_phases(candidate):
+        folded = fold_profile(counts, candidate)
+        return folded <= folded.max() * 0.01
+
+    autocorr = autocorrelation(counts.astype(np.float64))
+    candidates = [
+        p
+        for p in range(pitch - 2, pitch + 3)
+        if 2 <= p <= n // 2 and autocorr[p] >= autocorr[pitch] * 0.9
+    ]
+    pitch = max(
+        candidates,
+        key=lambda p: (empty_phases(p).sum(), n % p == 0, -abs(p - pitch)),
+    )
+
+    folded = fold_profile(counts, pitch)
+    empty = empty_phases(pitch)
+
+    if empty.all() or not empty.any():
+        # Sem calha: grade alinhada à imagem se o período divide o tamanho,
+        # senão a borda da célula passa onde há menos conteúdo
+        offset = 0 if n % pitch == 0 else int(np.argmin(folded))
+        spacing = 0
+    elif empty[0] and n % pitch == 0:
+        # Células coladas com folga transparente dentro de cada uma
+        offset, spacing = 0, 0
+    else:
+        # Maior sequência circular de fases vazias = espaçamento
+        doubled = np.concatenate([empty, empty])
+        best_start, best_len, run = 0, 0, 0
+        for i, value in enumerate(doubled):
+            run = run + 1 if value else 0
+            if run > best_len:
+                best_start, best_len = i - run + 1, run
+        spacing = min(best_len, pitch - 1)
+        offset = (best_start + spacing) % pitch
+
+    cell = pitch - spacing
+    count = max(1, (n - offset + spacing) // pitch)
+    return offset, cell, spacing, count
+
+
+def detect_grid(image):
+    """
+    Propõe a grade de uma folha de sprites a partir dos perfis de projeção
+    de linhas e colunas: {x, y, cols, rows, cell_w, cell_h, spacing_x,
+    spacing_y}, ou None se a imagem não tiver conteúdo
+    """
+    mask = sheet_content_mask(image)
+    horizontal = detect_grid_axis(mask.sum(axis=0))
+    vertical = detect_grid_axis(mask.sum(axis=1))
+    if horizontal is None or vertical is None:
+        return None
+
+    x, cell_w, spacing_x, cols = horizontal
+    y, cell_h, spacing_y, rows = vertical
+    return {
+        "x": x,
+        "y": y,
+        "cols": cols,
+        "rows": rows,
+        "cell_w": cell_w,
+        "cell_h": cell_h,
+        "spacing_x": spacing_x,
+        "spacing_y": spacing_y,
+    }
+
+
+# Opções do encoder PNG na exportação de sprites
+PNG_COMPRESSION = {
+    "Fast": {"compress_level": 1},
+    "Balanced": {"compress_level": 6},
+    "Optimized": {"compress_level": 9, "optimize": True},
+}
+
+
+def sprite_filenames(prefix, count):
+    """
+    Nomes determinísticos prefix_0000.png...; os dígitos crescem com a
+    quantidade para a ordem alfabética continuar igual à da lista
+    """
+    digits = max(4, len(str(count - 1)))
+    return [f"{prefix}_{idx:0{digits}d}.png" for idx in range(count)]
+
+
+def export_sprite_files(
+    images,
+    output_dir,
+    prefix,
+    compression="Fast",
+    workers=0,
+    progress=None,
+    cancelled=None,
+):
+    """
+    Grava os sprites em PNG usando um pool de threads (o zlib do PIL solta
+    o GIL durante a compressão). Retorna os nomes dos arquivos, ou None se
+    cancelado; arquivos já gravados ficam na pasta.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    options = PNG_COMPRESSION[compression]
+    filenames = sprite_filenames(prefix, len(images))
+    cancelled = cancelled or (lambda: False)
+
+    def save(idx):
+        if cancelled():
+            return
+        images[idx].save(os.path.join(output_dir, filenames[idx]), "PNG", **options)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [pool.submit(save, idx) for idx in range(len(images))]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress:
+                progress(done, len(futures))
+            if cancelled():
+                for pending in futures:
+                    pending.cancel()
+                return None
+
+    return filenames
+
+
+def pack_atlas(images, padding=8, max_side=1024):
+    """
+    Empacota as imagens em atlas (prateleiras, maiores primeiro) com
+    padding transparente entre elas. Retorna [(atlas, [(índice, x, y)])].
+    """
+    order = sorted(range(len(images)), key=lambda i: -images[i].height)
+    atlases = []
+    placements = []
+    x = y = padding
+    shelf = 0
+
+    def flush():
+        width = max(px + images[i].width for i, px, _ in placements) + padding
+        height = max(py + images[i].height for i, _, py in placements) + padding
+        atlas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        for i, px, py in placements:
+            atlas.paste(images[i].convert("RGBA"), (px, py))
+        atlases.append((atlas, list(placements)))
+
+    for i in order:
+        w, h = images[i].size
+
+        # Nova prateleira quando a linha enche
+        if x + w + padding > max_side and x > padding:
+            x = padding
+            y += shelf + padding
+            shelf = 0
+
+        # Novo atlas quando a altura enche
+        if y + h + padding > max_side and placements:
+            flush()
+            placements.clear()
+            x = y = padding
+            shelf = 0
+
+        placements.append((i, x, y))
+        x += w + padding
+        shelf = max(shelf, h)
+
+    if placements:
+        flush()
+
+    return atlases
+
+
+def process_atlases(
+    images, process, padding=8, max_side=1024, progress=None, cancelled=None
+):
+    """
+    Roda process(atlas) -> imagem uma vez por atlas e recorta os
+    resultados de volta na ordem original (a escala vem do tamanho da
+    saída). Retorna a nova lista ou None se cancelado.
+    """
+    atlases = pack_atlas(images, padding, max_side)
+    results = [None] * len(images)
+
+    for done, (atlas, placements) in enumerate(atlases, 1):
+        if cancelled and cancelled():
+            return None
+
+        output = process(atlas)
+        if output is None:
+            return None
+
+        sx = output.width / atlas.width
+        sy = output.height / atlas.height
+        for i, x, y in placements:
+            w, h = images[i].size
+            results[i] = output.crop(
+                (
+                    round(x * sx),
+                    round(y * sy),
+                    round((x + w) * sx),
+                    round((y + h) * sy),
+                )
+            )
+
+        if progress:
+            progress(done, len(atlases))
+
+    return results
+
+
+def benchmark_upscale_backends(
+    model_idx, backends, size=128, repeats=3, options=None
+):
+    """
+    Latência de CPU por megapixel de entrada de cada backend (sem contar
+    o carregamento do modelo). options é {backend: opções}. Retorna
+    {backend: ms/MP ou mensagem de erro}.
+    """
+    import time
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (size, size, 3), np.uint8)
+    netscale = UPSCALE_MODELS[model_idx]["netscale"]
+    megapixels = size * size / 1e6
+
+    results = {}
+    for backend in backends:
+        try:
+            backend_options = (options or {}).get(backend)
+            upsampler = get_upsampler(
+                model_idx, "cpu", backend=backend, options=backend_options
+            )
+            upsampler.enhance(img, outscale=netscale)  # aquecimento
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                upsampler.enhance(img, outscale=netscale)
+            elapsed = (time.perf_counter() - start) / repeats
+
+            results[backend] = elapsed * 1000 / megapixels
+        except Exception as e:
+            results[backend] = str(e)
+
+    return results
+
+
+def cpu_profile_report(model_idx, profiles, image=None, size=96, repeats=2):
+    """
+    Roda o mesmo recorte com cada perfil de CPU e mede latência (ms/MP
+    de entrada) e qualidade (PSNR contra o primeiro perfil, o de
+    referência). Retorna [(nome, ms/MP, PSNR ou None, erro ou None)].
+    """
+    import time
+
+    import numpy as np
+
+    if image is None:
+        rng = np.random.default_rng(0)
+        bgr = rng.integers(0, 256, (size, size, 3), np.uint8)
+    else:
+        rgb = np.asarray(image.convert("RGB"))
+        h, w = rgb.shape[:2]
+        y0, x0 = max(0, (h - size) // 2), max(0, (w - size) // 2)
+        bgr = np.ascontiguousarray(rgb[y0 : y0 + size, x0 : x0 + size, ::-1])
+
+    netscale = UPSCALE_MODELS[model_idx]["netscale"]
+    megapixels = bgr.shape[0] * bgr.shape[1] / 1e6
+
+    rows = []
+    reference = None
+    for name, profile in profiles:
+        try:
+            upsampler = get_upsampler(model_idx, "cpu", options=profile)
+            output, _ = upsampler.enhance(bgr, outscale=netscale)  # aquecimento
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                output, _ = upsampler.enhance(bgr, outscale=netscale)
+            latency = (time.perf_counter() - start) / repeats * 1000 / megapixels
+        except Exception as e:
+            rows.append((name, None, None, str(e)))
+            continue
+
+        psnr = None
+        if reference is None:
+            reference = output.astype(np.float64)
+        else:
+            mse = np.mean((output.astype(np.float64) - reference) ** 2)
+            psnr = float("inf") if mse == 0 else 10 * np.log10(255.0**2 / mse)
+        rows.append((name, latency, psnr, None))
+
+    return rows
+
+
+def warm_up_models(upscale=None, rembg=None, cancelled=None):
+    """
+    Carrega os modelos usados por último e roda uma inferência mínima em
+    cada um (inicializa kernels, contexto CUDA e sessões ONNX). upscale é
+    {model, device, backend, options} e rembg é {model, threads}. Nunca
+    baixa nem exporta nada: modelos ausentes são pulados. Para entre as
+    etapas se cancelled() retornar True. Retorna os nomes aquecidos.
+    """
+    import os
+
+    import numpy as np
+
+    cancelled = cancelled or (lambda: False)
+    warmed = []
+
+    if upscale and not cancelled():
+        entry = UPSCALE_MODELS[upscale["model"]]
+        backend = upscale.get("backend", "torch")
+        with MODEL_LOAD_LOCK:
+            if backend == "onnx":
+                present = os.path.isfile(MODEL_REGISTRY.onnx_path(entry["name"]))
+            else:
+                present = MODEL_REGISTRY.check(entry["name"]) == "ok"
+        if present:
+            upsampler = get_upsampler(
+                upscale["model"],
+                upscale.get("device", "cpu"),
+                backend=backend,
+                options=upscale.get("options"),
+            )
+            if not cancelled():
+                upsampler.enhance(
+                    np.zeros((16, 16, 3), np.uint8), outscale=entry["netscale"]
+                )
+            warmed.append(entry["name"])
+
+    if rembg and not cancelled():
+        from rembg import remove
+
+        # O rembg baixaria o modelo que falta; o aquecimento só usa os locais
+        u2net_home = os.environ.get("U2NET_HOME") or os.path.join(
+            os.path.expanduser("~"), ".u2net"
+        )
+        if not os.path.isfile(os.path.join(u2net_home, f"{rembg['model']}.onnx")):
+            return warmed
+
+        session = get_rembg_session(rembg["model"], rembg.get("threads", 0))
+        if not cancelled():
+            remove(Image.new("RGBA", (32, 32)), session=session)
+        warmed.append(rembg["model"])
+
+    return warmed
+
+
+def unload_upsamplers():
+    """Libera upsamplers e sessões rembg carregados (e a memória da GPU)"""
+    import gc
+
+    count = len(UPSAMPLER_CACHE) + len(REMBG_SESSION_CACHE)
+    UPSAMPLER_CACHE.clear()
+    REMBG_SESSION_CACHE.clear()
+    gc.collect()
+
+    if REALESRGAN_AVAILABLE and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    return count
+
+
+# Modelos do rembg oferecidos na interface
+REMBG_MODELS = [
+    "u2net",
+    "u2netp",
+    "isnet-general-use",
+    "isnet-anime",
+    "silueta",
+    "u2net_human_seg",
+]
+
+# Sessões ONNX do rembg ficam abertas entre as chamadas
+REMBG_SESSION_CACHE = LRUCache(max_items=2)
+
+
+def get_rembg_session(model_name, threads=0):
+    """
+    Sessão rembg do modelo, criada uma vez e reaproveitada. threads > 0
+    limita as threads do onnxruntime com SessionOptions próprias, sem
+    mexer no ambiente do processo.
+    """
+    with MODEL_LOAD_LOCK:
+        key = (model_name, threads)
+        session = REMBG_SESSION_CACHE.get(key)
+        if session is not None:
+            return session
+
+        if threads > 0:
+            import onnxruntime
+            from rembg.sessions import sessions_class
+
+            # O new_session monta as SessionOptions sozinho (só lê
+            # OMP_NUM_THREADS); a classe da sessão aceita as nossas
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = threads
+            session_class = next(
+                (cls for cls in sessions_class if cls.name() == model_name), None
+            )
+            if session_class is None:
+                raise ValueError(f"Modelo rembg desconhecido: {model_name}")
+            session = session_class(model_name, options)
+        else:
+            from rembg import new_session
+
+            session = new_session(model_name)
+
+        REMBG_SESSION_CACHE.put(key, session)
+        return session
+
+
+def remove_background(image, model_name="u2net", threads=0):
+    """Remove o fundo de uma imagem PIL direto (sem ida e volta por PNG)"""
+    from rembg import remove
+
+    session = get_rembg_session(model_name, threads)
+    return remove(image.convert("RGBA"), session=session).convert("RGBA")
+
+
+def default_cache_dir():
+    """Pasta padrão da camada em disco do cache de resultados"""
+    import os
+
+    return os.path.join(os.path.expanduser("~"), ".sprite_editor", "cache")
+
+
+class ResultCache:
+    """
+    Cache de resultados de operações caras (upscale, rembg, denoise) com
+    chave (hash do conteúdo da imagem, operação, parâmetros). A camada em
+    memória é um LRU limitado em bytes; com directory definido, os
+    resultados também vão para PNGs em disco e sobrevivem entre sessões.
+    Acessado da thread da interface e dos jobs, por isso o lock.
+    """
+
+    def __init__(self, max_items=16, max_bytes=512 * 1024 * 1024, directory=None):
+        import threading
+
+        self.memory = LRUCache(
+            max_items,
+            max_bytes,
+            lambda image: len(image.getbands()) * image.width * image.height,
+        )
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Último erro de gravação em disco (mostrado por quem lê o stats)
+        self.disk_error = None
+
+    @staticmethod
+    def key(image, operation, **params):
+        """Hash do conteúdo (modo, tamanho, paleta e pixels) + operação + parâmetros"""
+        import hashlib
+
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.mode}{image.size}".encode())
+        if image.mode == "P":
+            digest.update(bytes(image.getpalette("RGBA") or []))
+        digest.update(image.tobytes())
+        digest.update(operation.encode())
+        digest.update(repr(sorted(params.items())).encode())
+        return digest.hexdigest()
+
+    def disk_path(self, key):
+        import os
+
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        """Cópia do resultado guardado, ou None"""
+        import os
+
+        with self.lock:
+            image = self.memory.get(key)
+
+        if image is None and self.directory:
+            path = self.disk_path(key)
+            if os.path.exists(path):
+                try:
+                    with Image.open(path) as cached:
+                        image = cached.copy()
+                except OSError:
+                    image = None
+                if image is not None:
+                    with self.lock:
+                        self.memory.put(key, image)
+
+        with self.lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return image.copy()
+
+    def put(self, key, image):
+        """
+        Guarda o resultado. Uma falha ao gravar em disco não interrompe a
+        operação: fica em disk_error e o resultado segue só na memória.
+        """
+        import os
+
+        image = image.copy()
+        with self.lock:
+            self.memory.put(key, image)
+
+        if self.directory:
+            path = self.disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Grava em .tmp e renomeia: um PNG pela metade nunca é lido
+                temp_path = f"{path}.tmp"
+                image.save(temp_path, "PNG", compress_level=1)
+                os.replace(temp_path, path)
+            except OSError as e:
+                with self.lock:
+                    self.disk_error = str(e)
+
+    def clear(self, disk=False):
+        import shutil
+
+        with self.lock:
+            self.memory.clear()
+            self.hits = self.misses = 0
+            self.disk_error = None
+        if disk and self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        """(itens em memória, MB em memória, acertos, erros)"""
+        with self.lock:
+            return (
+                len(self.memory),
+                self.memory.size / (1024 * 1024),
+                self.hits,
+                self.misses,
+            )
+
+
+RESULT_CACHE = ResultCache()
+
+
+OUTLINE_PLACEMENTS = ["Outside", "Inside", "Center"]
+
+
+def distance_ramp(distance, width, softness=0.0):
+    """Converte uma distância em cobertura 0-1 (borda dura ou rampa anti-aliased)"""
+    import numpy as np
+
+    if softness <= 0:
+        return (distance <= width).astype(np.float32)
+    return np.clip((width + softness - distance) / softness, 0.0, 1.0)
+
+
+def outline_coverage(alpha, thickness, placement="Outside", softness=0.0):
+    """
+    Calcula a cobertura do outline (externa e interna) a partir do canal alpha.
+    Usa uma única transformada de distância euclidiana por lado, então o custo
+    não depende da espessura.
+    """
+    import cv2
+    import numpy as np
+
+    inside = alpha > 128
+    outer = np.zeros(alpha.shape, np.float32)
+    inner = np.zeros(alpha.shape, np.float32)
+
+    if not inside.any():
+        return outer, inner
+
+    if placement == "Center":
+        outer_width = (thickness + 1) // 2
+        inner_width = thickness // 2
+    elif placement == "Inside":
+        outer_width, inner_width = 0, thickness
+    else:
+        outer_width, inner_width = thickness, 0
+
+    if outer_width > 0:
+        # Distância de cada pixel externo até o pixel opaco mais próximo
+        dist = cv2.distanceTransform(
+            (~inside).astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE
+        )
+        outer = distance_ramp(dist, outer_width, softness)
+        outer[inside] = 0
+
+    if inner_width > 0 and not inside.all():
+        # Distância de cada pixel opaco até o pixel transparente mais próximo
+        dist = cv2.distanceTransform(
+            inside.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE
+        )
+        inner = distance_ramp(dist, inner_width, softness)
+        inner[~inside] = 0
+
+    return outer, inner
+
+
+def erode_alpha(alpha, distance, softness=0.0):
+    """
+    Apaga as bordas do canal alpha em `distance` px com uma transformada de
+    distância, então apagar 1px ou 50px tem o mesmo custo.
+    """
+    import cv2
+    import numpy as np
+
+    opaque = alpha > 0
+    if not opaque.any():
+        return alpha.copy()
+
+    # Distância de cada pixel visível até o pixel transparente mais próximo
+    dist = cv2.distanceTransform(
+        opaque.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE
+    )
+    erase = distance_ramp(dist, distance, softness)
+    return np.rint(alpha * (1.0 - erase)).astype(np.uint8)
+
+
+def render_outline(image, color, thickness, placement="Outside", softness=0.0):
+    """Retorna uma cópia RGBA da imagem com o outline aplicado"""
+    import numpy as np
+
+    img = image.convert("RGBA")
+    alpha = np.asarray(img)[:, :, 3]
+    outer, inner = outline_coverage(alpha, thickness, placement, softness)
+
+    r, g, b, a = color
+    layer = np.empty(alpha.shape + (4,), np.uint8)
+    layer[:, :, 0] = r
+    layer[:, :, 1] = g
+    layer[:, :, 2] = b
+
+    # Outline externo fica por baixo do sprite, o interno por cima
+    layer[:, :, 3] = np.rint(outer * a).astype(np.uint8)
+    result = Image.alpha_composite(Image.fromarray(layer, "RGBA"), img)
+
+    if inner.any():
+        layer[:, :, 3] = np.rint(inner * a).astype(np.uint8)
+        result = Image.alpha_composite(result, Image.fromarray(layer, "RGBA"))
+
+    return result
+
+
+def channel_histograms(rgba):
+    """Histogramas (256 níveis) dos canais R, G e B"""
+    import cv2
+
+    return [
+        cv2.calcHist([rgba], [channel], None, [256], [0, 256]).ravel()
+        for channel in range(3)
+    ]
+
+
+def color_contrast_mean(histograms, brightness=0):
+    """
+    Média de luminância usada pelo contraste (mesma do ImageEnhance.Contrast),
+    calculada pelos histogramas dos canais já com o brilho aplicado.
+    """
+    import numpy as np
+
+    levels = np.arange(256, dtype=np.float64)
+    levels = np.clip(levels * (1.0 + brightness / 100.0), 0, 255)
+
+    total = float(histograms[0].sum())
+    if total == 0:
+        return 128
+
+    means = [float(hist @ levels) / total for hist in histograms]
+
+    luma = means[0] * 0.299 + means[1] * 0.587 + means[2] * 0.114
+    return int(luma + 0.5)
+
+
+def build_color_plan(brightness, contrast, saturation, red, green, blue, mean=128):
+    """
+    Compila os sliders de cor em LUTs por canal (256 entradas) e uma matriz
+    de saturação. Retorna None se nenhum ajuste estiver ativo.
+    """
+    import numpy as np
+
+    if not any((brightness, contrast, saturation, red, green, blue)):
+        return None
+
+    levels = np.arange(256, dtype=np.float32)
+
+    # Brilho (mistura com preto) seguido de contraste (mistura com a média)
+    pre = np.clip(levels * (1.0 + brightness / 100.0), 0, 255)
+    pre = np.clip(mean + (pre - mean) * (1.0 + contrast / 100.0), 0, 255)
+
+    post = None
+    if red or green or blue:
+        offsets = np.array([red, green, blue], np.float32)
+        post = np.clip(levels[:, None] + offsets[None, :], 0, 255)
+
+    matrix = None
+    if saturation:
+        factor = 1.0 + saturation / 100.0
+        luma = np.array([0.299, 0.587, 0.114], np.float32)
+        matrix = np.eye(4, dtype=np.float32)
+        matrix[:3, :3] = factor * np.eye(3) + (1.0 - factor) * luma[None, :]
+
+    def as_lut(rgb):
+        lut = np.empty((256, 1, 4), np.uint8)
+        lut[:, 0, :3] = np.rint(rgb).astype(np.uint8)
+        lut[:, 0, 3] = np.arange(256)
+        return lut
+
+    pre_rgb = np.repeat(pre[:, None], 3, axis=1)
+
+    if matrix is None:
+        # Sem saturação tudo vira uma única LUT
+        if post is not None:
+            pre_rgb = post[np.rint(pre_rgb).astype(np.intp), np.arange(3)]
+        return as_lut(pre_rgb), None, None
+
+    return as_lut(pre_rgb), matrix, as_lut(post) if post is not None else None
+
+
+def apply_color_plan(rgba, plan, out=None):
+    """Aplica o plano de cor num array RGBA em uma passada, sem mexer no alpha"""
+    import cv2
+    import numpy as np
+
+    if out is None:
+        out = np.empty_like(rgba)
+
+    pre, matrix, post = plan
+    cv2.LUT(rgba, pre, dst=out)
+
+    if matrix is not None:
+        cv2.transform(out, matrix, dst=out)
+    if post is not None:
+        cv2.LUT(out, post, dst=out)
+
+    return out
+
+
+DENOISE_METHODS = [
+    "Median Filter",
+    "Gaussian Blur",
+    "Smooth Filter",
+    "Smooth More",
+    "Bilateral Filter",
+    "Non-Local Means",
+]
+
+# Mesmos kernels de ImageFilter.SMOOTH e ImageFilter.SMOOTH_MORE
+SMOOTH_KERNEL = [[1, 1, 1], [1, 5, 1], [1, 1, 1]]
+SMOOTH_MORE_KERNEL = [
+    [1, 1, 1, 1, 1],
+    [1, 5, 5, 5, 1],
+    [1, 5, 44, 5, 1],
+    [1, 5, 5, 5, 1],
+    [1, 1, 1, 1, 1],
+]
+
+
+def gaussian_kernel_size(sigma):
+    """
+    Tamanho do kernel do Gaussian Blur, com raio de 4 sigma. Passado
+    explicitamente ao cv2.GaussianBlur para a margem dos tiles ser
+    exatamente o raio usado.
+    """
+    import math
+
+    return 2 * int(math.ceil(sigma * 4)) + 1
+
+
+def denoise_halo(method, strength):
+    """Margem (px) que cada tile precisa para o resultado não ter emendas"""
+    if method == 0:
+        return int(strength * 2) // 2 + 1
+    if method == 1:
+        return gaussian_kernel_size(strength) // 2 + 1
+    if method == 2:
+        return max(1, int(strength)) + 1
+    if method == 3:
+        return max(1, int(strength)) * 2 + 1
+    if method == 4:
+        return int(strength * 2) + 1
+    # Non-Local Means: metade da janela de busca + metade do template
+    return 21 // 2 + 7 // 2 + 1
+
+
+def denoise_rgb(rgb, method, strength):
+    """Aplica o filtro de denoise num array RGB uint8 contínuo"""
+    import cv2
+    import numpy as np
+
+    if method == 0:  # Median Filter
+        # Converte para int e garante que é ímpar
+        kernel_size = (int(strength * 2) + 1) | 1
+        if kernel_size < 3:
+            return rgb.copy()
+        return cv2.medianBlur(rgb, kernel_size)
+
+    if method == 1:  # Gaussian Blur
+        size = gaussian_kernel_size(strength)
+        return cv2.GaussianBlur(rgb, (size, size), sigmaX=strength)
+
+    if method in (2, 3):  # Smooth / Smooth More
+        kernel = np.array(
+            SMOOTH_KERNEL if method == 2 else SMOOTH_MORE_KERNEL, np.float32
+        )
+        kernel /= kernel.sum()
+        out = rgb
+        for _ in range(max(1, int(strength))):
+            out = cv2.filter2D(out, -1, kernel, borderType=cv2.BORDER_REPLICATE)
+        return out
+
+    if method == 4:  # Bilateral
+        diameter = int(strength * 2) * 2 + 1
+        return cv2.bilateralFilter(
+            rgb, diameter, sigmaColor=20.0 * strength, sigmaSpace=strength * 2 + 1
+        )
+
+    # Non-Local Means (o OpenCV espera BGR)
+    bgr = np.ascontiguousarray(rgb[:, :, ::-1])
+    h = 3.0 * strength
+    out = cv2.fastNlMeansDenoisingColored(bgr, None, h, h, 7, 21)
+    return np.ascontiguousarray(out[:, :, ::-1])
+
+
+def denoise_array(
+    rgba, method, strength, tile_size=256, workers=None, progress=None, cancelled=None
+):
+    """
+    Denoise em tiles (com margem) processados em paralelo. Só o RGB é
+    filtrado, o alpha é preservado. `progress(feitos, total)` é chamado na
+    thread que chamou a função; se `cancelled()` retornar True, retorna None.
+    """
+    import os
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    import numpy as np
+
+    h, w = rgba.shape[:2]
+    halo = denoise_halo(method, strength)
+    out = rgba.copy()
+
+    tiles = [
+        (x, y, min(w, x + tile_size), min(h, y + tile_size))
+        for y in range(0, h, tile_size)
+        for x in range(0, w, tile_size)
+    ]
+
+    def run(tile):
+        x0, y0, x1, y1 = tile
+        hx0, hy0 = max(0, x0 - halo), max(0, y0 - halo)
+        hx1, hy1 = min(w, x1 + halo), min(h, y1 + halo)
+        src = np.ascontiguousarray(rgba[hy0:hy1, hx0:hx1, :3])
+        result = denoise_rgb(src, method, strength)
+        out[y0:y1, x0:x1, :3] = result[y0 - hy0 : y1 - hy0, x0 - hx0 : x1 - hx0]
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=min(workers, len(tiles))) as pool:
+        pending = {pool.submit(run, tile) for tile in tiles}
+        done_count = 0
+
+        while pending:
+            done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+                done_count += 1
+
+            if progress:
+                progress(done_count, len(tiles))
+
+            if cancelled and cancelled():
+                for future in pending:
+                    future.cancel()
+                return None
+
+    return out
+
+
+def denoise_image(image, method, strength, progress=None, cancelled=None):
+    """Aplica o denoise escolhido e retorna a nova imagem (ou None se cancelado)"""
+    import numpy as np
+
+    rgba = np.asarray(image.convert("RGBA"))
+    out = denoise_array(rgba, method, strength, progress=progress, cancelled=cancelled)
+    if out is None:
+        return None
+    return Image.fromarray(out, "RGBA")
+
+
+def image_palette(image):
+    """Paleta de uma imagem modo 'P' como array (n, 4) RGBA"""
+    import numpy as np
+
+    palette = np.array(image.getpalette("RGBA") or [], np.uint8).reshape(-1, 4)
+
+    transparency = image.info.get("transparency")
+    if isinstance(transparency, int) and transparency < len(palette):
+        palette[transparency, 3] = 0
+    elif isinstance(transparency, bytes):
+        alphas = np.frombuffer(transparency, np.uint8)[: len(palette)]
+        palette[: len(alphas), 3] = alphas
+
+    return palette
+
+
+def nearest_palette_indices(colors, palette, chunk=16384):
+    """Índice da cor mais próxima (RGBA euclidiano) na paleta para cada cor"""
+    import numpy as np
+
+    # |c - p|² = |c|² - 2 c·p + |p|²; |c|² não muda o argmin
+    pal = palette.astype(np.float32)
+    pal_norm = (pal * pal).sum(axis=1)
+    result = np.empty(len(colors), np.intp)
+
+    for start in range(0, len(colors), chunk):
+        block = colors[start : start + chunk].astype(np.float32)
+        dist = pal_norm[None, :] - 2 * (block @ pal.T)
+        result[start : start + chunk] = dist.argmin(axis=1)
+
+    return result
+
+
+def rgba_to_indexed(image, palette=None, max_colors=256):
+    """
+    Converte uma imagem para modo 'P' (buffer uint8 + paleta RGBA), com o
+    índice 0 reservado para transparente. Cores que já estão na paleta
+    mantêm o índice, cores novas entram enquanto houver espaço e o resto
+    vai para a cor mais próxima.
+    """
+    import numpy as np
+
+    rgba = np.ascontiguousarray(np.asarray(image.convert("RGBA")))
+    h, w = rgba.shape[:2]
+
+    packed = rgba.view(np.uint32).reshape(h, w).copy()
+    packed[rgba[:, :, 3] == 0] = 0
+    colors, inverse = np.unique(packed, return_inverse=True)
+
+    if palette is None or len(palette) == 0:
+        palette = np.zeros((1, 4), np.uint8)
+        if len(colors) > max_colors:
+            # Muitas cores: parte de uma paleta quantizada
+            quantized = image.convert("RGBA").quantize(
+                max_colors - 1, method=Image.Quantize.FASTOCTREE
+            )
+            palette = np.vstack([palette, image_palette(quantized)[: max_colors - 1]])
+    palette = np.ascontiguousarray(palette, np.uint8)
+
+    palette_keys = palette.view(np.uint32).ravel().tolist()
+    lookup = {key: i for i, key in reversed(list(enumerate(palette_keys)))}
+    lookup[0] = 0
+
+    mapping = np.empty(len(colors), np.intp)
+    missing = []
+    for i, key in enumerate(colors.tolist()):
+        index = lookup.get(key)
+        if index is None and len(palette_keys) < max_colors:
+            index = len(palette_keys)
+            palette_keys.append(key)
+            lookup[key] = index
+        if index is None:
+            missing.append(i)
+        else:
+            mapping[i] = index
+
+    palette = np.array(palette_keys, np.uint32).view(np.uint8).reshape(-1, 4)
+    if missing:
+        missing_colors = colors[missing].view(np.uint8).reshape(-1, 4)
+        mapping[missing] = nearest_palette_indices(missing_colors, palette)
+
+    indices = mapping[inverse.ravel()].astype(np.uint8).reshape(h, w)
+    indexed = Image.fromarray(indices, "P")
+    indexed.putpalette(palette.tobytes(), rawmode="RGBA")
+    return indexed
+
+
+def palette_fits(image, palette, max_colors=256):
+    """
+    True se rgba_to_indexed(image, palette) não precisa aproximar nenhuma
+    cor: as cores novas cabem no espaço que sobra na paleta
+    """
+    import numpy as np
+
+    rgba = np.ascontiguousarray(np.asarray(image.convert("RGBA")))
+    packed = rgba.view(np.uint32).ravel().copy()
+    packed[rgba[:, :, 3].ravel() == 0] = 0
+
+    if palette is None or len(palette) == 0:
+        known = np.zeros(1, np.uint32)
+    else:
+        known = np.ascontiguousarray(palette, np.uint8).view(np.uint32).ravel()
+
+    new = np.setdiff1d(np.unique(packed), np.append(known, 0))
+    return len(known) + len(new) <= max_colors
+
+
+PALETTE_SWAP_SCOPES = ["Current Image", "All Sliced Sprites"]
+
+
+def sample_color_histogram(images, max_samples=65536, seed=0):
+    """
+    Histograma das cores opacas (RGB) de uma ou mais imagens, a partir de
+    uma amostra de no máximo max_samples pixels. Retorna (cores, contagens).
+    """
+    import numpy as np
+
+    pixels = [
+        np.asarray(image.convert("RGBA")).reshape(-1, 4) for image in images
+    ]
+    pixels = np.concatenate(pixels) if pixels else np.zeros((0, 4), np.uint8)
+    pixels = pixels[pixels[:, 3] > 0]
+
+    if len(pixels) > max_samples:
+        rng = np.random.default_rng(seed)
+        pixels = pixels[rng.choice(len(pixels), max_samples, replace=False)]
+
+    packed = (
+        (pixels[:, 0].astype(np.uint32) << 16)
+        | (pixels[:, 1].astype(np.uint32) << 8)
+        | pixels[:, 2]
+    )
+    keys, counts = np.unique(packed, return_counts=True)
+    colors = np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=1)
+    return colors.astype(np.uint8), counts
+
+
+def median_cut_palette(colors, counts, n_colors):
+    """Median cut ponderado sobre o histograma: divide a caixa com maior faixa"""
+    import numpy as np
+
+    if len(colors) == 0:
+        return np.zeros((0, 3), np.uint8)
+
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < n_colors:
+        # Caixa com maior faixa (ponderada pela quantidade de pixels)
+        best, best_score, best_axis = -1, 0, 0
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            ranges = np.ptp(colors[box], axis=0)
+            score = int(ranges.max()) * int(counts[box].sum())
+            if score > best_score:
+                best, best_score, best_axis = i, score, int(ranges.argmax())
+
+        if best < 0:
+            break
+
+        box = boxes.pop(best)
+        box = box[np.argsort(colors[box, best_axis], kind="stable")]
+        cumulative = np.cumsum(counts[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+        split = min(max(split, 1), len(box) - 1)
+        boxes.extend([box[:split], box[split:]])
+
+    return np.array(
+        [np.average(colors[box], axis=0, weights=counts[box]) for box in boxes]
+    ).round().astype(np.uint8)
+
+
+def kmeans_refine_palette(palette, colors, counts, iterations=4):
+    """Refina a paleta com algumas iterações de k-means ponderado"""
+    import numpy as np
+
+    centers = palette.astype(np.float64)
+    weights = counts.astype(np.float64)
+
+    for _ in range(iterations):
+        labels = nearest_palette_indices(colors, centers.round().astype(np.uint8))
+        totals = np.bincount(labels, weights, minlength=len(centers))
+        used = totals > 0
+        for c in range(3):
+            sums = np.bincount(labels, weights * colors[:, c], minlength=len(centers))
+            centers[used, c] = sums[used] / totals[used]
+
+    return centers.round().astype(np.uint8)
+
+
+def extract_palette(images, n_colors, refine=True):
+    """Paleta RGB (n, 3) das imagens, ordenada por luminância"""
+    import numpy as np
+
+    colors, counts = sample_color_histogram(images)
+
+    if len(colors) <= n_colors:
+        palette = colors
+    else:
+        palette = median_cut_palette(colors, counts, n_colors)
+        if refine:
+            palette = kmeans_refine_palette(palette, colors, counts)
+        palette = np.unique(palette, axis=0)
+
+    luminance = palette.astype(np.float64) @ np.array([0.299, 0.587, 0.114])
+    return palette[np.argsort(luminance, kind="stable")]
+
+
+def palette_from_image(image, max_colors=256):
+    """Cores opacas de uma imagem de paleta, na ordem em que aparecem"""
+    import numpy as np
+
+    if image.mode == "P":
+        palette = image_palette(image)
+        used = np.unique(np.asarray(image))
+        palette = palette[used]
+        return palette[palette[:, 3] > 0][:max_colors, :3].copy()
+
+    rgba = np.asarray(image.convert("RGBA")).reshape(-1, 4)
+    rgba = rgba[rgba[:, 3] > 0]
+    _, first = np.unique(rgba[:, :3], axis=0, return_index=True)
+    return rgba[np.sort(first)[:max_colors], :3].copy()
+
+
+def swap_palette(images, source, target):
+    """
+    Troca a paleta source pela target (mesma ordem) em todas as imagens.
+    Cada cor única vai para a entrada mais próxima de source e a lookup
+    table resultante é aplicada em uma passada por imagem. Imagens
+    indexadas só têm a paleta remapeada.
+    """
+    import numpy as np
+
+    source = np.asarray(source, np.uint8)
+    target = np.asarray(target, np.uint8)
+    mapping = target[np.arange(len(source)) % len(target)]
+
+    def remap(rgb):
+        packed = (
+            (rgb[..., 0].astype(np.uint32) << 16)
+            | (rgb[..., 1].astype(np.uint32) << 8)
+            | rgb[..., 2]
+        )
+        keys, inverse = np.unique(packed, return_inverse=True)
+        colors = np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], 1)
+        lut = mapping[nearest_palette_indices(colors.astype(np.uint8), source)]
+        return lut[inverse.reshape(rgb.shape[:-1])]
+
+    results = []
+    for image in images:
+        if image.mode == "P":
+            palette = image_palette(image)
+            palette[1:, :3] = remap(palette[1:, :3])
+            swapped = image.copy()
+            swapped.putpalette(palette.tobytes(), rawmode="RGBA")
+        else:
+            rgba = np.asarray(image.convert("RGBA"))
+            out = np.empty_like(rgba)
+            out[..., :3] = remap(rgba)
+            out[..., 3] = rgba[..., 3]
+            swapped = Image.fromarray(out, "RGBA")
+        results.append(swapped)
+
+    return results
+
+
+def process_region(image, region, func):
+    """
+    Aplica func (imagem RGBA -> imagem RGBA do mesmo tamanho) na região
+    (outer, inner) de get_selection_region e cola o resultado de volta em
+    image; sem região processa a imagem toda. Não lê nada da interface,
+    então também roda dentro dos jobs. None se func retornar None.
+    """
+    if region is None:
+        return func(image)
+
+    outer, inner = region
+    result = func(image.crop(outer))
+    if result is None:
+        return None
+
+    image.paste(result.crop(inner), (outer[0] + inner[0], outer[1] + inner[1]))
+    return image
+
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class BackgroundJob(QRunnable):
+    """
+    Roda work(progress, cancelled) fora da thread da interface. O
+    resultado (None se cancelado) e os erros voltam por sinais, que o Qt
+    entrega na thread da interface.
+    """
+
+    def __init__(self, work):
+        super().__init__()
+        self.work = work
+        self.cancel_requested = False
+        self.signals = JobSignals()
+
+    def cancel(self):
+        self.cancel_requested = True
+
+    def is_cancelled(self):
+        return self.cancel_requested
+
+    def run(self):
+        try:
+            result = self.work(self.signals.progress.emit, self.is_cancelled)
+        except Exception as e:
+            import traceback
+
+            self.signals.failed.emit(f"{str(e)}\n\n{traceback.format_exc()}")
+            return
+
+        self.signals.finished.emit(None if self.cancel_requested else result)
+
+
+class GridOverlay(QGraphicsObject):
+    positionChanged = pyqtSignal(int, int)
+
+    def __init__(self, cell_size=32, rows=1, cols=1, subdivisions=False):
+        super().__init__()
+        self.cell_w = self.cell_h = cell_size
+        self.spacing_x = self.spacing_y = 0
+        self.rows = rows
+        self.cols = cols
+        self.subdivisions = subdivisions
+        self.setFlag(QGraphicsObject.GraphicsItemFlag.ItemIsMovable, True)
+        self.setFlag(QGraphicsObject.GraphicsItemFlag.ItemSendsGeometryChanges, True)
+        self.setZValue(10)
+
+    def grid_size(self):
+        width = self.cols * (self.cell_w + self.spacing_x) - self.spacing_x
+        height = self.rows * (self.cell_h + self.spacing_y) - self.spacing_y
+        return width, height
+
+    def boundingRect(self):
+        width, height = self.grid_size()
+        return QRectF(0, 0, width, height)
+
+    def paint(self, painter, option, widget):
+        width, height = self.grid_size()
+
+        pen = QPen(QColor(255, 255, 255), 1, Qt.PenStyle.SolidLine)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+
+        if self.spacing_x or self.spacing_y:
+            # Com espaçamento cada célula tem a própria borda
+            for c in range(self.cols):
+                for r in range(self.rows):
+                    x = c * (self.cell_w + self.spacing_x)
+                    y = r * (self.cell_h + self.spacing_y)
+                    painter.drawRect(x, y, self.cell_w, self.cell_h)
+                    painter.fillRect(
+                        x, y, self.cell_w, self.cell_h, QColor(255, 255, 255, 30)
+                    )
+            return
+
+        painter.drawRect(0, 0, width, height)
+
+        if self.subdivisions or (self.rows > 1 or self.cols > 1):
+            for c in range(1, self.cols):
+                x = c * self.cell_w
+                painter.drawLine(x, 0, x, height)
+
+            for r in range(1, self.rows):
+                y = r * self.cell_h
+                painter.drawLine(0, y, width, y)
+
+        painter.fillRect(0, 0, width, height, QColor(255, 255, 255, 30))
+
+    def itemChange(self, change, value):
+        if change == QGraphicsObject.GraphicsItemChange.ItemPositionChange:
+            new_pos = value
+            self.positionChanged.emit(int(new_pos.x()), int(new_pos.y()))
+        return super().itemChange(change, value)
+
+    def update_grid(self, rows, cols, subdivisions, cell_size=None, spacing=None):
+        self.prepareGeometryChange()
+        self.rows = rows
+        self.cols = cols
+        self.subdivisions = subdivisions
+        if cell_size:
+            self.cell_w, self.cell_h = cell_size
+        if spacing:
+            self.spacing_x, self.spacing_y = spacing
+        self.update()
+
+
+class FineGridOverlay(QGraphicsObject):
+    def __init__(self, image_rect, grid_spacing=4):
+        super().__init__()
+        self.image_rect = image_rect
+        self.grid_spacing = grid_spacing
+        self.setZValue(5)
+        self.visible = False
+
+    def boundingRect(self):
+        return self.image_rect.adjusted(-1, -1, 1, 1)
+
+    def paint(self, painter, option, widget):
+        if not self.visible:
+            return
+
+        rect = self.image_rect
+
+        # Grid fino
+        pen = QPen(QColor(255, 255, 255, 40), 1, Qt.PenStyle.SolidLine)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+
+        # Linhas verticais
+        x = 0
+        while x <= rect.width():
+            painter.drawLine(int(x), 0, int(x), int(rect.height()))
+            x += self.grid_spacing
+
+        # Linhas horizontais
+        y = 0
+        while y <= rect.height():
+            painter.drawLine(0, int(y), int(rect.width()), int(y))
+            y += self.grid_spacing
+
+        # Borda da imagem em vermelho
+        border_pen = QPen(QColor(255, 100, 100, 200), 3, Qt.PenStyle.SolidLine)
+        border_pen.setCosmetic(True)
+        painter.setPen(border_pen)
+        painter.drawRect(rect)
+
+    def set_visible(self, visible):
+        self.visible = visible
+        self.update()
+
+    def update_rect(self, new_rect):
+        self.prepareGeometryChange()
+        self.image_rect = new_rect
+        self.update()
+
+    def set_spacing(self, spacing):
+        self.grid_spacing = spacing
+        self.update()
+
+
+class SelectionRectangle(QGraphicsRectItem):
+    def __init__(self):
+        super().__init__()
+        self.setFlag(
+            QGraphicsRectItem.GraphicsItemFlag.ItemIsMovable, False
+        )  # Desabilitado por padrão
+        self.setFlag(QGraphicsRectItem.GraphicsItemFlag.ItemSendsGeometryChanges, True)
+        self.setFlag(QGraphicsRectItem.GraphicsItemFlag.ItemIsSelectable, True)
+        self.setZValue(15)
+
+        pen = QPen(QColor(0, 150, 255), 2, Qt.PenStyle.DashLine)
+        pen.setCosmetic(True)
+        self.setPen(pen)
+        self.setBrush(QBrush(QColor(0, 150, 255, 30)))
+
+        self.setAcceptHoverEvents(True)
+
+        # Armazena a imagem selecionada como um pixmap item
+        self.selected_pixmap_item = None
+        self.original_rect = None
+
+    def set_rect(self, rect):
+        """Define o retângulo de seleção"""
+        self.setRect(rect)
+        self.original_rect = rect
+
+    def hoverEnterEvent(self, event):
+        self.setCursor(Qt.CursorShape.SizeAllCursor)
+        super().hoverEnterEvent(event)
+
+    def hoverLeaveEvent(self, event):
+        """Restaura o cursor ao sair da seleção"""
+        self.setCursor(Qt.CursorShape.ArrowCursor)
+        super().hoverLeaveEvent(event)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.setCursor(Qt.CursorShape.ClosedHandCursor)
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        """Restaura o cursor após arrastar"""
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.setCursor(Qt.CursorShape.SizeAllCursor)
+        super().mouseReleaseEvent(event)
+
+
+class ZoomableGraphicsView(QGraphicsView):
+    def __init__(self, scene, parent=None):
+        super().__init__(scene, parent)
+        self.setTransformationAnchor(QGraphicsView.ViewportAnchor.NoAnchor)
+        self.zoom_factor = 1.0
+
+    def wheelEvent(self, event: QWheelEvent):
+        modifiers = QApplication.keyboardModifiers()
+
+        if modifiers == Qt.KeyboardModifier.ControlModifier:
+            zoom_in_factor = 1.15
+            zoom_out_factor = 1 / zoom_in_factor
+
+            old_pos = self.mapToScene(event.position().toPoint())
+
+            if event.angleDelta().y() > 0:
+                factor = zoom_in_factor
+                self.zoom_factor *= zoom_in_factor
+            else:
+                factor = zoom_out_factor
+                self.zoom_factor *= zoom_out_factor
+
+            if 0.1 <= self.zoom_factor <= 5.0:
+                self.scale(factor, factor)
+
+                new_pos = self.mapToScene(event.position().toPoint())
+                delta = new_pos - old_pos
+                self.translate(delta.x(), delta.y())
+
+                if hasattr(self.parent(), "update_zoom_label"):
+                    self.parent().update_zoom_label(int(self.zoom_factor * 100))
+            else:
+                self.zoom_factor /= factor
+
+            event.accept()
+        else:
+            super().wheelEvent(event)
+
+
+class SliceWindow(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Sprite Editor - Made by Sherrat")
+        self.resize(900, 600)
+
+        self.setWindowIcon(QIcon("editor.ico"))
+
+        self.setStyleSheet("background-color: #494949; color: white;")
+        self.original_image_pil = None
+        self.current_image_pil = None
+        self.sliced_images = []
+        # Retângulo (x, y, w, h) de origem de cada sprite na imagem
+        self.sliced_rects = []
+        # Mapa de referências: cada célula recortada -> sprite (único) e a
+        # transformação que leva o sprite à célula
+        self.sprite_references = []
+        self.color_picker_mode = False
+        self.paint_color_picker_mode = False
+
+        # Eraser tool
+        self.eraser_mode = False
+        self.eraser_size = 10
+        self.eraser_feathering = 0  # NOVA VARIÁVEL
+        self.last_eraser_point = None
+        
+        self.cut_size_mode = False
+        self.rotate_fine_angle = 0        
+        self.cut_rect_item = None
+        self.is_drawing_cut_rect = False
+        self.cut_start_pos = None        
+
+        self.paint_mode = False
+        self.paint_size = 5
+        self.paint_color = QColor(0, 0, 0, 255)
+        self.last_paint_point = None
+        self.paint_feathering = 0
+
+        self.brush_type = "Circle"
+        self.spray_density = 0.3  # 0–1, fração de pontos pintados no círculo
+        self.texture_brush_image = None  # PIL.Image para textura do pincel
+
+        self.outline_color = QColor(0, 0, 0, 255)  # Preto por padrão
+
+        self.selection_mode = False
+        self.selection_start = None
+        self.selection_rect_item = None
+        self.is_drawing_selection = False
+        self.selected_image_data = None
+
+        self.is_moving_selection = False
+        self.move_start_pos = None
+        self.selection_image_backup = None  # Backup da área original
+        self.floating_selection_pixmap = None
+
+        # Fine Grid
+        self.fine_grid_item = None
+        self.fine_grid_enabled = False
+        self.fine_grid_spacing = 32
+
+        # === LAYERS SYSTEM ===
+        self.layers = []  # Lista de Layer objects
+        self.active_layer_id = None  # ID do layer ativo
+        self.layer_widgets = {}  # Mapeamento de ID -> LayerWidget
+        self.layer_graphics_items = {}  # Mapeamento de ID -> DraggableLayerItem
+        self.is_dragging_layer = False
+        self.layer_drag_start = None
+
+        self.undo_stack = []
+        self.redo_stack = []
+        self.max_undo_steps = 20
+
+        # Documento indexado (buffer uint8 + paleta) para pixel art
+        self.indexed_mode = False
+        self.document_palette = None
+
+        # Palette swap: paleta extraída (source) -> paleta alvo (target)
+        self.source_palette = None
+        self.target_palette = None
+
+        # Job em segundo plano (AI upscale / remoção de fundo)
+        self.active_job = None
+        self.warmup_job = None
+        # Conferência dos pesos (hash) em segundo plano
+        self.model_status_job = None
+        # Muda a cada edição/undo/troca de imagem (ver start_background_job)
+        self.document_generation = 0
+
+        # Pasta dos modelos de IA escolhida pelo usuário
+        self.settings = QSettings("SpriteEditor", "SpriteEditor")
+        model_dir = self.settings.value("models/dir", "")
+        if model_dir:
+            set_model_directory(model_dir)
+        if self.settings.value("cache/disk", False, type=bool):
+            RESULT_CACHE.directory = default_cache_dir()
+
+        # Live preview (proxy do tamanho da viewport)
+        self.preview_kind = None
+        self.preview_item = None
+        # Saída do plano de cor, reaproveitada pelo preview e pelo Apply
+        self.color_buffer = None
+        self.preview_histograms = None
+        self.preview_source = None
+
+        screen = QApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 60
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(int(1000 / max(30, refresh_rate)))
+        self.preview_timer.timeout.connect(self.render_preview)
+
+        self.init_ui()
+
+        # Aquece os modelos usados por último quando a janela ficar ociosa:
+        # qualquer clique/tecla/scroll reinicia a contagem (ver eventFilter)
+        self.warmup_timer = QTimer(self)
+        self.warmup_timer.setSingleShot(True)
+        self.warmup_timer.setInterval(1500)
+        self.warmup_timer.timeout.connect(self.on_idle_warmup)
+        if self.settings.value("warmup/enabled", True, type=bool):
+            QApplication.instance().installEventFilter(self)
+            self.warmup_timer.start()
+
+    def init_ui(self):
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.setSpacing(0)
+
+        toolbar = QFrame()
+        toolbar.setFixedHeight(40)
+        toolbar.setStyleSheet("background-color: #333; border-bottom: 1px solid #222;")
+        tb_layout = QHBoxLayout(toolbar)
+        tb_layout.setContentsMargins(10, 5, 10, 5)
+
+        btn_open = QPushButton("Open Image")
+        btn_open.setStyleSheet("background-color: #555; padding: 5px;")
+        btn_open.clicked.connect(self.open_image)
+        tb_layout.addWidget(btn_open)
+
+        # Novo botão: Export Project (exporta a imagem atual inteira, sem slices)
+        btn_export_project = QPushButton("Export Project")
+        btn_export_project.setStyleSheet(
+            "background-color: #28a745; padding: 5px; font-weight: bold;"
+        )
+        btn_export_project.clicked.connect(self.export_full_project)
+        tb_layout.addWidget(btn_export_project)
+
+        tb_layout.addStretch()
+
+        self.chk_live_preview = QCheckBox("Live Preview")
+        self.chk_live_preview.setChecked(True)
+        self.chk_live_preview.setToolTip(
+            "Mostra o resultado de cor, denoise, outline e rotate enquanto os\n"
+            "controles mudam. A imagem só é alterada ao clicar em Apply."
+        )
+        self.chk_live_preview.toggled.connect(self.on_live_preview_toggled)
+        tb_layout.addWidget(self.chk_live_preview)
+
+        # Erro do último preview (some no próximo preview que der certo)
+        self.lbl_preview_status = QLabel("")
+        self.lbl_preview_status.setStyleSheet("color: #e0a040; font-size: 10px;")
+        tb_layout.addWidget(self.lbl_preview_status)
+
+        btn_rot_r = QPushButton("Rot 90°")
+        btn_rot_r.clicked.connect(lambda: self.transform_image("rotate_90"))
+        tb_layout.addWidget(btn_rot_r)
+
+        btn_flip_h = QPushButton("Flip H")
         btn_flip_h.clicked.connect(lambda: self.transform_image("flip_h"))
         tb_layout.addWidget(btn_flip_h)
 
@@ -677,20 +3223,37 @@ class SliceWindow(QWidget):
 
         edges_layout.addWidget(QLabel("Thickness:"), 5, 0)
         self.spin_outline_thickness = QSpinBox()
-        self.spin_outline_thickness.setRange(1, 20)
+        self.spin_outline_thickness.setRange(1, 100)
         self.spin_outline_thickness.setValue(2)
         self.spin_outline_thickness.setSuffix("px")
+        self.spin_outline_thickness.valueChanged.connect(
+            lambda: self.schedule_preview("outline")
+        )
         edges_layout.addWidget(self.spin_outline_thickness, 5, 1)
 
-        edges_layout.addWidget(QLabel("Feathering:"), 6, 0)
+        edges_layout.addWidget(QLabel("Position:"), 6, 0)
+        self.combo_outline_placement = QComboBox()
+        self.combo_outline_placement.addItems(OUTLINE_PLACEMENTS)
+        self.combo_outline_placement.setToolTip(
+            "Outside = fora do sprite, Inside = dentro, Center = metade em cada lado"
+        )
+        self.combo_outline_placement.currentIndexChanged.connect(
+            lambda: self.schedule_preview("outline")
+        )
+        edges_layout.addWidget(self.combo_outline_placement, 6, 1)
+
+        edges_layout.addWidget(QLabel("Feathering:"), 7, 0)
         self.spin_outline_feathering = QSpinBox()
         self.spin_outline_feathering.setRange(0, 100)
         self.spin_outline_feathering.setValue(0)
         self.spin_outline_feathering.setSuffix("%")
         self.spin_outline_feathering.setToolTip(
-            "0% = bordas duras, 100% = máxima suavização"
+            "0% = bordas duras, 100% = queda suave (anti-aliased) do tamanho da espessura"
+        )
+        self.spin_outline_feathering.valueChanged.connect(
+            lambda: self.schedule_preview("outline")
         )
-        edges_layout.addWidget(self.spin_outline_feathering, 6, 1)
+        edges_layout.addWidget(self.spin_outline_feathering, 7, 1)
 
         self.btn_apply_outline = QPushButton("Apply Outline")
         self.btn_apply_outline.setStyleSheet(
@@ -698,25 +3261,27 @@ class SliceWindow(QWidget):
         )
         self.btn_apply_outline.clicked.connect(self.apply_outline)
         self.btn_apply_outline.setEnabled(False)
-        edges_layout.addWidget(self.btn_apply_outline, 7, 0, 1, 2)
+        edges_layout.addWidget(self.btn_apply_outline, 8, 0, 1, 2)
 
         # Edge Eraser
-        edges_layout.addWidget(QLabel("Edge Eraser:"), 8, 0, 1, 2)
+        edges_layout.addWidget(QLabel("Edge Eraser:"), 9, 0, 1, 2)
 
-        edges_layout.addWidget(QLabel("Distance:"), 9, 0)
+        edges_layout.addWidget(QLabel("Distance:"), 10, 0)
         self.spin_edge_eraser_distance = QSpinBox()
         self.spin_edge_eraser_distance.setRange(1, 50)
         self.spin_edge_eraser_distance.setValue(5)
         self.spin_edge_eraser_distance.setSuffix("px")
-        self.spin_edge_eraser_distance.setToolTip("Distância das bordas para apagar")
-        edges_layout.addWidget(self.spin_edge_eraser_distance, 9, 1)
+        self.spin_edge_eraser_distance.setToolTip(
+            "Distância das bordas para apagar (limitado à seleção, se houver)"
+        )
+        edges_layout.addWidget(self.spin_edge_eraser_distance, 10, 1)
 
-        edges_layout.addWidget(QLabel("Feathering:"), 10, 0)
+        edges_layout.addWidget(QLabel("Feathering:"), 11, 0)
         self.spin_edge_eraser_feathering = QSpinBox()
         self.spin_edge_eraser_feathering.setRange(0, 100)
         self.spin_edge_eraser_feathering.setValue(0)
         self.spin_edge_eraser_feathering.setSuffix("%")
-        edges_layout.addWidget(self.spin_edge_eraser_feathering, 10, 1)
+        edges_layout.addWidget(self.spin_edge_eraser_feathering, 11, 1)
 
         self.btn_erase_edges = QPushButton("Erase Edges")
         self.btn_erase_edges.setStyleSheet(
@@ -724,7 +3289,7 @@ class SliceWindow(QWidget):
         )
         self.btn_erase_edges.clicked.connect(self.erase_edges)
         self.btn_erase_edges.setEnabled(False)
-        edges_layout.addWidget(self.btn_erase_edges, 11, 0, 1, 2)
+        edges_layout.addWidget(self.btn_erase_edges, 12, 0, 1, 2)
 
         grp_edges.setLayout(edges_layout)
         tab_resize_layout.addWidget(grp_edges)
@@ -790,7 +3355,80 @@ class SliceWindow(QWidget):
         else:
             self.btn_remove_bg_ai.setToolTip("Remove background usando IA (U2Net)")
 
-        transparency_layout.addWidget(self.btn_remove_bg_ai, 5, 0, 1, 2)
+        transparency_layout.addWidget(QLabel("AI Model:"), 5, 0)
+        self.combo_rembg_model = QComboBox()
+        self.combo_rembg_model.addItems(REMBG_MODELS)
+        self.combo_rembg_model.setToolTip(
+            "u2netp é mais leve; isnet-anime costuma ir melhor em arte 2D"
+        )
+        transparency_layout.addWidget(self.combo_rembg_model, 5, 1)
+
+        transparency_layout.addWidget(QLabel("AI Threads:"), 6, 0)
+        self.spin_rembg_threads = QSpinBox()
+        self.spin_rembg_threads.setRange(0, 64)
+        self.spin_rembg_threads.setValue(0)
+        self.spin_rembg_threads.setSpecialValueText("Auto")
+        self.spin_rembg_threads.setToolTip("Threads do onnxruntime (Auto = padrão)")
+        transparency_layout.addWidget(self.spin_rembg_threads, 6, 1)
+
+        transparency_layout.addWidget(self.btn_remove_bg_ai, 7, 0, 1, 2)
+
+        # GRUPO: Palette (documento indexado)
+        grp_palette = QGroupBox("Palette")
+        palette_layout = QGridLayout()
+
+        self.chk_indexed_mode = QCheckBox("Indexed Color Mode")
+        self.chk_indexed_mode.setToolTip(
+            "Guarda a imagem como índices de 1 byte + paleta (até 256 cores).\n"
+            "Usa ~4x menos memória no canvas, layers e undo.\n"
+            "Pincel e borracha pintam cores sólidas da paleta."
+        )
+        self.chk_indexed_mode.toggled.connect(self.toggle_indexed_mode)
+        palette_layout.addWidget(self.chk_indexed_mode, 0, 0, 1, 2)
+
+        self.lbl_palette_info = QLabel("")
+        self.lbl_palette_info.setStyleSheet("color: #aaa; font-size: 10px;")
+        self.lbl_palette_info.setWordWrap(True)
+        palette_layout.addWidget(self.lbl_palette_info, 1, 0, 1, 2)
+
+        palette_layout.addWidget(QLabel("Colors:"), 2, 0)
+        self.spin_palette_colors = QSpinBox()
+        self.spin_palette_colors.setRange(2, 256)
+        self.spin_palette_colors.setValue(16)
+        palette_layout.addWidget(self.spin_palette_colors, 2, 1)
+
+        self.btn_extract_palette = QPushButton("Extract Palette")
+        self.btn_extract_palette.setToolTip(
+            "Extrai a paleta (median cut + k-means) da imagem ou dos sprites"
+        )
+        self.btn_extract_palette.clicked.connect(self.extract_source_palette)
+        palette_layout.addWidget(self.btn_extract_palette, 3, 0, 1, 2)
+
+        palette_layout.addWidget(QLabel("Source:"), 4, 0)
+        self.lbl_source_palette = QLabel()
+        palette_layout.addWidget(self.lbl_source_palette, 4, 1)
+
+        palette_layout.addWidget(QLabel("Target:"), 5, 0)
+        self.lbl_target_palette = QLabel()
+        self.lbl_target_palette.setToolTip("Clique em uma cor para editar")
+        self.lbl_target_palette.mousePressEvent = self.edit_target_palette_color
+        palette_layout.addWidget(self.lbl_target_palette, 5, 1)
+
+        self.btn_load_palette = QPushButton("Load Target Palette...")
+        self.btn_load_palette.clicked.connect(self.load_target_palette)
+        palette_layout.addWidget(self.btn_load_palette, 6, 0, 1, 2)
+
+        palette_layout.addWidget(QLabel("Apply to:"), 7, 0)
+        self.combo_palette_scope = QComboBox()
+        self.combo_palette_scope.addItems(PALETTE_SWAP_SCOPES)
+        palette_layout.addWidget(self.combo_palette_scope, 7, 1)
+
+        self.btn_swap_palette = QPushButton("Swap Palette")
+        self.btn_swap_palette.clicked.connect(self.apply_palette_swap)
+        palette_layout.addWidget(self.btn_swap_palette, 8, 0, 1, 2)
+
+        grp_palette.setLayout(palette_layout)
+        tab_transparency_layout.addWidget(grp_palette)
 
         # GRUPO 2: Color Adjustments (NOVO)
         grp_color_adjust = QGroupBox("Color Adjustments")
@@ -988,18 +3626,52 @@ class SliceWindow(QWidget):
 
         grp_cells_layout.addWidget(QLabel("Cols:"), 4, 0)
         self.spin_cols = QSpinBox()
-        self.spin_cols.setRange(1, 100)
+        self.spin_cols.setRange(1, 1024)
         self.spin_cols.setValue(1)
         self.spin_cols.valueChanged.connect(self.update_grid_visuals)
         grp_cells_layout.addWidget(self.spin_cols, 4, 1)
 
         grp_cells_layout.addWidget(QLabel("Rows:"), 5, 0)
         self.spin_rows = QSpinBox()
-        self.spin_rows.setRange(1, 100)
+        self.spin_rows.setRange(1, 1024)
         self.spin_rows.setValue(1)
         self.spin_rows.valueChanged.connect(self.update_grid_visuals)
         grp_cells_layout.addWidget(self.spin_rows, 5, 1)
 
+        grp_cells_layout.addWidget(QLabel("Cell W:"), 6, 0)
+        self.spin_cell_w = QSpinBox()
+        self.spin_cell_w.setRange(1, 4096)
+        self.spin_cell_w.setValue(32)
+        self.spin_cell_w.valueChanged.connect(self.update_grid_visuals)
+        grp_cells_layout.addWidget(self.spin_cell_w, 6, 1)
+
+        grp_cells_layout.addWidget(QLabel("Cell H:"), 7, 0)
+        self.spin_cell_h = QSpinBox()
+        self.spin_cell_h.setRange(1, 4096)
+        self.spin_cell_h.setValue(32)
+        self.spin_cell_h.valueChanged.connect(self.update_grid_visuals)
+        grp_cells_layout.addWidget(self.spin_cell_h, 7, 1)
+
+        grp_cells_layout.addWidget(QLabel("Spacing X:"), 8, 0)
+        self.spin_spacing_x = QSpinBox()
+        self.spin_spacing_x.setRange(0, 512)
+        self.spin_spacing_x.valueChanged.connect(self.update_grid_visuals)
+        grp_cells_layout.addWidget(self.spin_spacing_x, 8, 1)
+
+        grp_cells_layout.addWidget(QLabel("Spacing Y:"), 9, 0)
+        self.spin_spacing_y = QSpinBox()
+        self.spin_spacing_y.setRange(0, 512)
+        self.spin_spacing_y.valueChanged.connect(self.update_grid_visuals)
+        grp_cells_layout.addWidget(self.spin_spacing_y, 9, 1)
+
+        self.btn_detect_grid = QPushButton("Detect Grid")
+        self.btn_detect_grid.setToolTip(
+            "Propõe tamanho da célula, offset e espaçamento a partir dos\n"
+            "perfis de alpha das linhas e colunas da imagem"
+        )
+        self.btn_detect_grid.clicked.connect(self.detect_grid_settings)
+        grp_cells_layout.addWidget(self.btn_detect_grid, 10, 0, 1, 2)
+
         grp_cells.setLayout(grp_cells_layout)
         tab_slice_layout.addWidget(grp_cells)
 
@@ -1011,6 +3683,64 @@ class SliceWindow(QWidget):
         self.btn_cut.clicked.connect(self.cut_image)
         tab_slice_layout.addWidget(self.btn_cut)
 
+        # Auto slice: sprites empacotados sem grade
+        grp_auto_slice = QGroupBox("Auto Slice")
+        auto_slice_layout = QGridLayout()
+
+        auto_slice_layout.addWidget(QLabel("Merge Distance:"), 0, 0)
+        self.spin_merge_distance = QSpinBox()
+        self.spin_merge_distance.setRange(0, 64)
+        self.spin_merge_distance.setValue(1)
+        self.spin_merge_distance.setSuffix(" px")
+        self.spin_merge_distance.setToolTip(
+            "Partes separadas por até esta distância viram um sprite só\n"
+            "(efeitos, sombras e olhos soltos continuam com o personagem)"
+        )
+        auto_slice_layout.addWidget(self.spin_merge_distance, 0, 1)
+
+        auto_slice_layout.addWidget(QLabel("Min Area:"), 1, 0)
+        self.spin_min_area = QSpinBox()
+        self.spin_min_area.setRange(1, 100000)
+        self.spin_min_area.setValue(4)
+        self.spin_min_area.setSuffix(" px")
+        self.spin_min_area.setToolTip("Ignora manchas com menos pixels visíveis")
+        auto_slice_layout.addWidget(self.spin_min_area, 1, 1)
+
+        self.btn_auto_slice = QPushButton("AUTO SLICE")
+        self.btn_auto_slice.setStyleSheet(
+            "background-color: #16a085; font-weight: bold; color: white;"
+        )
+        self.btn_auto_slice.setToolTip(
+            "Detecta os sprites pelo canal alpha (componentes conexos)\n"
+            "e recorta cada um justo, sem usar a grade"
+        )
+        self.btn_auto_slice.clicked.connect(self.auto_slice_image)
+        auto_slice_layout.addWidget(self.btn_auto_slice, 2, 0, 1, 2)
+
+        grp_auto_slice.setLayout(auto_slice_layout)
+        tab_slice_layout.addWidget(grp_auto_slice)
+
+        grp_duplicates = QGroupBox("Duplicates")
+        duplicates_layout = QVBoxLayout()
+
+        self.chk_dedupe = QCheckBox("Remove Duplicates")
+        self.chk_dedupe.setToolTip(
+            "Sprites repetidos entram uma vez só na lista; as células\n"
+            "repetidas ficam no mapa exportado junto com os sprites"
+        )
+        duplicates_layout.addWidget(self.chk_dedupe)
+
+        self.chk_dedupe_variants = QCheckBox("Match Flips/Rotations")
+        self.chk_dedupe_variants.setToolTip(
+            "Também trata versões espelhadas ou rotacionadas como duplicatas"
+        )
+        self.chk_dedupe_variants.setEnabled(False)
+        self.chk_dedupe.toggled.connect(self.chk_dedupe_variants.setEnabled)
+        duplicates_layout.addWidget(self.chk_dedupe_variants)
+
+        grp_duplicates.setLayout(duplicates_layout)
+        tab_slice_layout.addWidget(grp_duplicates)
+
         grp_eraser = QGroupBox("Eraser Tool")
         eraser_layout = QGridLayout()
 
@@ -1162,8 +3892,9 @@ class SliceWindow(QWidget):
 
         denoise_layout.addWidget(QLabel("Method:"), 0, 0)
         self.combo_denoise_method = QComboBox()
-        self.combo_denoise_method.addItems(
-            ["Median Filter", "Gaussian Blur", "Smooth Filter", "Smooth More"]
+        self.combo_denoise_method.addItems(DENOISE_METHODS)
+        self.combo_denoise_method.currentIndexChanged.connect(
+            lambda: self.schedule_preview("denoise")
         )
         denoise_layout.addWidget(self.combo_denoise_method, 0, 1)
 
@@ -1178,7 +3909,11 @@ class SliceWindow(QWidget):
 
 
         self.spin_denoise_strength.setToolTip(
-            "Kernel size para Median ou raio para Gaussian"
+            "Kernel size para Median, raio para Gaussian/Bilateral,\n"
+            "repetições para Smooth ou intensidade para Non-Local Means"
+        )
+        self.spin_denoise_strength.valueChanged.connect(
+            lambda: self.schedule_preview("denoise")
         )
         denoise_layout.addWidget(self.spin_denoise_strength, 1, 1)
 
@@ -1203,6 +3938,8 @@ class SliceWindow(QWidget):
                 "RealESRGAN x4 (General)",
                 "RealESRGAN x4 Anime",
                 "RealESRGAN x2",
+                "Pixel Art: Scale2x/3x (EPX)",
+                "Pixel Art: xBR",
             ]
         )
         self.combo_upscale_model.setCurrentIndex(1)
@@ -1229,6 +3966,42 @@ class SliceWindow(QWidget):
         self.chk_use_gpu.setToolTip("Requer NVIDIA GPU com CUDA instalado")
         upscale_layout.addWidget(self.chk_use_gpu, 3, 0, 1, 2)
 
+        upscale_layout.addWidget(QLabel("Backend:"), 4, 0)
+        self.combo_upscale_backend = QComboBox()
+        self.combo_upscale_backend.addItems(UPSCALE_BACKENDS)
+        self.combo_upscale_backend.setToolTip(
+            "ONNX Runtime roda o modelo exportado para ONNX só na CPU"
+        )
+        self.combo_upscale_backend.currentIndexChanged.connect(
+            self.on_upscale_backend_changed
+        )
+        upscale_layout.addWidget(self.combo_upscale_backend, 4, 1)
+
+        upscale_layout.addWidget(QLabel("ONNX Threads:"), 5, 0)
+        self.spin_onnx_threads = QSpinBox()
+        self.spin_onnx_threads.setRange(0, 64)
+        self.spin_onnx_threads.setValue(0)
+        self.spin_onnx_threads.setSpecialValueText("Auto")
+        self.spin_onnx_threads.setToolTip("intra_op_num_threads do onnxruntime")
+        upscale_layout.addWidget(self.spin_onnx_threads, 5, 1)
+
+        upscale_layout.addWidget(QLabel("ONNX Graph Opt.:"), 6, 0)
+        self.combo_onnx_optimization = QComboBox()
+        self.combo_onnx_optimization.addItems(ONNX_OPTIMIZATION_LEVELS)
+        upscale_layout.addWidget(self.combo_onnx_optimization, 6, 1)
+
+        upscale_layout.addWidget(QLabel("Tile Size:"), 7, 0)
+        self.spin_upscale_tile = QSpinBox()
+        self.spin_upscale_tile.setRange(0, 2048)
+        self.spin_upscale_tile.setSingleStep(32)
+        self.spin_upscale_tile.setValue(0)
+        self.spin_upscale_tile.setSpecialValueText("Auto")
+        self.spin_upscale_tile.setToolTip(
+            "Auto: escolhe o tile pela memória livre e o tamanho da imagem.\n"
+            "Tiles menores usam menos RAM, mas demoram um pouco mais."
+        )
+        upscale_layout.addWidget(self.spin_upscale_tile, 7, 1)
+
         # Botão Apply
         self.btn_apply_upscale = QPushButton("Apply AI Upscale")
         self.btn_apply_upscale.setStyleSheet(
@@ -1242,7 +4015,7 @@ class SliceWindow(QWidget):
         else:
             self.btn_apply_upscale.setEnabled(False)
 
-        upscale_layout.addWidget(self.btn_apply_upscale, 4, 0, 1, 2)
+        upscale_layout.addWidget(self.btn_apply_upscale, 8, 0, 1, 2)
 
         # Label de status
         self.lbl_upscale_status = QLabel("")
@@ -1252,11 +4025,174 @@ class SliceWindow(QWidget):
         if not REALESRGAN_AVAILABLE:
             self.lbl_upscale_status.setText("⚠️ Real-ESRGAN não disponível")
 
-        upscale_layout.addWidget(self.lbl_upscale_status, 5, 0, 1, 2)
+        upscale_layout.addWidget(self.lbl_upscale_status, 9, 0, 1, 2)
+
+        self.btn_unload_models = QPushButton("Unload Models")
+        self.btn_unload_models.setToolTip(
+            "Libera os modelos de IA mantidos em memória entre upscales"
+        )
+        self.btn_unload_models.clicked.connect(self.unload_ai_models)
+        self.btn_unload_models.setEnabled(
+            REALESRGAN_AVAILABLE or REMBG_AVAILABLE or ONNXRUNTIME_AVAILABLE
+        )
+        upscale_layout.addWidget(self.btn_unload_models, 10, 0, 1, 2)
+
+        # Registro local de modelos (uso offline)
+        self.lbl_model_registry = QLabel("")
+        self.lbl_model_registry.setStyleSheet("color: #aaa; font-size: 10px;")
+        self.lbl_model_registry.setWordWrap(True)
+        upscale_layout.addWidget(self.lbl_model_registry, 11, 0, 1, 2)
+
+        models_buttons = QHBoxLayout()
+        btn_models_dir = QPushButton("Models Folder...")
+        btn_models_dir.clicked.connect(self.choose_model_directory)
+        models_buttons.addWidget(btn_models_dir)
+
+        btn_import_model = QPushButton("Import Model...")
+        btn_import_model.setToolTip("Copia um .pth baixado para a pasta de modelos")
+        btn_import_model.clicked.connect(self.import_model_file)
+        models_buttons.addWidget(btn_import_model)
+
+        self.btn_download_models = QPushButton("Download Missing")
+        self.btn_download_models.clicked.connect(self.download_missing_models)
+        models_buttons.addWidget(self.btn_download_models)
+        upscale_layout.addLayout(models_buttons, 12, 0, 1, 2)
+
+        self.btn_benchmark_upscale = QPushButton("Benchmark Backends")
+        self.btn_benchmark_upscale.setToolTip(
+            "Compara a latência de CPU (ms por megapixel) do PyTorch e do onnxruntime"
+        )
+        self.btn_benchmark_upscale.clicked.connect(self.benchmark_upscale)
+        upscale_layout.addWidget(self.btn_benchmark_upscale, 13, 0, 1, 2)
+        self.on_upscale_backend_changed(self.combo_upscale_backend.currentIndex())
+
+        self.upscale_model_labels = [
+            self.combo_upscale_model.itemText(i)
+            for i in range(self.combo_upscale_model.count())
+        ]
+        if REALESRGAN_AVAILABLE or ONNXRUNTIME_AVAILABLE:
+            self.refresh_model_status()
+        else:
+            for i in range(models_buttons.count()):
+                models_buttons.itemAt(i).widget().setEnabled(False)
 
         grp_upscale.setLayout(upscale_layout)
         tab_upscale_layout.addWidget(grp_upscale)
 
+        # GRUPO: Perfil de CPU do backend PyTorch
+        grp_cpu_profile = QGroupBox("CPU Profile (PyTorch)")
+        cpu_profile_layout = QGridLayout()
+
+        cpu_profile_layout.addWidget(QLabel("Threads:"), 0, 0)
+        self.spin_torch_threads = QSpinBox()
+        self.spin_torch_threads.setRange(0, 256)
+        self.spin_torch_threads.setValue(0)
+        self.spin_torch_threads.setSpecialValueText("Auto")
+        self.spin_torch_threads.setToolTip(
+            "torch.set_num_threads (vale para todo o processo, inclusive o aquecimento)"
+        )
+        if REALESRGAN_AVAILABLE:
+            self.spin_torch_threads.valueChanged.connect(set_torch_threads)
+        cpu_profile_layout.addWidget(self.spin_torch_threads, 0, 1)
+
+        self.chk_inference_mode = QCheckBox("Inference Mode")
+        self.chk_inference_mode.setChecked(True)
+        self.chk_inference_mode.setToolTip("Roda dentro de torch.inference_mode()")
+        cpu_profile_layout.addWidget(self.chk_inference_mode, 1, 0)
+
+        self.chk_channels_last = QCheckBox("Channels Last")
+        self.chk_channels_last.setToolTip(
+            "Pesos no formato NHWC (costuma acelerar convoluções com oneDNN)"
+        )
+        cpu_profile_layout.addWidget(self.chk_channels_last, 1, 1)
+
+        cpu_profile_layout.addWidget(QLabel("Precision:"), 2, 0)
+        self.combo_cpu_precision = QComboBox()
+        self.combo_cpu_precision.addItems(["FP32", "BF16 (autocast)"])
+        self.combo_cpu_precision.setToolTip(
+            "BF16 só acelera em CPUs com AVX512-BF16/AMX; perde um pouco de qualidade"
+        )
+        cpu_profile_layout.addWidget(self.combo_cpu_precision, 2, 1)
+
+        self.btn_cpu_profile_report = QPushButton("Profile Report")
+        self.btn_cpu_profile_report.setToolTip(
+            "Compara latência e qualidade (PSNR) de perfis de CPU nesta máquina"
+        )
+        self.btn_cpu_profile_report.clicked.connect(self.run_cpu_profile_report)
+        self.btn_cpu_profile_report.setEnabled(REALESRGAN_AVAILABLE)
+        cpu_profile_layout.addWidget(self.btn_cpu_profile_report, 3, 0, 1, 2)
+
+        grp_cpu_profile.setLayout(cpu_profile_layout)
+        tab_upscale_layout.addWidget(grp_cpu_profile)
+
+        # GRUPO: Batch AI dos sprites cortados
+        grp_batch_ai = QGroupBox("Batch AI (Sprites)")
+        batch_ai_layout = QGridLayout()
+
+        batch_ai_layout.addWidget(QLabel("Operation:"), 0, 0)
+        self.combo_batch_ai = QComboBox()
+        self.combo_batch_ai.addItems(["AI Upscale", "Remove Background"])
+        batch_ai_layout.addWidget(self.combo_batch_ai, 0, 1)
+
+        batch_ai_layout.addWidget(QLabel("Padding:"), 1, 0)
+        self.spin_batch_padding = QSpinBox()
+        self.spin_batch_padding.setRange(2, 64)
+        self.spin_batch_padding.setValue(12)
+        self.spin_batch_padding.setToolTip(
+            "Espaço transparente entre sprites no atlas (evita que um vaze no outro)"
+        )
+        batch_ai_layout.addWidget(self.spin_batch_padding, 1, 1)
+
+        self.btn_batch_ai = QPushButton("Process All Sprites")
+        self.btn_batch_ai.setToolTip(
+            "Junta os sprites em atlas e passa cada atlas uma vez pelo modelo.\n"
+            "Usa as opções de AI Upscale acima e o modelo rembg da aba Color."
+        )
+        self.btn_batch_ai.clicked.connect(self.batch_ai_sprites)
+        batch_ai_layout.addWidget(self.btn_batch_ai, 2, 0, 1, 2)
+
+        grp_batch_ai.setLayout(batch_ai_layout)
+        tab_upscale_layout.addWidget(grp_batch_ai)
+
+        # Cache de resultados (upscale, rembg e denoise)
+        grp_result_cache = QGroupBox("Result Cache")
+        result_cache_layout = QGridLayout()
+
+        self.chk_disk_cache = QCheckBox("Keep results on disk")
+        self.chk_disk_cache.setChecked(RESULT_CACHE.directory is not None)
+        self.chk_disk_cache.setToolTip(
+            f"Guarda os resultados também em {default_cache_dir()}\n"
+            "para reaproveitar entre sessões."
+        )
+        self.chk_disk_cache.toggled.connect(self.toggle_disk_cache)
+        result_cache_layout.addWidget(self.chk_disk_cache, 0, 0, 1, 2)
+
+        self.lbl_cache_info = QLabel()
+        self.lbl_cache_info.setWordWrap(True)
+        result_cache_layout.addWidget(self.lbl_cache_info, 1, 0, 1, 2)
+
+        self.btn_clear_cache = QPushButton("Clear Cache")
+        self.btn_clear_cache.setToolTip("Apaga os resultados guardados (memória e disco)")
+        self.btn_clear_cache.clicked.connect(self.clear_result_cache)
+        result_cache_layout.addWidget(self.btn_clear_cache, 2, 0, 1, 2)
+
+        grp_result_cache.setLayout(result_cache_layout)
+        tab_upscale_layout.addWidget(grp_result_cache)
+        self.update_cache_info()
+
+        self.chk_warmup = QCheckBox("Warm up last-used AI models on startup")
+        self.chk_warmup.setChecked(
+            self.settings.value("warmup/enabled", True, type=bool)
+        )
+        self.chk_warmup.setToolTip(
+            "Com a janela ociosa, carrega em segundo plano os últimos modelos\n"
+            "de upscale e rembg usados. Para sozinho ao iniciar um processamento."
+        )
+        self.chk_warmup.toggled.connect(
+            lambda enabled: self.settings.setValue("warmup/enabled", enabled)
+        )
+        tab_upscale_layout.addWidget(self.chk_warmup)
+
         tab_upscale_layout.addStretch()
 
         self.tab_widget.addTab(tab_resize, "Adjust")
@@ -1264,6 +4200,7 @@ class SliceWindow(QWidget):
         self.tab_widget.addTab(tab_slice, "Tools")
         self.tab_widget.addTab(tab_upscale, "Upscale")
 
+        self.tab_widget.currentChanged.connect(lambda _: self.clear_preview())
         lp_layout.addWidget(self.tab_widget)
 
         grp_zoom = QGroupBox("Zoom")
@@ -1295,6 +4232,10 @@ class SliceWindow(QWidget):
         self.view.mouseMoveEvent = self.view_mouse_move
         self.view.mouseReleaseEvent = self.view_mouse_release
 
+        # Ao rolar, o preview é refeito para a nova região visível
+        self.view.horizontalScrollBar().valueChanged.connect(self.on_view_scrolled)
+        self.view.verticalScrollBar().valueChanged.connect(self.on_view_scrolled)
+
         content_layout.addWidget(self.view, 1)
 
         self.pixmap_item = QGraphicsPixmapItem()
@@ -1339,6 +4280,17 @@ class SliceWindow(QWidget):
         self.btn_export.clicked.connect(self.export_sprites)
         self.btn_export.setEnabled(False)
         rp_layout.addWidget(self.btn_export)
+
+        export_options_layout = QHBoxLayout()
+        export_options_layout.addWidget(QLabel("PNG:"))
+        self.combo_export_compression = QComboBox()
+        self.combo_export_compression.addItems(list(PNG_COMPRESSION))
+        self.combo_export_compression.setToolTip(
+            "Fast: arquivos um pouco maiores, exportação rápida\n"
+            "Optimized: menor tamanho, bem mais lento"
+        )
+        export_options_layout.addWidget(self.combo_export_compression, 1)
+        rp_layout.addLayout(export_options_layout)
         
         self.btn_import = QPushButton("Import SPR")
         self.btn_import.setFixedHeight(30)
@@ -1394,7 +4346,18 @@ class SliceWindow(QWidget):
             return
         
         self.sliced_images.pop(index)
+        self.sliced_rects.pop(index)
         self.list_widget.takeItem(index)
+
+        # Células do sprite removido saem do mapa; as seguintes andam uma posição
+        references = []
+        for reference in self.sprite_references:
+            if reference["sprite"] == index:
+                continue
+            if reference["sprite"] > index:
+                reference = dict(reference, sprite=reference["sprite"] - 1)
+            references.append(reference)
+        self.sprite_references = references
         
         if len(self.sliced_images) == 0:
             self.btn_export.setEnabled(False)
@@ -1520,8 +4483,8 @@ class SliceWindow(QWidget):
                 new_image.paste(cropped, (paste_x, paste_y))
             
             # Atualiza a imagem
-            self.current_image_pil = new_image
-            self.original_image_pil = new_image.copy()
+            self.current_image_pil = self.filter_result_to_document(new_image)
+            self.original_image_pil = self.current_image_pil.copy()
             
             # Atualiza o layer main
             main_layer = self.get_main_layer()
@@ -2070,7 +5033,7 @@ class SliceWindow(QWidget):
             return
 
         # Cria uma nova imagem com o tamanho necessário para conter todos os layers
-        result = main_layer.image.copy()
+        result = main_layer.image.convert("RGBA")
 
         # Compõe cada layer visível sobre o resultado
         for layer in self.layers[1:]:  # Pula o main
@@ -2098,8 +5061,8 @@ class SliceWindow(QWidget):
                 result = Image.alpha_composite(result, layer_canvas)
 
         # Atualiza a imagem principal
-        self.current_image_pil = result
-        main_layer.image = result.copy()
+        self.current_image_pil = self.filter_result_to_document(result)
+        main_layer.image = self.current_image_pil.copy()
 
         # Remove todos os layers exceto o main
         layers_to_remove = [l for l in self.layers if l.name != "Main"]
@@ -2115,290 +5078,807 @@ class SliceWindow(QWidget):
 
         self.layers = [l for l in self.layers if l.name == "Main"]
 
-        # Atualiza a UI
-        self.update_canvas_image()
-        self.update_layers_ui()
+        # Atualiza a UI
+        self.update_canvas_image()
+        self.update_layers_ui()
+
+        # Atualiza o thumbnail do layer main
+        if main_layer.id in self.layer_widgets:
+            self.layer_widgets[main_layer.id].layer.image = result.copy()
+            # self.layer_widgets[main_layer.id].update_thumbnail()
+
+        QMessageBox.information(
+            self, "Merge Complete", "Todos os layers foram mesclados com sucesso!"
+        )
+
+    def clear_all_layers(self):
+        """Remove todos os layers"""
+        # Remove widgets
+        for widget in self.layer_widgets.values():
+            self.layers_layout.removeWidget(widget)
+            widget.deleteLater()
+
+        # Remove items gráficos
+        for item in self.layer_graphics_items.values():
+            self.scene.removeItem(item)
+
+        self.layers.clear()
+        self.layer_widgets.clear()
+        self.layer_graphics_items.clear()
+        self.active_layer_id = None
+
+    def update_layers_ui(self):
+        """Atualiza a UI dos layers"""
+        has_layers = len(self.layers) > 0
+        has_secondary_layers = len(self.layers) > 1
+
+        self.btn_add_layer.setEnabled(has_layers)
+        self.btn_remove_layer.setEnabled(has_secondary_layers)
+        self.btn_layer_up.setEnabled(has_secondary_layers)
+        self.btn_layer_down.setEnabled(has_secondary_layers)
+        self.btn_merge_layers.setEnabled(has_secondary_layers)
+
+    def update_layer_buttons(self):
+        """Atualiza o estado dos botões baseado no layer selecionado"""
+        active_layer = self.get_active_layer()
+
+        if active_layer:
+            is_main = active_layer.name == "Main"
+            self.btn_remove_layer.setEnabled(not is_main and len(self.layers) > 1)
+            self.btn_layer_up.setEnabled(not is_main)
+            self.btn_layer_down.setEnabled(not is_main)
+
+    def compose_and_display_layers(self):
+        """Compõe todos os layers visíveis e exibe no canvas"""
+        if not self.layers:
+            return
+
+        main_layer = self.get_main_layer()
+        if not main_layer or not main_layer.image:
+            return
+
+        # Atualiza apenas os items gráficos dos layers secundários
+        # O main layer usa o pixmap_item principal
+        for layer in self.layers:
+            if layer.name != "Main" and layer.id in self.layer_graphics_items:
+                item = self.layer_graphics_items[layer.id]
+                item.setPos(layer.x, layer.y)
+                item.setVisible(layer.visible)
+
+    def remove_background_ai(self):
+        if not self.current_image_pil:
+            return
+
+        if not REMBG_AVAILABLE:  # ← Use a variável global aqui
+            QMessageBox.critical(
+                self,
+                "Biblioteca Faltando",
+                "rembg não está instalado!\nInstale com: pip install rembg",
+            )
+            return
+
+        source = self.current_image_pil.convert("RGBA")
+        model_name = self.combo_rembg_model.currentText()
+        threads = self.spin_rembg_threads.value()
+
+        self.remember_ai_models("rembg", model=model_name, threads=threads)
+        cache_key = RESULT_CACHE.key(source, "rembg", model=model_name)
+
+        def work(progress, cancelled):
+            # Remove background (a inferência não tem como ser interrompida;
+            # Cancel descarta o resultado)
+            result = remove_background(source, model_name, threads)
+            RESULT_CACHE.put(cache_key, result)
+            return result
+
+        def on_result(output_image):
+            # Salvar estado e atualizar imagem juntos, já na thread da interface
+            self.save_state()
+            self.current_image_pil = self.filter_result_to_document(output_image)
+            self.update_canvas_image()
+
+            QMessageBox.information(
+                self,
+                "Background Removed",
+                "Background removido com sucesso!",
+            )
+
+        def on_done():
+            self.btn_remove_bg_ai.setEnabled(True)
+            self.update_cache_info()
+
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            on_result(cached)
+            self.update_cache_info()
+            return
+
+        if self.start_background_job(
+            "Remove Background",
+            "Removendo background com IA...",
+            work,
+            on_result,
+            on_done=on_done,
+            edits_document=True,
+        ):
+            self.btn_remove_bg_ai.setEnabled(False)
+
+    def apply_denoise(self):
+        if not self.current_image_pil:
+            return
+
+        method = self.combo_denoise_method.currentIndex()
+        method_name = self.combo_denoise_method.currentText()
+        strength = float(self.spin_denoise_strength.value())  # Força float
+
+        # Imagem e seleção lidas aqui; o job só recebe cópias
+        image = self.current_image_pil.convert("RGBA")
+        region = self.get_selection_region(denoise_halo(method, strength))
+
+        def work(progress, cancelled):
+            def denoise_region(part):
+                cache_key = RESULT_CACHE.key(
+                    part, "denoise", method=method, strength=strength
+                )
+                denoised = RESULT_CACHE.get(cache_key)
+                if denoised is None:
+                    denoised = denoise_image(
+                        part, method, strength, progress=progress, cancelled=cancelled
+                    )
+                    if denoised is not None:
+                        RESULT_CACHE.put(cache_key, denoised)
+                return denoised
+
+            # Cancelado: None, e undo/redo ficam como estavam
+            return process_region(image, region, denoise_region)
+
+        def on_result(result):
+            # Snapshot só depois do sucesso (save_state limpa o redo)
+            self.save_state()
+            self.current_image_pil = self.filter_result_to_document(result)
+            self.update_canvas_image()
+
+            QMessageBox.information(
+                self,
+                "Denoise Applied",
+                f"Denoise aplicado com sucesso!\n"
+                f"Método: {method_name}\n"
+                f"Força: {strength}"
+            )
+
+        self.start_background_job(
+            "Denoise",
+            "Aplicando denoise...",
+            work,
+            on_result,
+            on_done=self.update_cache_info,
+            edits_document=True,
+        )
+
+    def on_upscale_backend_changed(self, index):
+        onnx = index == 1
+        self.spin_onnx_threads.setEnabled(onnx)
+        self.combo_onnx_optimization.setEnabled(onnx)
+        self.chk_use_gpu.setEnabled(not onnx)
+
+    def get_upscale_backend(self):
+        """Backend, opções e device escolhidos na aba Upscale"""
+        if self.combo_upscale_backend.currentIndex() == 1:
+            options = {
+                "threads": self.spin_onnx_threads.value(),
+                "optimization": self.combo_onnx_optimization.currentText(),
+            }
+            return "onnx", options, "cpu"
+
+        use_gpu = self.chk_use_gpu.isChecked()
+        device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+        return "torch", self.get_cpu_profile(), device
+
+    def get_cpu_profile(self):
+        """Perfil de CPU do PyTorch escolhido na aba Upscale"""
+        return {
+            "threads": self.spin_torch_threads.value(),
+            "inference_mode": self.chk_inference_mode.isChecked(),
+            "channels_last": self.chk_channels_last.isChecked(),
+            "precision": CPU_PRECISIONS[self.combo_cpu_precision.currentIndex()],
+        }
+
+    def run_cpu_profile_report(self):
+        """Relatório lado a lado de latência/qualidade dos perfis de CPU"""
+        model_idx = self.combo_upscale_model.currentIndex()
+        if model_idx >= len(UPSCALE_MODELS):
+            QMessageBox.warning(self, "Aviso", "Escolha um modelo Real-ESRGAN!")
+            return
+
+        current = self.get_cpu_profile()
+        baseline = dict(DEFAULT_CPU_PROFILE, inference_mode=False)
+        tuned = dict(baseline, inference_mode=True)
+        profiles = [
+            ("Baseline (FP32, no_grad)", baseline),
+            ("+ inference_mode", tuned),
+            ("+ channels_last", dict(tuned, channels_last=True)),
+            ("+ BF16 autocast", dict(tuned, precision="bf16")),
+            ("Current settings", current),
+        ]
+        image = self.current_image_pil
+
+        def work(progress, cancelled):
+            return cpu_profile_report(model_idx, profiles, image)
+
+        def on_result(rows):
+            lines = []
+            for name, latency, psnr, error in rows:
+                if error:
+                    lines.append(f"{name}: erro - {error}")
+                    continue
+                quality = "referência" if psnr is None else f"PSNR {psnr:.1f} dB"
+                lines.append(f"{name}: {latency:,.0f} ms/MP, {quality}")
+
+            QMessageBox.information(
+                self,
+                "CPU Profile Report",
+                f"{self.upscale_model_labels[model_idx]} "
+                f"({torch.get_num_threads()} threads disponíveis)\n\n"
+                + "\n".join(lines),
+            )
+
+        self.start_background_job(
+            "CPU Profile", "Medindo perfis de CPU...", work, on_result
+        )
+
+    def check_upscale_backend(self):
+        """Avisa se o backend escolhido não está instalado"""
+        if self.combo_upscale_model.currentIndex() >= len(UPSCALE_MODELS):
+            # Upscalers de pixel art não dependem de nenhum backend
+            return True
+
+        if self.combo_upscale_backend.currentIndex() == 1:
+            if ONNXRUNTIME_AVAILABLE:
+                return True
+            QMessageBox.critical(
+                self, "Dependência Faltando", "onnxruntime não está instalado!"
+            )
+            return False
+
+        if REALESRGAN_AVAILABLE:
+            return True
+        QMessageBox.critical(
+            self, "Dependência Faltando", "Real-ESRGAN não está instalado!"
+        )
+        return False
+
+    def benchmark_upscale(self):
+        """Compara ms/MP na CPU entre PyTorch e onnxruntime para o modelo atual"""
+        backends = []
+        if REALESRGAN_AVAILABLE:
+            backends.append("torch")
+        if ONNXRUNTIME_AVAILABLE:
+            backends.append("onnx")
+        if not backends:
+            QMessageBox.critical(
+                self, "Dependência Faltando", "Nenhum backend de upscale instalado!"
+            )
+            return
+
+        model_idx = self.combo_upscale_model.currentIndex()
+        if model_idx >= len(UPSCALE_MODELS):
+            QMessageBox.warning(self, "Aviso", "Escolha um modelo Real-ESRGAN!")
+            return
+
+        options = {
+            "torch": self.get_cpu_profile(),
+            "onnx": {
+                "threads": self.spin_onnx_threads.value(),
+                "optimization": self.combo_onnx_optimization.currentText(),
+            },
+        }
+
+        def work(progress, cancelled):
+            return benchmark_upscale_backends(model_idx, backends, options=options)
+
+        def on_result(results):
+            names = {"torch": "PyTorch (CPU)", "onnx": "ONNX Runtime"}
+            lines = []
+            for backend, value in results.items():
+                if isinstance(value, float):
+                    lines.append(f"{names[backend]}: {value:,.0f} ms/MP")
+                else:
+                    lines.append(f"{names[backend]}: erro - {value}")
+            QMessageBox.information(
+                self,
+                "Benchmark",
+                f"{self.upscale_model_labels[model_idx]}\n\n" + "\n".join(lines),
+            )
 
-        # Atualiza o thumbnail do layer main
-        if main_layer.id in self.layer_widgets:
-            self.layer_widgets[main_layer.id].layer.image = result.copy()
-            # self.layer_widgets[main_layer.id].update_thumbnail()
+        self.start_background_job(
+            "Benchmark", "Medindo latência dos backends...", work, on_result
+        )
 
-        QMessageBox.information(
-            self, "Merge Complete", "Todos os layers foram mesclados com sucesso!"
+    def refresh_model_status(self):
+        """
+        Confere os pesos no registro local em segundo plano (o hash dos
+        .pth leva segundos) e depois marca os modelos faltando
+        """
+        registry = MODEL_REGISTRY
+        self.lbl_model_registry.setText(
+            f"📁 {registry.directory}\n⏳ Conferindo modelos..."
         )
 
-    def clear_all_layers(self):
-        """Remove todos os layers"""
-        # Remove widgets
-        for widget in self.layer_widgets.values():
-            self.layers_layout.removeWidget(widget)
-            widget.deleteLater()
+        def work(progress, cancelled):
+            with MODEL_LOAD_LOCK:
+                return registry, registry.status()
 
-        # Remove items gráficos
-        for item in self.layer_graphics_items.values():
-            self.scene.removeItem(item)
+        def failed(error):
+            self.lbl_model_registry.setText(
+                f"📁 {registry.directory}\n⚠️ {error.splitlines()[0]}"
+            )
 
-        self.layers.clear()
-        self.layer_widgets.clear()
-        self.layer_graphics_items.clear()
-        self.active_layer_id = None
+        job = BackgroundJob(work)
+        job.signals.finished.connect(lambda result: self.show_model_status(*result))
+        job.signals.failed.connect(failed)
+        self.model_status_job = job
+        QThreadPool.globalInstance().start(job)
 
-    def update_layers_ui(self):
-        """Atualiza a UI dos layers"""
-        has_layers = len(self.layers) > 0
-        has_secondary_layers = len(self.layers) > 1
+    def show_model_status(self, registry, status):
+        import os
 
-        self.btn_add_layer.setEnabled(has_layers)
-        self.btn_remove_layer.setEnabled(has_secondary_layers)
-        self.btn_layer_up.setEnabled(has_secondary_layers)
-        self.btn_layer_down.setEnabled(has_secondary_layers)
-        self.btn_merge_layers.setEnabled(has_secondary_layers)
+        if registry is not MODEL_REGISTRY:
+            # A pasta mudou enquanto conferia: vale a conferência mais nova
+            return
 
-    def update_layer_buttons(self):
-        """Atualiza o estado dos botões baseado no layer selecionado"""
-        active_layer = self.get_active_layer()
+        missing = []
 
-        if active_layer:
-            is_main = active_layer.name == "Main"
-            self.btn_remove_layer.setEnabled(not is_main and len(self.layers) > 1)
-            self.btn_layer_up.setEnabled(not is_main)
-            self.btn_layer_down.setEnabled(not is_main)
+        for i, entry in enumerate(UPSCALE_MODELS):
+            state = status.get(entry["name"], "missing")
+            label = self.upscale_model_labels[i]
 
-    def compose_and_display_layers(self):
-        """Compõe todos os layers visíveis e exibe no canvas"""
-        if not self.layers:
-            return
+            if state == "missing" and os.path.isfile(
+                MODEL_REGISTRY.onnx_path(entry["name"])
+            ):
+                # Sem o .pth, o .onnx ainda serve para o backend ONNX Runtime
+                label += " (ONNX only)"
+            elif state != "ok":
+                label += f" ({state})"
+                missing.append(entry["name"])
+            self.combo_upscale_model.setItemText(i, label)
+
+        if missing:
+            self.lbl_model_registry.setText(
+                f"📁 {MODEL_REGISTRY.directory}\n"
+                f"⚠️ Faltando: {', '.join(missing)}"
+            )
+        else:
+            self.lbl_model_registry.setText(
+                f"📁 {MODEL_REGISTRY.directory}\n✅ Todos os modelos disponíveis offline"
+            )
+        self.btn_download_models.setEnabled(bool(missing))
 
-        main_layer = self.get_main_layer()
-        if not main_layer or not main_layer.image:
+    def choose_model_directory(self):
+        directory = QFileDialog.getExistingDirectory(
+            self, "Select Models Folder", MODEL_REGISTRY.directory
+        )
+        if not directory:
             return
 
-        # Atualiza apenas os items gráficos dos layers secundários
-        # O main layer usa o pixmap_item principal
-        for layer in self.layers:
-            if layer.name != "Main" and layer.id in self.layer_graphics_items:
-                item = self.layer_graphics_items[layer.id]
-                item.setPos(layer.x, layer.y)
-                item.setVisible(layer.visible)
+        set_model_directory(directory)
+        self.settings.setValue("models/dir", directory)
+        self.refresh_model_status()
 
-    def remove_background_ai(self):
-        if not self.current_image_pil:
-            return
+    def import_model_file(self):
+        """Registra um arquivo .pth (pelo nome, ou como o modelo selecionado)"""
+        import os
 
-        if not REMBG_AVAILABLE:  # ← Use a variável global aqui
-            QMessageBox.critical(
-                self,
-                "Biblioteca Faltando",
-                "rembg não está instalado!\nInstale com: pip install rembg",
-            )
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Select Model Weights", "", "PyTorch Weights (*.pth)"
+        )
+        if not file_path:
             return
 
-        self.save_state()
+        file_name = os.path.basename(file_path)
+        names = [
+            name
+            for name, entry in MODEL_REGISTRY.entries.items()
+            if entry.get("file") == file_name
+        ]
+        name = (
+            names[0]
+            if names
+            else UPSCALE_MODELS[self.combo_upscale_model.currentIndex()]["name"]
+        )
 
         try:
-            import io
+            state = MODEL_REGISTRY.register(name, file_path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Erro ao importar modelo: {str(e)}")
+            return
 
-            from rembg import remove  # Importa aqui de novo (já foi importado no topo)
+        self.refresh_model_status()
+        QMessageBox.information(self, "Import Model", f"{name}: {state}")
 
-            # Mostrar mensagem de progresso
-            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
-            QApplication.processEvents()
+    def download_missing_models(self):
+        """
+        Baixa (uma vez) os modelos que faltam para a pasta local. A
+        conferência roda dentro do próprio job: não depende de o
+        refresh_model_status já ter terminado.
+        """
+        registry = MODEL_REGISTRY
+
+        def work(progress, cancelled):
+            with MODEL_LOAD_LOCK:
+                status = registry.status()
+            missing = [name for name, state in status.items() if state != "ok"]
+
+            for done, name in enumerate(missing):
+                if cancelled():
+                    return None
+                progress(done, len(missing))
+                registry.download(name)
+            return missing
+
+        def on_result(names):
+            if not names:
+                QMessageBox.information(
+                    self, "Download", "Todos os modelos já estão disponíveis."
+                )
+                return
+            QMessageBox.information(
+                self, "Download", f"Modelos baixados: {', '.join(names)}"
+            )
 
-            # Converte PIL Image para bytes
-            img_byte_arr = io.BytesIO()
-            self.current_image_pil.save(img_byte_arr, format="PNG")
-            img_byte_arr = img_byte_arr.getvalue()
+        self.start_background_job(
+            "Download Models",
+            "Conferindo e baixando modelos...",
+            work,
+            on_result,
+            on_done=self.refresh_model_status,
+        )
 
-            # Remove background
-            output_data = remove(img_byte_arr)
+    def remember_ai_models(self, kind, **params):
+        """Guarda nas QSettings o último modelo usado (para o aquecimento)"""
+        import json
 
-            # Converte de volta para PIL Image
-            output_image = Image.open(io.BytesIO(output_data))
+        self.settings.setValue(f"warmup/{kind}", json.dumps(params))
 
-            # Garante que está em RGBA
-            if output_image.mode != "RGBA":
-                output_image = output_image.convert("RGBA")
+    def last_ai_models(self, kind):
+        import json
 
-            self.current_image_pil = output_image
-            self.update_canvas_image()
+        try:
+            return json.loads(self.settings.value(f"warmup/{kind}", "") or "null")
+        except ValueError:
+            return None
 
-            QApplication.restoreOverrideCursor()
+    IDLE_RESET_EVENTS = (
+        QEvent.Type.MouseButtonPress,
+        QEvent.Type.MouseMove,
+        QEvent.Type.KeyPress,
+        QEvent.Type.Wheel,
+    )
+
+    def eventFilter(self, obj, event):
+        # Entrada do usuário antes do aquecimento adia a contagem de ociosidade
+        if event.type() in self.IDLE_RESET_EVENTS and self.warmup_timer.isActive():
+            self.warmup_timer.start()
+        return super().eventFilter(obj, event)
+
+    def on_idle_warmup(self):
+        QApplication.instance().removeEventFilter(self)
+        self.start_warmup()
+
+    def start_warmup(self):
+        """Carrega os últimos modelos usados em segundo plano, com prioridade baixa"""
+        if self.active_job or self.warmup_job:
+            return
 
-            QMessageBox.information(
-                self,
-                "Background Removed",
+        upscale = self.last_ai_models("upscale")
+        if upscale and not (
+            upscale.get("model", len(UPSCALE_MODELS)) < len(UPSCALE_MODELS)
+            and (
+                ONNXRUNTIME_AVAILABLE
+                if upscale.get("backend") == "onnx"
+                else REALESRGAN_AVAILABLE
             )
+        ):
+            upscale = None
+        if upscale and upscale.get("device") == "cuda":
+            if not torch.cuda.is_available():
+                upscale["device"] = "cpu"
+
+        rembg = self.last_ai_models("rembg") if REMBG_AVAILABLE else None
+        if not upscale and not rembg:
+            return
 
-        except Exception as e:
-            QApplication.restoreOverrideCursor()
-            QMessageBox.critical(self, "Error", f"Erro ao remover background: {str(e)}")
+        def work(progress, cancelled):
+            # A thread é do pool global: devolve a prioridade para os
+            # próximos jobs que a reaproveitarem
+            thread = QThread.currentThread()
+            previous = thread.priority()
+            if previous == QThread.Priority.InheritPriority:
+                # setPriority não aceita InheritPriority de volta
+                previous = QThread.Priority.NormalPriority
+            thread.setPriority(QThread.Priority.LowestPriority)
+            try:
+                return warm_up_models(upscale, rembg, cancelled)
+            finally:
+                thread.setPriority(previous)
 
-    def apply_denoise(self):
-        if not self.current_image_pil:
-            return
+        def finished(warmed):
+            self.warmup_job = None
+            if warmed and not self.lbl_upscale_status.text():
+                self.lbl_upscale_status.setText(
+                    f"🔥 Modelos prontos: {', '.join(warmed)}"
+                )
 
-        self.save_state()
+        def failed(error):
+            # Aquecimento é só otimização: avisa no status, sem diálogo
+            self.warmup_job = None
+            self.lbl_upscale_status.setText(
+                f"⚠️ Aquecimento dos modelos falhou: {error.splitlines()[0]}"
+            )
 
-        try:
-            method = self.combo_denoise_method.currentIndex()
-            strength = float(self.spin_denoise_strength.value())  # Força float
-            
-            img = self.current_image_pil.copy()
+        job = BackgroundJob(work)
+        job.signals.finished.connect(finished)
+        job.signals.failed.connect(failed)
+        self.warmup_job = job
+        QThreadPool.globalInstance().start(job, -1)
+
+    def cancel_warmup(self):
+        """Para o aquecimento na próxima etapa (vai começar um processamento)"""
+        if self.warmup_job:
+            self.warmup_job.cancel()
+
+    def toggle_disk_cache(self, enabled):
+        RESULT_CACHE.directory = default_cache_dir() if enabled else None
+        RESULT_CACHE.disk_error = None
+        self.settings.setValue("cache/disk", enabled)
+        self.update_cache_info()
+
+    def clear_result_cache(self):
+        RESULT_CACHE.clear(disk=True)
+        self.update_cache_info()
+
+    def update_cache_info(self):
+        items, megabytes, hits, misses = RESULT_CACHE.stats()
+        text = (
+            f"{items} resultado(s) em memória ({megabytes:.1f} MB)\n"
+            f"Acertos: {hits} | Erros: {misses}"
+        )
+        if RESULT_CACHE.disk_error:
+            text += f"\n⚠️ Falha ao gravar no disco: {RESULT_CACHE.disk_error}"
+        self.lbl_cache_info.setText(text)
+
+    def unload_ai_models(self):
+        count = unload_upsamplers()
+        self.lbl_upscale_status.setText(f"Modelos descarregados: {count}")
+
+    def start_background_job(
+        self,
+        title,
+        label,
+        work,
+        on_result,
+        on_progress=None,
+        on_done=None,
+        edits_document=False,
+    ):
+        """
+        Roda work(progress, cancelled) no QThreadPool com um diálogo de
+        progresso não-modal (com Cancel). on_result recebe o resultado na
+        thread da interface; on_done roda sempre no fim. Com
+        edits_document, o resultado é descartado se a imagem foi editada,
+        desfeita ou trocada enquanto o job rodava.
+        """
+        if self.active_job:
+            QMessageBox.warning(self, "Aviso", "Já existe um processamento em andamento!")
+            return False
 
-            if method == 0:  # Median Filter
-                # Converte para int e garante que é ímpar
-                kernel_size = int(strength * 2) + 1
-                if kernel_size < 1:
-                    kernel_size = 1
-                img = img.filter(ImageFilter.MedianFilter(size=kernel_size))
+        generation = self.document_generation
 
-            elif method == 1:  # Gaussian Blur
-                # Gaussian aceita float diretamente
-                img = img.filter(ImageFilter.GaussianBlur(radius=strength))
+        self.cancel_warmup()
 
-            elif method == 2:  # Smooth
-                for _ in range(max(1, int(strength))):
-                    img = img.filter(ImageFilter.SMOOTH)
+        dialog = QProgressDialog(label, "Cancel", 0, 0, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.WindowModality.NonModal)
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
 
-            elif method == 3:  # Smooth More
-                for _ in range(max(1, int(strength))):
-                    img = img.filter(ImageFilter.SMOOTH_MORE)
+        job = BackgroundJob(work)
+        dialog.canceled.connect(job.cancel)
 
-            self.current_image_pil = img
-            self.update_canvas_image()
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            if on_progress:
+                on_progress(done, total)
 
-            QMessageBox.information(
-                self,
-                "Denoise Applied",
-                f"Denoise aplicado com sucesso!\n"
-                f"Método: {self.combo_denoise_method.currentText()}\n"
-                f"Força: {strength}"
-            )
+        def finish():
+            dialog.close()
+            self.active_job = None
+            if on_done:
+                on_done()
 
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Erro ao aplicar denoise: {str(e)}")
+        def finished(result):
+            try:
+                if result is None:
+                    return
+                if edits_document and self.document_generation != generation:
+                    QMessageBox.warning(
+                        self,
+                        title,
+                        "A imagem mudou durante o processamento.\n"
+                        "O resultado foi descartado; rode de novo.",
+                    )
+                    return
+                on_result(result)
+            finally:
+                finish()
 
+        def failed(error):
+            finish()
+            QMessageBox.critical(self, "Error", f"Erro em {title}:\n{error}")
 
+        job.signals.progress.connect(progress)
+        job.signals.finished.connect(finished)
+        job.signals.failed.connect(failed)
 
-    def apply_ai_upscale(self):
-        if not self.current_image_pil:
+        self.active_job = job
+        dialog.show()
+        QThreadPool.globalInstance().start(job)
+        return True
+
+    def batch_ai_sprites(self):
+        """AI upscale ou remoção de fundo de todos os sprites via atlas"""
+        if not self.sliced_images:
+            QMessageBox.warning(self, "Aviso", "Corte a imagem em sprites primeiro!")
             return
 
-        if not REALESRGAN_AVAILABLE:
+        upscale = self.combo_batch_ai.currentIndex() == 0
+        if upscale and not self.check_upscale_backend():
+            return
+        if not upscale and not REMBG_AVAILABLE:
             QMessageBox.critical(
-                self, "Dependência Faltando", "Real-ESRGAN não está instalado!"
+                self,
+                "Biblioteca Faltando",
+                "rembg não está instalado!\nInstale com: pip install rembg",
             )
             return
 
-        # Guardar resolução original
-        original_width = self.current_image_pil.width
-        original_height = self.current_image_pil.height
-        keep_original_size = self.chk_keep_original_size.isChecked()
-
-        self.btn_apply_upscale.setEnabled(False)
-        self.lbl_upscale_status.setText("⏳ Carregando modelo...")
-        QApplication.processEvents()
+        images = list(self.sliced_images)
+        padding = self.spin_batch_padding.value()
 
-        try:
-            import cv2
-            import numpy as np
+        if upscale:
+            backend, options, device = self.get_upscale_backend()
+            model_idx = self.combo_upscale_model.currentIndex()
+            scale = int(self.combo_upscale_factor.currentText().replace("x", ""))
+            tile = self.spin_upscale_tile.value()
+            keep_size = self.chk_keep_original_size.isChecked()
+            # O upscale já trabalha em tiles, então o atlas pode ser grande
+            max_side = 1024
+        else:
+            model_name = self.combo_rembg_model.currentText()
+            threads = self.spin_rembg_threads.value()
+            # O rembg reduz a entrada para ~320 px: atlas pequenos para os
+            # sprites não ficarem minúsculos na máscara
+            max_side = 640
+
+        def work(progress, cancelled):
+            def process(atlas):
+                if upscale:
+                    return ai_upscale_image(
+                        atlas,
+                        model_idx,
+                        scale,
+                        device,
+                        tile,
+                        keep_size,
+                        cancelled=cancelled,
+                        backend=backend,
+                        options=options,
+                    )
+                return remove_background(atlas, model_name, threads)
 
-            # Configurar device
-            use_gpu = self.chk_use_gpu.isChecked()
-            device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+            return process_atlases(
+                images, process, padding, max_side, progress, cancelled
+            )
 
-            # Determinar modelo e escala
-            model_idx = self.combo_upscale_model.currentIndex()
-            scale_text = self.combo_upscale_factor.currentText()
-            scale = int(scale_text.replace("x", ""))
-
-            self.lbl_upscale_status.setText(f"⏳ Inicializando modelo...")
-            QApplication.processEvents()
-
-            # Configurar modelo baseado na seleção
-            if model_idx == 0:  # General x4
-                model = RRDBNet(
-                    num_in_ch=3,
-                    num_out_ch=3,
-                    num_feat=64,
-                    num_block=23,
-                    num_grow_ch=32,
-                    scale=4,
+        def on_result(results):
+            if not self.replace_sliced_images(results, expected=images):
+                QMessageBox.warning(
+                    self,
+                    "Batch AI",
+                    "A lista de sprites mudou durante o processamento.\n"
+                    "O resultado foi descartado; rode de novo.",
                 )
-                model_path = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth"
-                netscale = 4
-            elif model_idx == 1:  # Anime x4
-                model = RRDBNet(
-                    num_in_ch=3,
-                    num_out_ch=3,
-                    num_feat=64,
-                    num_block=6,
-                    num_grow_ch=32,
-                    scale=4,
-                )
-                model_path = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth"
-                netscale = 4
-            else:  # x2
-                model = RRDBNet(
-                    num_in_ch=3,
-                    num_out_ch=3,
-                    num_feat=64,
-                    num_block=23,
-                    num_grow_ch=32,
-                    scale=2,
-                )
-                model_path = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth"
-                netscale = 2
-
-            # Criar upsampler
-            upsampler = RealESRGANer(
-                scale=netscale,
-                model_path=model_path,
-                model=model,
-                tile=0,
-                tile_pad=10,
-                pre_pad=0,
-                half=False,
-                device=device,
+                return
+            QMessageBox.information(
+                self,
+                "Batch AI",
+                f"{len(results)} sprites processados "
+                f"({self.combo_batch_ai.currentText()}).",
             )
 
-            self.lbl_upscale_status.setText("⏳ Processando upscale...")
-            QApplication.processEvents()
+        if self.start_background_job(
+            "Batch AI",
+            f"Processando {len(images)} sprites em atlas...",
+            work,
+            on_result,
+            on_done=lambda: self.btn_batch_ai.setEnabled(True),
+        ):
+            self.btn_batch_ai.setEnabled(False)
 
-            # Converter PIL para numpy array (BGR para OpenCV)
-            img_rgb = self.current_image_pil.convert("RGB")
-            img_np = np.array(img_rgb)
-            img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
+    def apply_ai_upscale(self):
+        if not self.current_image_pil:
+            return
 
-            # Aplicar upscaling
-            output, _ = upsampler.enhance(img_bgr, outscale=scale)
+        if not self.check_upscale_backend():
+            return
 
-            # Converter de volta para PIL (BGR -> RGB)
-            output_rgb = cv2.cvtColor(output, cv2.COLOR_BGR2RGB)
-            upscaled_image = Image.fromarray(output_rgb)
+        # Com seleção, só a região (mais a margem dos tiles) passa pelo modelo
+        # e volta para o lugar na resolução original
+        selection = self.get_selection_region(halo=10)
+        source = self.current_image_pil.convert("RGBA")
+        if selection:
+            source = source.crop(selection[0])
 
-            # Se tinha transparência, processar canal alpha
-            if self.current_image_pil.mode == "RGBA":
-                alpha = self.current_image_pil.split()[-1]
-                alpha_upscaled = alpha.resize(
-                    (upscaled_image.width, upscaled_image.height), Image.LANCZOS
-                )
-                upscaled_image = upscaled_image.convert("RGBA")
-                upscaled_image.putalpha(alpha_upscaled)
+        # Guardar resolução original
+        original_width = source.width
+        original_height = source.height
+        keep_original_size = self.chk_keep_original_size.isChecked() or bool(selection)
+
+        # Configurar backend e device
+        backend, options, device = self.get_upscale_backend()
+
+        # Determinar modelo e escala
+        model_idx = self.combo_upscale_model.currentIndex()
+        scale = int(self.combo_upscale_factor.currentText().replace("x", ""))
+        tile = self.spin_upscale_tile.value()
+
+        if model_idx < len(UPSCALE_MODELS):
+            self.remember_ai_models(
+                "upscale",
+                model=model_idx,
+                device=device,
+                backend=backend,
+                options=options,
+            )
 
-            # NOVA LÓGICA: Manter resolução original se checkbox marcada
-            if keep_original_size:
-                self.lbl_upscale_status.setText(
-                    "⏳ Redimensionando para resolução original..."
-                )
-                QApplication.processEvents()
+        # O número de threads não muda o resultado, então fica fora da chave
+        cache_key = RESULT_CACHE.key(
+            source,
+            "upscale",
+            model=model_idx,
+            scale=scale,
+            device=device,
+            tile=tile,
+            keep_size=keep_original_size,
+            backend=backend,
+            options={k: v for k, v in options.items() if k != "threads"},
+        )
 
-                # Usar LANCZOS para melhor qualidade no downscale
-                upscaled_image = upscaled_image.resize(
-                    (original_width, original_height), Image.LANCZOS
-                )
+        def work(progress, cancelled):
+            result = ai_upscale_image(
+                source,
+                model_idx,
+                scale,
+                device,
+                tile,
+                keep_original_size,
+                progress,
+                cancelled,
+                backend,
+                options,
+            )
+            if result is not None:
+                RESULT_CACHE.put(cache_key, result)
+            return result
 
+        def on_progress(done, total):
+            self.lbl_upscale_status.setText(
+                f"⏳ Processando upscale... tile {done}/{total}"
+            )
+
+        def on_result(upscaled_image):
+            if keep_original_size:
                 result_msg = (
                     f"Imagem processada com sucesso!\n\n"
                     f"Upscale temporário: {scale}x\n"
@@ -2415,11 +5895,16 @@ class SliceWindow(QWidget):
                     f"Device: {device}"
                 )
 
-            # Salvar estado
-            self.save_state()
+            if selection:
+                outer, inner = selection
+                patch = upscaled_image.crop(inner)
+                upscaled_image = self.current_image_pil.convert("RGBA")
+                upscaled_image.paste(patch, (outer[0] + inner[0], outer[1] + inner[1]))
+                result_msg += f"\n\nAplicado só na seleção ({patch.width}x{patch.height})"
 
-            # Atualizar imagem
-            self.current_image_pil = upscaled_image
+            # Salvar estado e atualizar imagem juntos, já na thread da interface
+            self.save_state()
+            self.current_image_pil = self.filter_result_to_document(upscaled_image)
             self.update_canvas_image()
 
             # Atualizar spinboxes
@@ -2439,48 +5924,311 @@ class SliceWindow(QWidget):
 
             QMessageBox.information(self, "AI Upscale Complete", result_msg)
 
-        except Exception as e:
-            import traceback
-
-            error_details = traceback.format_exc()
-            self.lbl_upscale_status.setText(f"❌ Erro: {str(e)}")
-            QMessageBox.critical(
-                self,
-                "Error",
-                f"Erro ao aplicar AI upscale:\n{str(e)}\n\n{error_details}",
-            )
-
-        finally:
+        def on_done():
             self.btn_apply_upscale.setEnabled(True)
+            self.update_cache_info()
+            if self.lbl_upscale_status.text().startswith("⏳"):
+                self.lbl_upscale_status.setText("⛔ Upscale interrompido.")
+
+        # Mesma imagem com as mesmas opções: reaproveita o resultado
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            on_result(cached)
+            self.update_cache_info()
+            return
 
-
+        started = self.start_background_job(
+            "AI Upscale",
+            "Aplicando AI upscale...",
+            work,
+            on_result,
+            on_progress,
+            on_done,
+            edits_document=True,
+        )
+        if started:
+            self.btn_apply_upscale.setEnabled(False)
+            self.lbl_upscale_status.setText("⏳ Carregando modelo...")
 
     def on_brightness_change(self, value):
         self.lbl_brightness.setText(str(value))
+        self.schedule_preview("color")
 
     def on_contrast_change(self, value):
         self.lbl_contrast.setText(str(value))
+        self.schedule_preview("color")
 
     def on_saturation_change(self, value):
         self.lbl_saturation.setText(str(value))
+        self.schedule_preview("color")
 
     def on_red_change(self, value):
         self.lbl_red.setText(str(value))
+        self.schedule_preview("color")
 
     def on_green_change(self, value):
         self.lbl_green.setText(str(value))
+        self.schedule_preview("color")
+
+    def on_blue_change(self, value):
+        self.lbl_blue.setText(str(value))
+        self.schedule_preview("color")
+
+    def reset_color_sliders(self):
+        """Reseta todos os sliders de cor para 0"""
+        self.slider_brightness.setValue(0)
+        self.slider_contrast.setValue(0)
+        self.slider_saturation.setValue(0)
+        self.slider_red.setValue(0)
+        self.slider_green.setValue(0)
+        self.slider_blue.setValue(0)
+
+    def on_live_preview_toggled(self, checked):
+        if not checked:
+            self.clear_preview()
+
+    def on_view_scrolled(self, *args):
+        """Refaz o preview quando a região visível muda"""
+        if self.preview_kind:
+            self.schedule_preview(self.preview_kind)
+
+    def schedule_preview(self, kind):
+        """Agenda o preview, limitado à taxa de atualização da tela"""
+        if not self.chk_live_preview.isChecked() or not self.current_image_pil:
+            return
+
+        self.preview_kind = kind
+        if not self.preview_timer.isActive():
+            self.preview_timer.start()
+
+    def clear_preview(self):
+        """Remove o preview e volta a mostrar a imagem real"""
+        self.preview_timer.stop()
+        self.preview_kind = None
+        self.preview_histograms = None
+
+        if self.preview_item:
+            self.scene.removeItem(self.preview_item)
+            self.preview_item = None
+
+        self.pixmap_item.setVisible(True)
+
+    def get_preview_proxy(self, halo=0):
+        """
+        Recorta a região visível da imagem (mais a margem do filtro) e reduz
+        para a resolução da tela. Retorna (proxy, região útil no proxy,
+        posição na cena, escala).
+        """
+        w, h = self.current_image_pil.size
+        visible = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+
+        x0 = max(0, int(visible.left()))
+        y0 = max(0, int(visible.top()))
+        x1 = min(w, int(visible.right()) + 1)
+        y1 = min(h, int(visible.bottom()) + 1)
+
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        # Com zoom < 100% não faz sentido processar mais pixels do que a tela mostra
+        scale = min(1.0, self.view.transform().m11())
+
+        hx0, hy0 = max(0, x0 - halo), max(0, y0 - halo)
+        hx1, hy1 = min(w, x1 + halo), min(h, y1 + halo)
+        proxy = self.current_image_pil.crop((hx0, hy0, hx1, hy1)).convert("RGBA")
+
+        if scale < 1.0:
+            proxy = proxy.resize(
+                (
+                    max(1, round(proxy.width * scale)),
+                    max(1, round(proxy.height * scale)),
+                ),
+                Image.BILINEAR,
+            )
+
+        inner = (
+            round((x0 - hx0) * scale),
+            round((y0 - hy0) * scale),
+            max(1, round((x1 - hx0) * scale)),
+            max(1, round((y1 - hy0) * scale)),
+        )
+
+        # Original da região visível, para manter intacto o que fica fora da seleção
+        self.preview_source = proxy.crop(inner)
+        return proxy, inner, (x0, y0), scale
+
+    def render_preview(self):
+        """Renderiza o preview do ajuste atual no proxy"""
+        kind = self.preview_kind
+        if not kind or not self.current_image_pil:
+            return
+
+        try:
+            if kind == "rotate":
+                result = self.render_rotate_preview()
+            elif kind == "color":
+                result = self.render_color_preview()
+            elif kind == "denoise":
+                result = self.render_denoise_preview()
+            elif kind == "outline":
+                result = self.render_outline_preview()
+            else:
+                result = None
+        except Exception as e:
+            self.lbl_preview_status.setText(f"⚠️ Erro no preview: {e}")
+            self.lbl_preview_status.setToolTip(str(e))
+            result = None
+        else:
+            self.lbl_preview_status.setText("")
+            self.lbl_preview_status.setToolTip("")
+
+        if result is None:
+            self.clear_preview()
+            return
+
+        image, pos, scale = result
+
+        box = self.get_selection_box()
+        if box and kind != "rotate" and self.preview_source is not None:
+            # Filtros só mexem na seleção: fora dela o preview mostra o original
+            sel = (
+                max(0, round((box[0] - pos[0]) * scale)),
+                max(0, round((box[1] - pos[1]) * scale)),
+                min(image.width, round((box[2] - pos[0]) * scale)),
+                min(image.height, round((box[3] - pos[1]) * scale)),
+            )
+            merged = self.preview_source.copy()
+            if sel[2] > sel[0] and sel[3] > sel[1]:
+                merged.paste(image.crop(sel), sel[:2])
+            image = merged
+
+        pix = QPixmap.fromImage(self.pil_to_qimage(image))
+
+        if not self.preview_item:
+            self.preview_item = QGraphicsPixmapItem()
+            self.preview_item.setZValue(1)
+            self.scene.addItem(self.preview_item)
+
+        self.preview_item.setPixmap(pix)
+        self.preview_item.setScale(1.0 / scale)
+        self.preview_item.setPos(pos[0], pos[1])
+        self.pixmap_item.setVisible(False)
+        self.preview_kind = kind
+
+    def render_color_preview(self):
+        import numpy as np
+
+        proxy = self.get_preview_proxy()
+        if not proxy:
+            return None
+        image, inner, pos, scale = proxy
+
+        brightness_val = self.slider_brightness.value()
+        contrast_val = self.slider_contrast.value()
+
+        mean = 128
+        if contrast_val != 0:
+            # A média do contraste vem da imagem (ou seleção) inteira, como no Apply
+            box = self.get_selection_box()
+            if self.preview_histograms is None or self.preview_histograms[0] != box:
+                full = self.current_image_pil.convert("RGBA")
+                if box:
+                    full = full.crop(box)
+                self.preview_histograms = (box, channel_histograms(np.asarray(full)))
+            mean = color_contrast_mean(self.preview_histograms[1], brightness_val)
+
+        plan = build_color_plan(
+            brightness_val,
+            contrast_val,
+            self.slider_saturation.value(),
+            self.slider_red.value(),
+            self.slider_green.value(),
+            self.slider_blue.value(),
+            mean,
+        )
+        if plan is None:
+            return None
+
+        src = np.asarray(image.convert("RGBA").crop(inner))
+        out = apply_color_plan(src, plan, self.get_color_buffer(src))
+        return Image.fromarray(out, "RGBA"), pos, scale
+
+    def get_color_buffer(self, src):
+        """Buffer de saída do plano de cor, realocado só quando o tamanho muda"""
+        import numpy as np
+
+        if self.color_buffer is None or self.color_buffer.shape != src.shape:
+            self.color_buffer = np.empty_like(src)
+        return self.color_buffer
+
+    def render_denoise_preview(self):
+        method = self.combo_denoise_method.currentIndex()
+        strength = float(self.spin_denoise_strength.value())
+        proxy = self.get_preview_proxy(halo=denoise_halo(method, strength))
+        if not proxy:
+            return None
+        image, inner, pos, scale = proxy
+
+        # Raio/kernel em pixels acompanham a redução do proxy
+        if method in (0, 1, 4):
+            strength *= scale
+
+        result = denoise_image(image, method, strength)
+        return result.crop(inner), pos, scale
+
+    def render_outline_preview(self):
+        thickness = self.spin_outline_thickness.value()
+        softness = (self.spin_outline_feathering.value() / 100.0) * thickness
+
+        proxy = self.get_preview_proxy(halo=int(thickness + softness) + 1)
+        if not proxy:
+            return None
+        image, inner, pos, scale = proxy
+
+        color = (
+            self.outline_color.red(),
+            self.outline_color.green(),
+            self.outline_color.blue(),
+            self.outline_color.alpha(),
+        )
+        result = render_outline(
+            image,
+            color,
+            thickness * scale,
+            self.combo_outline_placement.currentText(),
+            softness * scale,
+        )
+        return result.crop(inner), pos, scale
+
+    def render_rotate_preview(self):
+        angle = self.spin_rotate_fine.value()
+        if angle % 360 == 0:
+            return None
+
+        active_layer = self.get_active_layer()
+        if active_layer and active_layer.name != "Main":
+            # Rotação de layers secundários não tem preview
+            return None
 
-    def on_blue_change(self, value):
-        self.lbl_blue.setText(str(value))
+        # A rotação mexe na imagem toda, então o proxy é a imagem inteira
+        # reduzida para caber na viewport
+        w, h = self.current_image_pil.size
+        viewport = self.view.viewport().size()
+        scale = min(
+            1.0,
+            self.view.transform().m11(),
+            viewport.width() / w,
+            viewport.height() / h,
+        )
+        scale = max(scale, 1.0 / max(w, h))
 
-    def reset_color_sliders(self):
-        """Reseta todos os sliders de cor para 0"""
-        self.slider_brightness.setValue(0)
-        self.slider_contrast.setValue(0)
-        self.slider_saturation.setValue(0)
-        self.slider_red.setValue(0)
-        self.slider_green.setValue(0)
-        self.slider_blue.setValue(0)
+        proxy = self.current_image_pil
+        if scale < 1.0:
+            proxy = proxy.resize(
+                (max(1, round(w * scale)), max(1, round(h * scale))), Image.BILINEAR
+            )
+
+        return proxy.rotate(-angle, expand=True), (0, 0), scale
 
     def apply_color_adjustments(self):
         if not self.current_image_pil:
@@ -2490,56 +6238,57 @@ class SliceWindow(QWidget):
 
         try:
             import numpy as np
-            from PIL import ImageEnhance
-
-            img = self.current_image_pil.copy()
-
-            if img.mode != "RGBA":
-                img = img.convert("RGBA")
 
             brightness_val = self.slider_brightness.value()
-            if brightness_val != 0:
-                factor = 1.0 + (brightness_val / 100.0)
-                enhancer = ImageEnhance.Brightness(img)
-                img = enhancer.enhance(factor)
-
             contrast_val = self.slider_contrast.value()
+
+            # Ajuste por pixel: a seleção não precisa de margem
+            region = self.get_selection_region()
+            src = np.asarray(
+                self.current_image_pil.convert("RGBA").crop(region[0])
+                if region
+                else self.current_image_pil.convert("RGBA")
+            )
+
+            mean = 128
             if contrast_val != 0:
-                factor = 1.0 + (contrast_val / 100.0)
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(factor)
-
-            saturation_val = self.slider_saturation.value()
-            if saturation_val != 0:
-                factor = 1.0 + (saturation_val / 100.0)
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(factor)
-
-            red_val = self.slider_red.value()
-            green_val = self.slider_green.value()
-            blue_val = self.slider_blue.value()
-
-            if red_val != 0 or green_val != 0 or blue_val != 0:
-                img_array = np.array(img)
-
-                r, g, b, a = (
-                    img_array[:, :, 0],
-                    img_array[:, :, 1],
-                    img_array[:, :, 2],
-                    img_array[:, :, 3],
-                )
+                mean = color_contrast_mean(channel_histograms(src), brightness_val)
+
+            plan = build_color_plan(
+                brightness_val,
+                contrast_val,
+                self.slider_saturation.value(),
+                self.slider_red.value(),
+                self.slider_green.value(),
+                self.slider_blue.value(),
+                mean,
+            )
+
+            if plan is None:
+                return
 
-                r = np.clip(r.astype(np.int16) + red_val, 0, 255).astype(np.uint8)
-                g = np.clip(g.astype(np.int16) + green_val, 0, 255).astype(np.uint8)
-                b = np.clip(b.astype(np.int16) + blue_val, 0, 255).astype(np.uint8)
+            if self.current_image_pil.mode == "P" and not region:
+                # Documento indexado: o ajuste vale para a paleta, não para
+                # os índices (o transparente, índice 0, fica como está)
+                palette = image_palette(self.current_image_pil)
+                adjusted = apply_color_plan(palette[None], plan)[0]
+                adjusted[0] = palette[0]
+                self.current_image_pil = self.current_image_pil.copy()
+                self.current_image_pil.putpalette(adjusted.tobytes(), rawmode="RGBA")
+                self.update_canvas_image()
+                return
 
-                img_array[:, :, 0] = r
-                img_array[:, :, 1] = g
-                img_array[:, :, 2] = b
+            # O buffer do preview recebe todas as etapas; o resultado é
+            # copiado para a região (o buffer continua sendo reaproveitado)
+            out = apply_color_plan(src, plan, self.get_color_buffer(src))
 
-                img = Image.fromarray(img_array, "RGBA")
+            def write_adjusted(region):
+                region.paste(Image.fromarray(out, "RGBA"))
+                return region
 
-            self.current_image_pil = img
+            self.current_image_pil = self.filter_result_to_document(
+                self.process_selection(write_adjusted)
+            )
             self.update_canvas_image()
 
         except Exception as e:
@@ -2613,8 +6362,7 @@ class SliceWindow(QWidget):
 
         w, h = self.current_image_pil.size
         if 0 <= x < w and 0 <= y < h:
-            pixel = self.current_image_pil.getpixel((x, y))
-            r, g, b, a = pixel
+            r, g, b, a = self.get_pixel_rgba(x, y)
 
             self.paint_color = QColor(r, g, b, a)
 
@@ -2654,7 +6402,10 @@ class SliceWindow(QWidget):
 
         brush_type = getattr(self, "brush_type", "Circle")
 
-        if brush_type == "Circle":
+        if self.current_image_pil.mode == "P":
+            self._paint_indexed(x, y, radius, self.palette_index_for((r, g, b, a)))
+
+        elif brush_type == "Circle":
             self._paint_circle(x, y, radius, (r, g, b, a))
 
         elif brush_type == "Square":
@@ -2675,6 +6426,42 @@ class SliceWindow(QWidget):
 
         self.update_canvas_image()
 
+    def _paint_indexed(self, x, y, radius, index):
+        """Pinta direto no buffer de índices (sem feathering, cor sólida)"""
+        import random
+
+        brush_type = getattr(self, "brush_type", "Circle")
+        draw = ImageDraw.Draw(self.current_image_pil)
+
+        if brush_type == "Square":
+            draw.rectangle([x - radius, y - radius, x + radius, y + radius], fill=index)
+
+        elif brush_type == "Hard Pixel":
+            size = max(1, self.paint_size)
+            left = x - size // 2
+            top = y - size // 2
+            draw.rectangle([left, top, left + size, top + size], fill=index)
+
+        elif brush_type == "Spray":
+            pixels = self.current_image_pil.load()
+            w, h = self.current_image_pil.size
+            density = getattr(self, "spray_density", 0.3)
+            samples = int((radius * radius * 3.14) * density)
+
+            for _ in range(samples):
+                dx = random.uniform(-radius, radius)
+                dy = random.uniform(-radius, radius)
+                if dx * dx + dy * dy > radius * radius:
+                    continue
+
+                px = int(x + dx)
+                py = int(y + dy)
+                if 0 <= px < w and 0 <= py < h:
+                    pixels[px, py] = index
+
+        else:
+            draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=index)
+
     def _paint_circle(self, x, y, radius, color_rgba):
         from PIL import ImageDraw
 
@@ -2831,6 +6618,7 @@ class SliceWindow(QWidget):
             self.paint_at_point(QPoint(x, y))
 
     def save_state(self):
+        self.document_generation += 1
         if self.current_image_pil:
             state = self.current_image_pil.copy()
             self.undo_stack.append(state)
@@ -2849,6 +6637,7 @@ class SliceWindow(QWidget):
             self.redo_stack.append(self.current_image_pil.copy())
 
         self.current_image_pil = self.undo_stack.pop()
+        self.sync_indexed_mode()
         self.update_canvas_image()
 
     def redo(self):
@@ -2860,6 +6649,7 @@ class SliceWindow(QWidget):
             self.undo_stack.append(self.current_image_pil.copy())
 
         self.current_image_pil = self.redo_stack.pop()
+        self.sync_indexed_mode()
         self.update_canvas_image()
 
     def keyPressEvent(self, event: QKeyEvent):
@@ -2877,6 +6667,7 @@ class SliceWindow(QWidget):
 
     def update_zoom_label(self, zoom_percentage):
         self.lbl_zoom_val.setText(f"{zoom_percentage}% (Ctrl+Scroll)")
+        self.on_view_scrolled()
 
         self.slider_zoom.blockSignals(True)
         self.slider_zoom.setValue(zoom_percentage)
@@ -2920,6 +6711,50 @@ class SliceWindow(QWidget):
         self.btn_copy_selection.setEnabled(False)
         self.btn_clear_selection.setEnabled(False)
 
+    def get_selection_box(self):
+        """Retorna a seleção ativa como caixa (x0, y0, x1, y1) limitada à imagem"""
+        if not self.selection_rect_item or not self.current_image_pil:
+            return None
+
+        rect = self.selection_rect_item.rect()
+        pos = self.selection_rect_item.pos()
+        w, h = self.current_image_pil.size
+
+        x0 = max(0, int(pos.x() + rect.x()))
+        y0 = max(0, int(pos.y() + rect.y()))
+        x1 = min(w, int(pos.x() + rect.x() + rect.width()))
+        y1 = min(h, int(pos.y() + rect.y() + rect.height()))
+
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return (x0, y0, x1, y1)
+
+    def get_selection_region(self, halo=0):
+        """
+        Seleção ativa com margem de halo px para filtros que olham a
+        vizinhança. Retorna (caixa com margem, seleção relativa à caixa)
+        ou None sem seleção.
+        """
+        box = self.get_selection_box()
+        if box is None:
+            return None
+
+        w, h = self.current_image_pil.size
+        x0, y0 = max(0, box[0] - halo), max(0, box[1] - halo)
+        x1, y1 = min(w, box[2] + halo), min(h, box[3] + halo)
+
+        inner = (box[0] - x0, box[1] - y0, box[2] - x0, box[3] - y0)
+        return (x0, y0, x1, y1), inner
+
+    def process_selection(self, func, halo=0):
+        """
+        Aplica func (imagem RGBA -> imagem RGBA do mesmo tamanho) só na
+        seleção ativa e cola o resultado de volta; sem seleção processa a
+        imagem toda. Retorna a nova imagem ou None se func retornar None.
+        """
+        image = self.current_image_pil.convert("RGBA")
+        return process_region(image, self.get_selection_region(halo), func)
+
     def cut_selection(self):
         if not self.selection_rect_item or not self.current_image_pil:
             return
@@ -2931,7 +6766,7 @@ class SliceWindow(QWidget):
         rect = self.selection_rect_item.rect()
         x, y, w, h = int(rect.x()), int(rect.y()), int(rect.width()), int(rect.height())
 
-        transparent_box = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+        transparent_box = Image.new(self.current_image_pil.mode, (w, h), 0)
         self.current_image_pil.paste(transparent_box, (x, y))
 
         self.update_canvas_image()
@@ -3162,7 +6997,7 @@ class SliceWindow(QWidget):
         box = (x, y, x + w, y + h)
         self.selected_image_data = self.current_image_pil.crop(box)
 
-        transparent_box = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+        transparent_box = Image.new(self.current_image_pil.mode, (w, h), 0)
         self.current_image_pil.paste(transparent_box, (x, y))
         self.update_canvas_image()
 
@@ -3228,7 +7063,12 @@ class SliceWindow(QWidget):
 
         radius = self.eraser_size // 2
 
-        if self.eraser_feathering == 0:
+        if self.current_image_pil.mode == "P":
+            # Modo indexado: índice 0 é o transparente
+            draw = ImageDraw.Draw(self.current_image_pil)
+            draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=0)
+
+        elif self.eraser_feathering == 0:
             draw = ImageDraw.Draw(self.current_image_pil, "RGBA")
             bbox = [x - radius, y - radius, x + radius, y + radius]
 
@@ -3312,7 +7152,42 @@ class SliceWindow(QWidget):
         rows = self.spin_rows.value()
         cols = self.spin_cols.value()
         subs = self.chk_subdivisions.isChecked()
-        self.grid_item.update_grid(rows, cols, subs)
+        self.grid_item.update_grid(
+            rows,
+            cols,
+            subs,
+            (self.spin_cell_w.value(), self.spin_cell_h.value()),
+            (self.spin_spacing_x.value(), self.spin_spacing_y.value()),
+        )
+
+    def detect_grid_settings(self):
+        """Preenche offset, células e espaçamento com a grade detectada"""
+        if not self.current_image_pil:
+            return
+
+        grid = detect_grid(self.current_image_pil)
+        if grid is None:
+            QMessageBox.warning(self, "Detect Grid", "A imagem está vazia!")
+            return
+
+        # Um único redesenho da grade no fim
+        spins = {
+            "x": self.spin_x,
+            "y": self.spin_y,
+            "cols": self.spin_cols,
+            "rows": self.spin_rows,
+            "cell_w": self.spin_cell_w,
+            "cell_h": self.spin_cell_h,
+            "spacing_x": self.spin_spacing_x,
+            "spacing_y": self.spin_spacing_y,
+        }
+        for key, spin in spins.items():
+            spin.blockSignals(True)
+            spin.setValue(grid[key])
+            spin.blockSignals(False)
+
+        self.update_grid_visuals()
+        self.on_spinbox_change()
 
     def open_image(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -3320,7 +7195,14 @@ class SliceWindow(QWidget):
         )
         if file_path:
             try:
-                self.current_image_pil = Image.open(file_path).convert("RGBA")
+                source = Image.open(file_path)
+
+                # Imagens com paleta abrem direto no modo indexado
+                if source.mode == "P" and not self.indexed_mode:
+                    self.set_indexed_mode(True)
+
+                self.document_palette = None
+                self.current_image_pil = self.to_document_mode(source.convert("RGBA"))
                 self.original_image_pil = self.current_image_pil.copy()
 
                 self.undo_stack.clear()
@@ -3397,8 +7279,9 @@ class SliceWindow(QWidget):
         self.redo_stack.clear()
 
         # Define como original e atual
-        self.original_image_pil = blank.copy()
-        self.current_image_pil = blank
+        self.document_palette = None
+        self.current_image_pil = self.to_document_mode(blank)
+        self.original_image_pil = self.current_image_pil.copy()
 
         # Atualiza spinboxes (garante coerência)
         self.spin_resize_width.blockSignals(True)
@@ -3492,38 +7375,25 @@ class SliceWindow(QWidget):
         tolerance = self.spin_tolerance.value()
 
         try:
-            img = self.current_image_pil.convert("RGBA")
-            datas = img.getdata()
+            import numpy as np
 
-            newData = []
             pixels_changed = 0
 
-            for item in datas:
-                r, g, b, a = item
+            def remove_color(region):
+                nonlocal pixels_changed
 
-                if tolerance == 0:
-                    if (r, g, b) == target_rgb:
-                        newData.append((r, g, b, 0))
-                        pixels_changed += 1
-                    else:
-                        newData.append(item)
-                else:
-                    r_diff = abs(r - target_rgb[0])
-                    g_diff = abs(g - target_rgb[1])
-                    b_diff = abs(b - target_rgb[2])
-
-                    if (
-                        r_diff <= tolerance
-                        and g_diff <= tolerance
-                        and b_diff <= tolerance
-                    ):
-                        newData.append((r, g, b, 0))
-                        pixels_changed += 1
-                    else:
-                        newData.append(item)
-
-            img.putdata(newData)
-            self.current_image_pil = img
+                rgba = np.array(region)
+                diff = np.abs(rgba[:, :, :3].astype(np.int16) - target_rgb)
+                mask = (diff <= tolerance).all(axis=2)
+
+                # Mesma contagem de antes: pixels da cor, mesmo se já transparentes
+                pixels_changed = int(mask.sum())
+                rgba[mask, 3] = 0
+                return Image.fromarray(rgba, "RGBA")
+
+            self.current_image_pil = self.filter_result_to_document(
+                self.process_selection(remove_color)
+            )
             self.update_canvas_image()
 
             QMessageBox.information(
@@ -3545,6 +7415,7 @@ class SliceWindow(QWidget):
             self.lbl_outline_color_preview.setStyleSheet(
                 f"background-color: {color.name()}; border: 1px solid #222;"
             )
+            self.schedule_preview("outline")
 
     def detect_edges(self):
         if not self.current_image_pil:
@@ -3553,32 +7424,21 @@ class SliceWindow(QWidget):
         self.save_state()
 
         try:
-            gray = self.current_image_pil.convert("L")
-
-            edges = gray.filter(ImageFilter.FIND_EDGES)
-
-            edges_rgba = edges.convert("RGBA")
-
-            from PIL import ImageOps
-
-            edges_inverted = ImageOps.invert(edges.convert("RGB"))
-            edges_rgba = edges_inverted.convert("RGBA")
-
-            pixels = edges_rgba.load()
-            original_pixels = self.current_image_pil.load()
-            w, h = edges_rgba.size
+            import numpy as np
 
-            for y in range(h):
-                for x in range(w):
-                    r, g, b, a = pixels[x, y]
-                    orig_a = original_pixels[x, y][3]
+            def find_edges(region):
+                edges = np.asarray(region.convert("L").filter(ImageFilter.FIND_EDGES))
 
-                    if r < 128 and orig_a > 0:
-                        pixels[x, y] = (0, 0, 0, 255)
-                    else:
-                        pixels[x, y] = (0, 0, 0, 0)
+                # Borda (invertida < 128) sobre pixel visível vira preto opaco
+                mask = (edges > 127) & (np.asarray(region)[:, :, 3] > 0)
+                rgba = np.zeros(edges.shape + (4,), np.uint8)
+                rgba[mask, 3] = 255
+                return Image.fromarray(rgba, "RGBA")
 
-            self.current_image_pil = edges_rgba
+            # Kernel 3x3: 1 px de margem
+            self.current_image_pil = self.filter_result_to_document(
+                self.process_selection(find_edges, halo=1)
+            )
             self.update_canvas_image()
 
             QMessageBox.information(
@@ -3597,56 +7457,32 @@ class SliceWindow(QWidget):
         try:
             thickness = self.spin_outline_thickness.value()
             feathering = self.spin_outline_feathering.value()
+            placement = self.combo_outline_placement.currentText()
 
-            r = self.outline_color.red()
-            g = self.outline_color.green()
-            b = self.outline_color.blue()
-            a = self.outline_color.alpha()
-
-            w, h = self.current_image_pil.size
-
-            outline_layer = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-
-            if self.current_image_pil.mode == "RGBA":
-                alpha_mask = self.current_image_pil.split()[3]
-            else:
-                alpha_mask = Image.new("L", (w, h), 255)
-
-            from PIL import ImageFilter
+            color = (
+                self.outline_color.red(),
+                self.outline_color.green(),
+                self.outline_color.blue(),
+                self.outline_color.alpha(),
+            )
 
-            expanded_mask = alpha_mask.copy()
-            for _ in range(thickness):
-                expanded_mask = expanded_mask.filter(ImageFilter.MaxFilter(3))
+            # Feathering vira a largura da queda anti-aliased (em px)
+            softness = (feathering / 100.0) * thickness
 
-            if feathering > 0:
-                blur_amount = (feathering / 100.0) * thickness
-                expanded_mask = expanded_mask.filter(
-                    ImageFilter.GaussianBlur(radius=blur_amount)
+            self.current_image_pil = self.filter_result_to_document(
+                self.process_selection(
+                    lambda region: render_outline(
+                        region, color, thickness, placement, softness
+                    ),
+                    halo=int(thickness + softness) + 1,
                 )
-
-            outline_color_layer = Image.new("RGBA", (w, h), (r, g, b, a))
-
-            outline_layer.paste(outline_color_layer, (0, 0), expanded_mask)
-
-            outline_pixels = outline_layer.load()
-            alpha_pixels = alpha_mask.load()
-
-            for y in range(h):
-                for x in range(w):
-                    if alpha_pixels[x, y] > 128:
-                        outline_pixels[x, y] = (0, 0, 0, 0)
-
-            result = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-            result.paste(outline_layer, (0, 0), outline_layer)
-            result.paste(self.current_image_pil, (0, 0), self.current_image_pil)
-
-            self.current_image_pil = result
+            )
             self.update_canvas_image()
 
             QMessageBox.information(
                 self,
                 "Outline Applied",
-                f"Outline de {thickness}px aplicado com sucesso!",
+                f"Outline de {thickness}px ({placement}) aplicado com sucesso!",
             )
 
         except Exception as e:
@@ -3659,29 +7495,23 @@ class SliceWindow(QWidget):
         self.save_state()
 
         try:
+            import numpy as np
+
             distance = self.spin_edge_eraser_distance.value()
             feathering = self.spin_edge_eraser_feathering.value()
+            softness = (feathering / 100.0) * distance
 
-            w, h = self.current_image_pil.size
-
-            if self.current_image_pil.mode == "RGBA":
-                alpha = self.current_image_pil.split()[3]
-            else:
-                self.current_image_pil = self.current_image_pil.convert("RGBA")
-                alpha = self.current_image_pil.split()[3]
-
-            eroded_mask = alpha.copy()
-            for _ in range(distance):
-                eroded_mask = eroded_mask.filter(ImageFilter.MinFilter(3))
-
-            if feathering > 0:
-                blur_amount = (feathering / 100.0) * distance
-                eroded_mask = eroded_mask.filter(
-                    ImageFilter.GaussianBlur(radius=blur_amount)
+            def erase(region):
+                alpha = np.asarray(region)[:, :, 3]
+                region.putalpha(
+                    Image.fromarray(erode_alpha(alpha, distance, softness), "L")
                 )
+                return region
 
-            self.current_image_pil.putalpha(eroded_mask)
-
+            # A margem deixa a distância enxergar as bordas fora da seleção
+            self.current_image_pil = self.filter_result_to_document(
+                self.process_selection(erase, halo=int(distance + softness) + 1)
+            )
             self.update_canvas_image()
 
             QMessageBox.information(
@@ -3708,8 +7538,7 @@ class SliceWindow(QWidget):
 
         w, h = self.current_image_pil.size
         if 0 <= x < w and 0 <= y < h:
-            pixel = self.current_image_pil.getpixel((x, y))
-            r, g, b = pixel[:3]
+            r, g, b = self.get_pixel_rgba(x, y)[:3]
 
             hex_color = f"#{r:02x}{g:02x}{b:02x}"
             self.line_hex_color.setText(hex_color)
@@ -3797,8 +7626,278 @@ class SliceWindow(QWidget):
 
         self.update_canvas_image()
 
+    def to_document_mode(self, image):
+        """
+        Converte a imagem para o modo do documento (RGBA ou indexado). Só
+        roda em pontos explícitos: abrir arquivo, ligar/desligar o modo.
+        """
+        if self.indexed_mode:
+            if image.mode == "P":
+                return image
+            return rgba_to_indexed(image, self.document_palette)
+
+        if image.mode != "RGBA":
+            return image.convert("RGBA")
+        return image
+
+    def set_indexed_mode(self, checked):
+        """Marca o modo indexado sem disparar a conversão do toggle"""
+        self.indexed_mode = checked
+        self.chk_indexed_mode.blockSignals(True)
+        self.chk_indexed_mode.setChecked(checked)
+        self.chk_indexed_mode.blockSignals(False)
+
+    def sync_indexed_mode(self):
+        """Undo/redo: o modo do documento segue o modo da imagem restaurada"""
+        image = self.current_image_pil
+        indexed = image is not None and image.mode == "P"
+        if indexed != self.indexed_mode:
+            self.set_indexed_mode(indexed)
+
+    def filter_result_to_document(self, image):
+        """
+        Resultado RGBA de um filtro no modo do documento. No modo indexado,
+        se as cores cabem na paleta o resultado é indexado sem perda; senão
+        o usuário escolhe entre requantizar para a paleta atual ou voltar o
+        documento para RGBA (nada é encaixado na paleta em silêncio).
+        """
+        if not self.indexed_mode or image.mode == "P":
+            return image
+
+        if palette_fits(image, self.document_palette):
+            return rgba_to_indexed(image, self.document_palette)
+
+        reply = QMessageBox.question(
+            self,
+            "Indexed Mode",
+            "O resultado tem cores que não cabem na paleta do documento.\n\n"
+            "Yes: requantizar (cores fora da paleta vão para a mais próxima).\n"
+            "No: manter as cores e voltar o documento para RGBA.",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            return rgba_to_indexed(image, self.document_palette)
+
+        self.set_indexed_mode(False)
+        if self.original_image_pil:
+            self.original_image_pil = self.original_image_pil.convert("RGBA")
+        return image
+
+    def toggle_indexed_mode(self, checked):
+        """Liga/desliga o modo de cor indexada do documento"""
+        self.indexed_mode = checked
+
+        if not self.current_image_pil:
+            self.update_palette_info()
+            return
+
+        self.save_state()
+
+        try:
+            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+            too_many = self.current_image_pil.convert("RGBA").getcolors(256) is None
+            self.current_image_pil = self.to_document_mode(self.current_image_pil)
+            self.document_palette = None
+            self.original_image_pil = self.to_document_mode(self.original_image_pil)
+            self.update_canvas_image()
+            QApplication.restoreOverrideCursor()
+
+            if checked and too_many:
+                QMessageBox.information(
+                    self,
+                    "Indexed Mode",
+                    "A imagem tem mais de 256 cores e foi quantizada para a paleta.",
+                )
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Error", f"Erro ao converter imagem: {str(e)}")
+
+    def update_palette_info(self):
+        """Mostra tamanho da paleta e memória do documento"""
+        img = self.current_image_pil
+        if not img or img.mode != "P":
+            self.lbl_palette_info.setText("")
+            return
+
+        w, h = img.size
+        colors = len(image_palette(img))
+        self.lbl_palette_info.setText(
+            f"{colors} cores na paleta\n"
+            f"Buffer: {w * h / 1024:.0f} KB (RGBA seria {w * h * 4 / 1024:.0f} KB)"
+        )
+
+    def palette_index_for(self, rgba):
+        """Índice da cor na paleta do documento, adicionando a cor se couber"""
+        import numpy as np
+
+        if rgba[3] == 0:
+            return 0
+
+        palette = image_palette(self.current_image_pil)
+        color = np.array(rgba, np.uint8)
+
+        matches = np.nonzero((palette == color).all(axis=1))[0]
+        if len(matches):
+            return int(matches[0])
+
+        if len(palette) < 256:
+            palette = np.vstack([palette, color[None, :]])
+            self.current_image_pil.putpalette(palette.tobytes(), rawmode="RGBA")
+            return len(palette) - 1
+
+        return int(nearest_palette_indices(color[None, :], palette)[0])
+
+    def palette_swap_images(self):
+        """Imagens afetadas pelo palette swap conforme o escopo escolhido"""
+        if self.combo_palette_scope.currentIndex() == 1:
+            return list(self.sliced_images)
+        return [self.current_image_pil] if self.current_image_pil else []
+
+    def extract_source_palette(self):
+        """Extrai a paleta source das imagens do escopo atual"""
+        import time
+
+        images = self.palette_swap_images()
+        if not images:
+            QMessageBox.warning(self, "Aviso", "Nenhuma imagem para extrair a paleta!")
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        start = time.perf_counter()
+        palette = extract_palette(images, self.spin_palette_colors.value())
+        elapsed = (time.perf_counter() - start) * 1000
+        QApplication.restoreOverrideCursor()
+
+        if len(palette) == 0:
+            QMessageBox.warning(self, "Aviso", "Nenhum pixel opaco encontrado!")
+            return
+
+        self.source_palette = palette
+        self.target_palette = palette.copy()
+        self.update_palette_swatches()
+
+        QMessageBox.information(
+            self,
+            "Extract Palette",
+            f"Paleta de {len(palette)} cores extraída de {len(images)} "
+            f"imagem(ns) em {elapsed:.0f} ms.",
+        )
+
+    def load_target_palette(self):
+        """Carrega a paleta alvo de uma imagem (strip de paleta ou sprite)"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Select Palette Image", "", "Images (*.png *.bmp *.gif)"
+        )
+        if not file_path:
+            return
+
+        try:
+            palette = palette_from_image(Image.open(file_path))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Erro ao carregar paleta: {str(e)}")
+            return
+
+        if len(palette) == 0:
+            QMessageBox.warning(self, "Aviso", "A imagem não tem cores opacas!")
+            return
+
+        self.target_palette = palette
+        self.update_palette_swatches()
+
+    def edit_target_palette_color(self, event):
+        """Edita a cor da paleta alvo clicada no swatch"""
+        if self.target_palette is None or len(self.target_palette) == 0:
+            return
+
+        cell = self.lbl_target_palette.width() / len(self.target_palette)
+        index = min(int(event.position().x() / cell), len(self.target_palette) - 1)
+        r, g, b = (int(c) for c in self.target_palette[index])
+
+        color = QColorDialog.getColor(QColor(r, g, b), self, "Escolher Cor da Paleta")
+        if color.isValid():
+            self.target_palette[index] = (color.red(), color.green(), color.blue())
+            self.update_palette_swatches()
+
+    @staticmethod
+    def palette_swatch_pixmap(palette, width=160, height=14):
+        """Faixa de swatches da paleta para exibir no painel"""
+        import numpy as np
+
+        if palette is None or len(palette) == 0:
+            return QPixmap()
+
+        columns = (np.arange(width) * len(palette)) // width
+        strip = np.repeat(palette[columns][None, :, :], height, axis=0)
+        rgba = np.dstack([strip, np.full(strip.shape[:2], 255, np.uint8)])
+        return QPixmap.fromImage(
+            SliceWindow.pil_to_qimage(Image.fromarray(np.ascontiguousarray(rgba)))
+        )
+
+    def update_palette_swatches(self):
+        self.lbl_source_palette.setPixmap(self.palette_swatch_pixmap(self.source_palette))
+        self.lbl_target_palette.setPixmap(self.palette_swatch_pixmap(self.target_palette))
+
+    def apply_palette_swap(self):
+        """Remapeia as cores source -> target na imagem ou em todos os sprites"""
+        import time
+
+        if self.source_palette is None or self.target_palette is None:
+            QMessageBox.warning(self, "Aviso", "Extraia a paleta source primeiro!")
+            return
+
+        images = self.palette_swap_images()
+        if not images:
+            QMessageBox.warning(self, "Aviso", "Nenhuma imagem para aplicar!")
+            return
+
+        batch = self.combo_palette_scope.currentIndex() == 1
+
+        try:
+            QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+            start = time.perf_counter()
+            swapped = swap_palette(images, self.source_palette, self.target_palette)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            if batch:
+                self.replace_sliced_images(swapped)
+            else:
+                self.save_state()
+                self.current_image_pil = swapped[0]
+                self.update_canvas_image()
+
+            QApplication.restoreOverrideCursor()
+
+            pixels = sum(img.width * img.height for img in images)
+            QMessageBox.information(
+                self,
+                "Palette Swap",
+                f"Paleta trocada em {len(images)} imagem(ns) "
+                f"({pixels / 1e6:.2f} MP) em {elapsed:.0f} ms.",
+            )
+        except Exception as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.critical(self, "Error", f"Erro no palette swap: {str(e)}")
+
+    def get_pixel_rgba(self, x, y):
+        """Cor RGBA de um pixel, resolvendo a paleta no modo indexado"""
+        pixel = self.current_image_pil.getpixel((x, y))
+        if self.current_image_pil.mode == "P":
+            return tuple(int(c) for c in image_palette(self.current_image_pil)[pixel])
+        return pixel
+
     def update_canvas_image(self):
+        # Qualquer mudança visível no documento invalida jobs em andamento
+        self.document_generation += 1
+        self.clear_preview()
+
         if self.current_image_pil:
+            self.document_palette = (
+                image_palette(self.current_image_pil)
+                if self.current_image_pil.mode == "P"
+                else None
+            )
+            self.update_palette_info()
+
             qim = self.pil_to_qimage(self.current_image_pil)
             pix = QPixmap.fromImage(qim)
             self.pixmap_item.setPixmap(pix)
@@ -3914,6 +8013,7 @@ class SliceWindow(QWidget):
         self.view.scale(scale, scale)
 
         self.view.zoom_factor = scale
+        self.on_view_scrolled()
 
     def cut_image(self):
         if not self.current_image_pil:
@@ -3923,45 +8023,158 @@ class SliceWindow(QWidget):
         start_y = self.spin_y.value()
         cols = self.spin_cols.value()
         rows = self.spin_rows.value()
-        size = self.cell_size
+        cell_w, cell_h = self.spin_cell_w.value(), self.spin_cell_h.value()
+        spacing_x, spacing_y = self.spin_spacing_x.value(), self.spin_spacing_y.value()
+
+        # Células vazias/fora da imagem saem da máscara sem recortar nada
+        mask = grid_cell_mask(
+            self.current_image_pil,
+            start_x,
+            start_y,
+            (cell_w, cell_h),
+            rows,
+            cols,
+            skip_empty=not self.chk_empty.isChecked(),
+            spacing=(spacing_x, spacing_y),
+        )
 
-        for c in range(cols):
-            for r in range(rows):
-                x = start_x + (c * size)
-                y = start_y + (r * size)
+        # Ordem de sempre: coluna por coluna
+        sprites = []
+        rects = []
+        for c, r in zip(*mask.T.nonzero()):
+            x = start_x + int(c) * (cell_w + spacing_x)
+            y = start_y + int(r) * (cell_h + spacing_y)
+            sprites.append(self.current_image_pil.crop((x, y, x + cell_w, y + cell_h)))
+            rects.append((x, y, cell_w, cell_h))
 
-                if (
-                    x + size > self.current_image_pil.width
-                    or y + size > self.current_image_pil.height
-                ):
-                    continue
+        duplicates = self.add_sliced_sprites(sprites, rects)
+
+        if self.list_widget.count() > 0:
+            self.btn_export.setEnabled(True)
 
-                box = (x, y, x + size, y + size)
-                sprite = self.current_image_pil.crop(box)
+        if duplicates:
+            QMessageBox.information(
+                self,
+                "Duplicates",
+                f"{len(sprites) - duplicates} sprites únicos adicionados.\n"
+                f"{duplicates} duplicata(s) removida(s).",
+            )
 
-                if not self.chk_empty.isChecked():
-                    if not sprite.getbbox():
-                        continue
+    def auto_slice_image(self):
+        """Recorta os sprites encontrados por componentes conexos do alpha"""
+        if not self.current_image_pil:
+            return
 
-                self.add_sprite_to_list(sprite)
+        image = self.current_image_pil
+        rects, labels, ids = detect_sprites(
+            image, self.spin_merge_distance.value(), self.spin_min_area.value()
+        )
+        if not rects:
+            QMessageBox.warning(self, "Auto Slice", "Nenhum sprite encontrado!")
+            return
 
-        if self.list_widget.count() > 0:
-            self.btn_export.setEnabled(True)
+        sprites = [
+            crop_sprite(image, rect, labels, label) for rect, label in zip(rects, ids)
+        ]
+        duplicates = self.add_sliced_sprites(sprites, rects)
+        self.btn_export.setEnabled(True)
 
-    def add_sprite_to_list(self, pil_image):
-        self.sliced_images.append(pil_image)
+        message = f"{len(sprites)} sprites encontrados."
+        if duplicates:
+            message += f"\n{duplicates} duplicata(s) removida(s)."
+        QMessageBox.information(self, "Auto Slice", message)
 
-        qim = self.pil_to_qimage(pil_image)
-        pix = QPixmap.fromImage(qim)
+    def add_sliced_sprites(self, sprites, rects):
+        """
+        Adiciona os sprites recortados registrando cada célula no mapa de
+        referências. Com Remove Duplicates, cópias (de sprites novos ou já
+        na lista) viram só uma referência. Retorna quantas foram removidas.
+        """
+        if not self.chk_dedupe.isChecked():
+            start = len(self.sliced_images)
+            self.sprite_references.extend(
+                {"rect": rect, "sprite": start + i, "transform": "identity"}
+                for i, rect in enumerate(rects)
+            )
+            self.add_sprites_to_list(sprites, rects)
+            return 0
+
+        index = SpriteIndex(self.chk_dedupe_variants.isChecked())
+        for position, sprite in enumerate(self.sliced_images):
+            index.add(sprite, position)
+
+        unique, unique_rects = [], []
+        for sprite, rect in zip(sprites, rects):
+            found = index.find(sprite)
+            if found is None:
+                position = len(self.sliced_images) + len(unique)
+                index.add(sprite, position)
+                unique.append(sprite)
+                unique_rects.append(rect)
+                found = (position, "identity")
+
+            position, transform = found
+            self.sprite_references.append(
+                {"rect": rect, "sprite": position, "transform": transform}
+            )
+
+        self.add_sprites_to_list(unique, unique_rects)
+        return len(sprites) - len(unique)
+
+    def add_sprite_to_list(self, pil_image, rect=None):
+        self.add_sprites_to_list([pil_image], [rect])
+
+    def add_sprites_to_list(self, images, rects=None):
+        """
+        Adiciona vários sprites com um único repaint/scroll da lista.
+        rects guarda o retângulo (x, y, w, h) de origem de cada sprite.
+        """
+        if not images:
+            return
 
-        icon = QIcon(pix)
-        item = QListWidgetItem(icon, "")
-        item.setSizeHint(QSize(40, 40))
-        self.list_widget.addItem(item)
+        rects = rects or [None] * len(images)
+        self.list_widget.setUpdatesEnabled(False)
+        try:
+            for pil_image, rect in zip(images, rects):
+                self.sliced_images.append(pil_image)
+                self.sliced_rects.append(rect)
+
+                qim = self.pil_to_qimage(pil_image)
+                pix = QPixmap.fromImage(qim)
+
+                icon = QIcon(pix)
+                item = QListWidgetItem(icon, "")
+                item.setSizeHint(QSize(40, 40))
+                if rect:
+                    x, y, w, h = rect
+                    item.setToolTip(f"x: {x}, y: {y} ({w}x{h})")
+                self.list_widget.addItem(item)
+        finally:
+            self.list_widget.setUpdatesEnabled(True)
         self.list_widget.scrollToBottom()
 
+    def replace_sliced_images(self, images, expected=None):
+        """
+        Troca os sprites da lista mantendo os itens (e a ordem). Com
+        expected (os sprites de quando o processamento começou), não mexe
+        em nada e retorna False se a lista mudou nesse meio tempo.
+        """
+        if expected is not None and (
+            len(expected) != len(self.sliced_images)
+            or any(a is not b for a, b in zip(expected, self.sliced_images))
+        ):
+            return False
+
+        self.sliced_images[:] = images
+        for i, sprite in enumerate(images):
+            pix = QPixmap.fromImage(self.pil_to_qimage(sprite))
+            self.list_widget.item(i).setIcon(QIcon(pix))
+        return True
+
     def clear_list(self):
         self.sliced_images.clear()
+        self.sliced_rects.clear()
+        self.sprite_references.clear()
         self.list_widget.clear()
         self.btn_export.setEnabled(False)
         self.btn_import.setEnabled(False)        
@@ -4003,20 +8216,72 @@ class SliceWindow(QWidget):
         if not ok or not prefix:
             prefix = "sprite"
 
-        try:
-            for idx, sprite in enumerate(self.sliced_images):
-                filename = f"{prefix}_{idx:04d}.png"
-                filepath = f"{output_dir}/{filename}"
-                sprite.save(filepath, "PNG")
-
-            QMessageBox.information(
-                self,
-                "Export Complete",
-                f"{len(self.sliced_images)} sprites exported successfully!",
+        # Cópias de quando a exportação começou: a lista pode ser editada
+        # enquanto o job roda
+        images = list(self.sliced_images)
+        references = [dict(reference) for reference in self.sprite_references]
+        compression = self.combo_export_compression.currentText()
+
+        def work(progress, cancelled):
+            return export_sprite_files(
+                images,
+                output_dir,
+                prefix,
+                compression,
+                progress=progress,
+                cancelled=cancelled,
             )
 
-        except Exception as e:
-            QMessageBox.critical(self, "Export Error", f"Failed to export:\n{str(e)}")
+        def on_result(filenames):
+            message = f"{len(filenames)} sprites exported successfully!"
+            try:
+                if self.export_reference_map(
+                    output_dir, prefix, filenames, references
+                ):
+                    message += f"\nMapa de duplicatas: {prefix}_map.json"
+            except OSError as e:
+                QMessageBox.critical(
+                    self, "Export Error", f"Failed to export map:\n{str(e)}"
+                )
+                return
+
+            QMessageBox.information(self, "Export Complete", message)
+
+        if self.start_background_job(
+            "Export",
+            f"Exportando {len(images)} sprites ({compression})...",
+            work,
+            on_result,
+            on_done=lambda: self.btn_export.setEnabled(bool(self.sliced_images)),
+        ):
+            self.btn_export.setEnabled(False)
+
+    def export_reference_map(self, output_dir, prefix, filenames, references):
+        """
+        Grava {prefix}_map.json com a célula de origem de cada referência
+        (arquivo do sprite único + transformação), se houver duplicatas
+        removidas. Retorna True se gravou.
+        """
+        import json
+        import os
+
+        deduplicated = len(references) > len(filenames) or any(
+            reference["transform"] != "identity" for reference in references
+        )
+        if not deduplicated:
+            return False
+
+        cells = [
+            {
+                "rect": list(reference["rect"]),
+                "sprite": filenames[reference["sprite"]],
+                "transform": reference["transform"],
+            }
+            for reference in references
+        ]
+        with open(os.path.join(output_dir, f"{prefix}_map.json"), "w") as f:
+            json.dump({"sprites": filenames, "cells": cells}, f, indent=2)
+        return True
 
     @staticmethod
     def pil_to_qimage(pil_image):
@@ -4064,8 +8329,11 @@ class SliceWindow(QWidget):
                 file_path = file_path + ".png"
                 fmt = "PNG"
 
-            # Salva a imagem atual
-            self.current_image_pil.save(file_path, fmt)
+            # Salva a imagem atual (JPEG não tem alpha nem paleta)
+            image = self.current_image_pil
+            if fmt == "JPEG":
+                image = image.convert("RGB")
+            image.save(file_path, fmt)
             QMessageBox.information(
                 self, "Export", f"Projeto exportado em:\n{file_path}"
             )
@@ -4080,12 +8348,14 @@ class SliceWindow(QWidget):
         self.spin_rotate_fine.blockSignals(True)
         self.spin_rotate_fine.setValue(value)
         self.spin_rotate_fine.blockSignals(False)
+        self.schedule_preview("rotate")
 
     def on_rotate_fine_spin_change(self, value):
         """Sincroniza o slider com o spin box"""
         self.slider_rotate_fine.blockSignals(True)
         self.slider_rotate_fine.setValue(value)
         self.slider_rotate_fine.blockSignals(False)
+        self.schedule_preview("rotate")
 
     def apply_rotate_fine(self):
         """Aplica a rotação fina"""
@@ -4096,6 +8366,7 @@ class SliceWindow(QWidget):
         active_layer = self.get_active_layer()
         is_main_selected = not active_layer or active_layer.name == "Main"
         
+        self.clear_preview()
         self.save_state()
         angle = self.spin_rotate_fine.value()
         
@@ -4151,6 +8422,9 @@ class SliceWindow(QWidget):
         self.slider_rotate_fine.blockSignals(False)
         self.spin_rotate_fine.blockSignals(False)
 
+        if self.preview_kind == "rotate":
+            self.clear_preview()
+
 
 
 if __name__ == "__main__":